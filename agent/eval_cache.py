@@ -0,0 +1,106 @@
+import contextlib
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+
+from agent.mask import Mask
+
+
+# ——————————————————————————— 评估结果缓存 ———————————————————————————
+# 以 (原图字节, mask 字节, 视觉概念 prompt) 的内容哈希为键，
+# 命中时直接返回上次的评分，避免重复调用 VLM。
+class EvaluationCache:
+    """
+    两级缓存：
+        - 内存：OrderedDict 实现的 LRU，最多 max_items 条
+        - 磁盘（可选）：cache_dir/<key>.json，跨进程/跨批次复用
+    """
+
+    def __init__(self, max_items: int = 256, cache_dir: Optional[str] = None):
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._lru: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest_array(arr) -> str:
+        """数组内容哈希（包含形状与 dtype，避免不同形状同字节的碰撞）；Mask 直接哈希打包后的数据"""
+        if isinstance(arr, Mask):
+            return arr.digest()
+        arr = np.ascontiguousarray(np.asarray(arr))
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{arr.shape}|{arr.dtype}".encode())
+        h.update(memoryview(arr).cast("B"))
+        return h.hexdigest()
+
+    @staticmethod
+    def make_key(img_digest: str, mask_digest: str, prompt: str) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        for part in (img_digest, mask_digest, prompt):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self._lru[key])
+
+        if self.cache_dir and os.path.exists(self._disk_path(key)):
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                value = json.load(f)
+            self._put_memory(key, value)
+            with self._lock:
+                self.hits += 1
+            return copy.deepcopy(value)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value) -> None:
+        value = copy.deepcopy(value)
+        self._put_memory(key, value)
+
+        if self.cache_dir:
+            # 先写临时文件再原子替换，避免并发读到半截文件；
+            # 每次写入用 mkstemp 生成独立的临时文件，同进程多线程写同一个 key 也不会互相覆盖
+            try:
+                fd, tmp = tempfile.mkstemp(prefix=f"{key}.", suffix=".tmp", dir=self.cache_dir)
+            except OSError:
+                return
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(value, f, ensure_ascii=False)
+                os.replace(tmp, self._disk_path(key))
+            except OSError:
+                # 只是缓存：落盘失败不影响评估结果，内存中仍保留这一条
+                with contextlib.suppress(OSError):
+                    os.remove(tmp)
+
+    def _put_memory(self, key: str, value) -> None:
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._lru)}
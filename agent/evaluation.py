@@ -1,9 +1,14 @@
-import json, re
 import cv2
 import numpy as np
-from transformers import AutoProcessor, AutoModelForImageTextToText
+from transformers import AutoProcessor, AutoModelForImageTextToText, StoppingCriteriaList
 import streamlit as st
 
+from agent.eval_cache import EvaluationCache
+from agent.mask import Mask
+from agent.prompts import soft_evaluation_overlay_prompt
+from agent.structured import SOFT_EVAL_SCHEMA, JsonObjectStoppingCriteria, parse_json_output
+from serving.batching import MicroBatcher
+
 
 @st.cache_resource
 def load_model(model_name: str):
@@ -16,14 +21,143 @@ def load_model(model_name: str):
     return processor, model
 
 
-class evaluate:
+class HardGate:
+    """
+    分级评估的门控：hard 指标明显不合格时跳过 VLM 的 soft 评估。
+    只有未被判定为“明显失败”的 mask 才会进入昂贵的 soft 评估。
+    """
+
+    def __init__(self, min_coverage=0.01, max_coverage=0.95, min_hard_score=0.3):
+        self.min_coverage = min_coverage
+        self.max_coverage = max_coverage
+        self.min_hard_score = min_hard_score
+
+    def check(self, hard_score, coverage):
+        """返回拦截原因；None 表示需要继续做 soft 评估"""
+        if coverage < self.min_coverage:
+            return f"coverage {coverage:.4f} < {self.min_coverage}, target is almost missing"
+        if coverage > self.max_coverage:
+            return f"coverage {coverage:.4f} > {self.max_coverage}, mask is almost the whole image"
+        if hard_score < self.min_hard_score:
+            return f"hard score {hard_score:.4f} < {self.min_hard_score}, mask is clearly broken"
+        return None
+
+
+class EvalInputPolicy:
+    """
+    soft 评估的输入策略：控制送入 VLM 的分辨率与 mask 的呈现方式。
+        max_side: 长边上限（像素），None 表示保持原分辨率
+        align_to_grid: 宽高对齐到视觉编码器的 patch 网格（patch_size × merge_size）
+        mask_render: "mask"    原图 + 3 通道 mask 两张图（与原 prompt 一致）
+                     "overlay" mask 以半透明红色叠加在原图上，只送一张图
+                     "contour" mask 轮廓线画在原图上，只送一张图
+    """
+
+    MASK_RENDERS = ("mask", "overlay", "contour")
+
+    def __init__(self, max_side=None, align_to_grid=True, mask_render="mask"):
+        if mask_render not in self.MASK_RENDERS:
+            raise ValueError(f"unknown mask_render: {mask_render}, expected one of {self.MASK_RENDERS}")
+        self.max_side = max_side
+        self.align_to_grid = align_to_grid
+        self.mask_render = mask_render
+
+    def tag(self):
+        """参与评估缓存键，不同策略的评分互不复用"""
+        return f"{self.max_side}|{self.align_to_grid}|{self.mask_render}"
+
+    def to_dict(self):
+        return {"max_side": self.max_side, "align_to_grid": self.align_to_grid, "mask_render": self.mask_render}
+
+    def select_prompt(self, prompt):
+        return prompt if self.mask_render == "mask" else soft_evaluation_overlay_prompt
+
+    @staticmethod
+    def grid_factor(processor):
+        ip = getattr(processor, "image_processor", None)
+        return getattr(ip, "patch_size", 14) * getattr(ip, "merge_size", 2)
+
+    def target_size(self, h, w, factor):
+        scale = 1.0
+        if self.max_side:
+            scale = min(1.0, self.max_side / max(h, w))
+        nh, nw = h * scale, w * scale
+        if self.align_to_grid:
+            limit = max(self.max_side or max(h, w), factor)
+            nh = max(factor, int(round(nh / factor)) * factor)
+            nw = max(factor, int(round(nw / factor)) * factor)
+            # 四舍五入后不超过长边上限
+            while max(nh, nw) > limit:
+                if nh >= nw:
+                    nh -= factor
+                else:
+                    nw -= factor
+        return int(nh), int(nw)
+
+    def render(self, img, mask, processor):
+        """返回送入 VLM 的图像列表"""
+        img = np.asarray(img)
+        mask = np.asarray(mask)
+        if mask.ndim == 3:
+            mask = mask[..., 0]
+
+        h, w = img.shape[:2]
+        nh, nw = self.target_size(h, w, self.grid_factor(processor))
+        if (nh, nw) != (h, w):
+            img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_AREA)
+            mask = cv2.resize(mask, (nw, nh), interpolation=cv2.INTER_NEAREST)
+
+        fg = mask > 0
+        if self.mask_render == "mask":
+            return [img, np.stack([(fg * 255).astype(np.uint8)] * 3, axis=-1)]
+
+        canvas = img.copy()
+        if self.mask_render == "overlay":
+            red = np.array([255, 0, 0], dtype=np.float32)
+            canvas[fg] = (0.5 * canvas[fg] + 0.5 * red).astype(np.uint8)
+        else:
+            contours, _ = cv2.findContours(fg.astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+            thickness = max(1, round(max(nh, nw) / 400))
+            cv2.drawContours(canvas, contours, -1, (0, 255, 0), thickness)
+        return [canvas]
 
-    def __init__(self):
-        self.model_name = "/home/kexin/hd1/zkf/Qwen3-VL-4bit"
-        self.processor, self.model = load_model(self.model_name)
 
+class evaluate:
 
-    def hard_evaluate(self, mask):
+    def __init__(self, cache: EvaluationCache = None, gate: HardGate = None,
+                 max_batch: int = 1, max_wait: float = 0.01,
+                 input_policy: EvalInputPolicy = None):
+        self.model_name = "/home/kexin/hd1/zkf/Qwen3-VL-4bit"
+        self.processor, self.model = self._load_model()
+
+        # 评估结果缓存（None 表示不缓存）
+        self.cache = cache
+        # 分级评估门控（None 表示每次都做 soft 评估）
+        self.gate = gate
+        # soft 评估的输入分辨率 / mask 呈现策略（None 表示原图 + mask 全分辨率）
+        self.input_policy = input_policy
+        # VLM 调用计数：实际调用 / 被门控跳过
+        self.vlm_calls = 0
+        self.vlm_skipped = 0
+        # 同一作业内原图不变，记住上一张原图的哈希，避免每轮重复计算。
+        # (原图, 哈希) 作为一个元组整体替换，多个会话 / 工作线程并发评估时
+        # 读到的总是配对的原图与哈希
+        self._img_memo = (None, None)
+
+        # soft 评估微批处理：max_batch > 1 时，并发到达的请求在 max_wait 秒内合并成一批
+        self._batcher = None
+        if max_batch > 1:
+            self._batcher = MicroBatcher(self.soft_evaluate_batch, max_batch=max_batch,
+                                         max_wait=max_wait, name="soft-evaluate")
+
+
+    def _load_model(self):
+        """加载 VLM；远程评估等子类可覆盖为不加载"""
+        return load_model(self.model_name)
+
+
+    @staticmethod
+    def hard_evaluate(mask, min_coverage=0.01, max_coverage=0.95):
         """
         对二值/近似二值的分割 mask 进行启发式质量评估（hard rule）。
         主要从三个方面衡量：
@@ -31,17 +165,23 @@ class evaluate:
         2. 连通性（connectivity）：前景是否主要集中在一个连通区域
         3. 平滑度（smoothness）：边缘是否过于破碎
 
+        所有指标共用同一个二值缓冲区，连通域面积由 connectedComponentsWithStats
+        一次性给出，复杂度与连通域数量无关。
+        覆盖率超出 [min_coverage, max_coverage] 视为不合理（开启门控时取门控的上下限）。
+
         返回：
-            score (float): 综合评分，范围大致在 [0, 1]
-            msg (str): 评估状态说明
+            score (float): 综合评分，范围大致在 [0, 1]；覆盖率不合理时为 0
+            coverage, connectivity, smoothness (float): 各项指标
         """
 
         # -----------------------------
         # 1. 基本统计信息
         # -----------------------------
+        mask = np.asarray(mask)     # Mask 在这里解码一次
         h, w = mask.shape           # mask 的高和宽
         area = h * w                # 整幅图像的像素总数
-        fg = np.sum(mask > 0)       # 前景像素数量（mask > 0 视为前景）
+        binary = (mask > 0).astype(np.uint8)
+        fg = int(np.count_nonzero(binary))  # 前景像素数量（mask > 0 视为前景）
 
         # -----------------------------
         # 2. 覆盖率约束（Coverage）
@@ -49,25 +189,17 @@ class evaluate:
         coverage = fg / area        # 前景占整图的比例
 
         # 如果前景过少（几乎没有目标）
-        # 或前景过多（几乎全是目标），直接判为不合理
-        if coverage < 0.01 or coverage > 0.95:
-            return 0.0, "bad coverage"
+        # 或前景过多（几乎全是目标），直接判为不合理（综合评分记 0，其余指标照常给出）
+        bad_coverage = coverage < min_coverage or coverage > max_coverage
 
         # -----------------------------
         # 3. 连通性评估（Connectivity）
         # -----------------------------
-        # 对前景区域做连通域分析
-        # num_labels: 连通域数量（包含背景）
-        # labels: 每个像素所属的连通域编号
-        binary = (mask > 0).astype("uint8")
-        num_labels, labels = cv2.connectedComponents(binary)
-
-        # 计算最大前景连通域的像素数量
-        # 从 1 开始是为了跳过背景（背景通常是 0）
-        largest = max(
-            [np.sum(labels == i) for i in range(1, num_labels)],
-            default=0
-        )
+        # 对前景区域做连通域分析，stats 中直接给出每个连通域的面积
+        # 第 0 行是背景，跳过
+        num_labels, _, stats, _ = cv2.connectedComponentsWithStats(binary)
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        largest = int(areas.max()) if num_labels > 1 else 0
 
         # 连通性定义为：最大连通域 / 前景像素总数
         # 越接近 1，说明前景越集中、不碎片化
@@ -81,7 +213,7 @@ class evaluate:
 
         # 边缘像素占比越小，说明边界越平滑
         # 这里用 1 - 边缘占比 作为平滑度指标
-        smoothness = 1.0 - np.sum(edges > 0) / area
+        smoothness = 1.0 - np.count_nonzero(edges) / area
 
         # -----------------------------
         # 5. 综合评分（加权求和）
@@ -91,13 +223,17 @@ class evaluate:
             0.4 * connectivity +    # 连通性权重
             0.2 * smoothness        # 平滑度权重
         )
+        if bad_coverage:
+            score = 0.0
 
         return score, coverage, connectivity, smoothness
 
 
-    def soft_evaluate(self, img, mask, prompt):
-
+    @staticmethod
+    def _to_rgb_mask(mask):
         # 统一 mask 为 3 通道
+        if isinstance(mask, Mask):
+            mask = mask.to_array()
         if isinstance(mask, np.ndarray):
             if mask.ndim == 2:
                 mask = np.stack([mask]*3, axis=-1)
@@ -106,30 +242,58 @@ class evaluate:
         else:
             if mask.mode != "RGB":
                 mask = mask.convert("RGB")
+        return mask
 
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "image", "image": img},
-                    {"type": "image", "image": mask},
-                    {"type": "text", "text": prompt},
-                ],
-            }
-        ]
+
+    def soft_evaluate_batch(self, items, input_policy=None):
+        """
+        一次 generate 处理多个 (img, mask, prompt)，左侧 padding 对齐。
+        input_policy 为 None 时使用 self.input_policy。
+        返回与 items 等长的列表，元素为 (coverage_score, coverage_reason, semantic_score, semantic_reason)；
+        单项解析失败时对应位置为 ValueError 实例。
+        """
+        policy = input_policy if input_policy is not None else self.input_policy
+        conversations = []
+        for img, mask, prompt in items:
+            if policy is not None:
+                images = policy.render(img, mask, self.processor)
+            else:
+                images = [img, self._to_rgb_mask(mask)]
+            conversations.append([
+                {
+                    "role": "user",
+                    "content": [{"type": "image", "image": im} for im in images]
+                               + [{"type": "text", "text": prompt}],
+                }
+            ])
 
         # Preparation for inference
+        # 批量生成需要左侧 padding；按调用传入，不修改共享 tokenizer 的全局设置
         inputs = self.processor.apply_chat_template(
-            messages,
+            conversations if len(conversations) > 1 else conversations[0],
             tokenize=True,
             add_generation_prompt=True,
             return_dict=True,
-            return_tensors="pt"
+            return_tensors="pt",
+            padding=True,
+            padding_side="left"
         )
         inputs = inputs.to(self.model.device)
 
         # Inference: Generation of the output
-        generated_ids = self.model.generate(**inputs, max_new_tokens=1280)
+        # JSON 对象闭合即停止，避免在固定小 schema 上浪费解码步数
+        stopping = StoppingCriteriaList([
+            JsonObjectStoppingCriteria(
+                self.processor.tokenizer,
+                prompt_len=inputs.input_ids.shape[1],
+                max_answer_tokens=SOFT_EVAL_SCHEMA.max_new_tokens
+            )
+        ])
+        generated_ids = self.model.generate(
+            **inputs,
+            max_new_tokens=SOFT_EVAL_SCHEMA.max_new_tokens,
+            stopping_criteria=stopping
+        )
         generated_ids_trimmed = [
             out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
         ]
@@ -138,28 +302,139 @@ class evaluate:
             generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
         )
 
-        text = output_text[0] if isinstance(output_text, list) else output_text
-        result = json.loads(text)
+        outputs = []
+        for text in output_text:
+            try:
+                result = parse_json_output(text, SOFT_EVAL_SCHEMA)
+            except ValueError as e:
+                outputs.append(e)
+                continue
+            outputs.append((result["coverage_score"], result["coverage_reason"], result["semantic_score"], result["semantic_reason"]))
+        return outputs
 
-        coverage_score, coverage_reason, semantic_score, semantic_reason = result["coverage_score"], result["coverage_reason"], result["semantic_score"], result["semantic_reason"]
 
-        return coverage_score, coverage_reason, semantic_score, semantic_reason
+    def soft_evaluate(self, img, mask, prompt):
+        # 开启微批处理时交给攒批队列，与其他并发作业合并成一次 generate
+        if self._batcher is not None:
+            return self._batcher((img, mask, prompt))
+
+        out = self.soft_evaluate_batch([(img, mask, prompt)])[0]
+        if isinstance(out, Exception):
+            raise out
+        return out
+
+
+    def _image_digest(self, img):
+        memo_img, digest = self._img_memo
+        if memo_img is not img:
+            digest = EvaluationCache.digest_array(img)
+            self._img_memo = (img, digest)
+        return digest
+
+
+    @staticmethod
+    def _cache_key(img_digest, mask, prompt):
+        return EvaluationCache.make_key(img_digest, EvaluationCache.digest_array(mask), prompt)
+
+
+    def soft_evaluate_many(self, items):
+        """
+        多个 (img, mask, prompt) 的 soft 评估：开启微批处理时并发提交给攒批队列，
+        否则直接一次 batched generate。单项失败时抛出异常。
+        """
+        if len(items) == 1:
+            return [self.soft_evaluate(*items[0])]
+        if self._batcher is not None:
+            futures = [self._batcher.submit(item) for item in items]
+            return [f.result() for f in futures]
+
+        outputs = self.soft_evaluate_batch(items)
+        for out in outputs:
+            if isinstance(out, Exception):
+                raise out
+        return outputs
 
 
     def run(self, img, mask, prompt, visual_concept):
-        hard_score, coverage, connectivity, smoothness = self.hard_evaluate(mask)
+        return self.run_batch(img, [mask], prompt, visual_concept)[0]
+
 
+    def run_batch(self, img, masks, prompt, visual_concept):
+        """
+        同一原图的多个候选 mask 一起评估：缓存 / hard 指标 / 门控逐个处理，
+        需要 VLM 的候选合并成一次 soft 评估。返回与 masks 等长的
+        [(result, coverage_reason, semantic_reason), ...]。
+        """
+        if self.input_policy is not None:
+            prompt = self.input_policy.select_prompt(prompt)
         prompt_rag = prompt.format(visual_concept)
-        coverage_score, coverage_reason, semantic_score, semantic_reason = self.soft_evaluate(img, mask, prompt_rag)
-        soft_score = 0.5 * coverage_score + 0.5 * semantic_score
-
-        total_score = round(0.4 * hard_score + 0.6 * soft_score, 4)
-
-        return {
-            "score": total_score,
-            "hard_score": round(hard_score, 4),
-            "soft_score": round(soft_score, 4),
-            "coverage": round(coverage, 4),
-            "connectivity": round(connectivity, 4),
-            "smoothness": round(smoothness, 4)
-        }, coverage_reason, semantic_reason
\ No newline at end of file
+        policy_tag = self.input_policy.tag() if self.input_policy is not None else ""
+
+        outputs = [None] * len(masks)
+        keys = [None] * len(masks)
+        pending = []            # [(下标, hard_score, hard 指标)]
+        duplicates = {}         # 同一批内内容相同的 mask 只评估一次：下标 → 首次出现的下标
+        first_seen = {}
+        img_digest = self._image_digest(img) if self.cache is not None else None
+        # 覆盖率的合理区间与门控保持一致，HardGate 的上下限才会真正生效
+        coverage_bounds = (self.gate.min_coverage, self.gate.max_coverage) if self.gate is not None else ()
+
+        for i, mask in enumerate(masks):
+            # 相同的 (原图, mask, prompt) 直接返回上次的评分
+            if self.cache is not None:
+                keys[i] = self._cache_key(img_digest, mask, prompt_rag + policy_tag)
+                if keys[i] in first_seen:
+                    duplicates[i] = first_seen[keys[i]]
+                    continue
+                first_seen[keys[i]] = i
+                cached = self.cache.get(keys[i])
+                if cached is not None:
+                    outputs[i] = tuple(cached)
+                    continue
+
+            hard_score, coverage, connectivity, smoothness = self.hard_evaluate(mask, *coverage_bounds)
+            metrics = {
+                "hard_score": round(hard_score, 4),
+                "coverage": round(coverage, 4),
+                "connectivity": round(connectivity, 4),
+                "smoothness": round(smoothness, 4)
+            }
+
+            # 明显失败的 mask 不调用 VLM，直接合成结果交给路由器（soft 分记 0）
+            reason = self.gate.check(hard_score, coverage) if self.gate is not None else None
+            if reason is not None:
+                self.vlm_skipped += 1
+                outputs[i] = ({
+                    "score": round(0.4 * hard_score, 4),
+                    "soft_score": 0.0,
+                    "gated": True,
+                    **metrics
+                }, f"[hard gate] {reason}", "[hard gate] soft evaluation skipped")
+                continue
+
+            pending.append((i, hard_score, metrics))
+
+        if pending:
+            self.vlm_calls += len(pending)
+            softs = self.soft_evaluate_many([(img, masks[i], prompt_rag) for i, _, _ in pending])
+            for (i, hard_score, metrics), soft in zip(pending, softs):
+                coverage_score, coverage_reason, semantic_score, semantic_reason = soft
+                soft_score = 0.5 * coverage_score + 0.5 * semantic_score
+
+                total_score = round(0.4 * hard_score + 0.6 * soft_score, 4)
+
+                outputs[i] = ({
+                    "score": total_score,
+                    "hard_score": metrics["hard_score"],
+                    "soft_score": round(soft_score, 4),
+                    "coverage": metrics["coverage"],
+                    "connectivity": metrics["connectivity"],
+                    "smoothness": metrics["smoothness"]
+                }, coverage_reason, semantic_reason)
+
+                if keys[i] is not None:
+                    self.cache.put(keys[i], list(outputs[i]))
+
+        for i, j in duplicates.items():
+            outputs[i] = outputs[j]
+        return outputs
@@ -0,0 +1,121 @@
+import hashlib
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+# 每个字节中 1 的个数，面积统计直接在打包后的字节上完成（numpy >= 2.0 用 bitwise_count）
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def _popcount(bits: np.ndarray) -> int:
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(bits).sum(dtype=np.int64))
+    return int(np.bincount(bits.ravel(), minlength=256) @ _POPCOUNT)
+
+
+# ——————————————————————————— 紧凑 mask ———————————————————————————
+# 分割结果在管线中长期保存（记忆器、历史最优、扇出候选、UI 历史），
+# 以每像素 1 bit 按行打包存储，只有交给工具 / 模型时才还原为 uint8 数组。
+class Mask:
+    """
+    按行 bit-packed 的二值 mask（前景为 mask > 0）。
+
+    - 面积、外接框直接在打包数据上计算，连通域只解码外接框内的区域
+    - np.asarray(mask) / to_array() 还原为 H×W uint8，前景取原数组的前景值（通常为 255）
+    - 同内容的 mask 的 digest() 相同，可直接作为缓存键
+    """
+
+    __slots__ = ("shape", "value", "_bits")
+
+    ndim = 2
+    dtype = np.dtype(np.uint8)
+
+    def __init__(self, shape: Tuple[int, int], bits: np.ndarray, value: int = 255):
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.value = int(value)
+        self._bits = bits
+
+    @staticmethod
+    def from_array(arr) -> "Mask":
+        """由 H×W（或 H×W×C，取第一个通道）数组构造；已经是 Mask 时原样返回"""
+        if isinstance(arr, Mask):
+            return arr
+        arr = np.asarray(arr)
+        if arr.ndim == 3:
+            arr = arr[..., 0]
+        if arr.ndim != 2:
+            raise ValueError(f"mask must be 2-D, got shape {arr.shape}")
+        fg = arr > 0
+        value = 255
+        if np.issubdtype(arr.dtype, np.integer) and fg.any():
+            # 0/1 与 0/255 的 mask 都原样还原；布尔、浮点 mask 还原为 0/255
+            value = min(int(arr.max()), 255)
+        return Mask(arr.shape, np.packbits(fg, axis=1), value)
+
+    def to_array(self) -> np.ndarray:
+        h, w = self.shape
+        out = np.unpackbits(self._bits, axis=1, count=w)
+        if self.value != 1:
+            out *= np.uint8(self.value)
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self.to_array()
+        return arr if dtype is None else arr.astype(dtype, copy=False)
+
+    def __repr__(self):
+        return f"Mask(shape={self.shape}, area={self.area}, nbytes={self.nbytes})"
+
+    @property
+    def nbytes(self) -> int:
+        return self._bits.nbytes
+
+    @property
+    def bits(self) -> np.ndarray:
+        return self._bits
+
+    @property
+    def area(self) -> int:
+        return _popcount(self._bits)
+
+    @property
+    def coverage(self) -> float:
+        h, w = self.shape
+        return self.area / (h * w)
+
+    @property
+    def bbox(self) -> Optional[Tuple[int, int, int, int]]:
+        """前景外接框 (x0, y0, x1, y1)，右下角不含；空 mask 返回 None"""
+        rows = np.flatnonzero(self._bits.any(axis=1))
+        if rows.size == 0:
+            return None
+        y0, y1 = int(rows[0]), int(rows[-1]) + 1
+        col_bits = np.bitwise_or.reduce(self._bits[y0:y1], axis=0)
+        cols = np.flatnonzero(np.unpackbits(col_bits, count=self.shape[1]))
+        return int(cols[0]), y0, int(cols[-1]) + 1, y1
+
+    def crop(self, bbox: Tuple[int, int, int, int]) -> np.ndarray:
+        """只解码 bbox 范围内的行，返回该区域的 0/1 uint8 数组"""
+        x0, y0, x1, y1 = bbox
+        return np.unpackbits(self._bits[y0:y1], axis=1, count=self.shape[1])[:, x0:x1]
+
+    def components(self, connectivity: int = 8) -> np.ndarray:
+        """各连通域的面积（不含背景），只在外接框内做连通域分析"""
+        bbox = self.bbox
+        if bbox is None:
+            return np.zeros(0, dtype=np.int64)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(self.crop(bbox), connectivity=connectivity)
+        return stats[1:, cv2.CC_STAT_AREA].astype(np.int64)
+
+    def digest(self) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"mask|{self.shape}|{self.value}".encode())
+        h.update(memoryview(np.ascontiguousarray(self._bits)).cast("B"))
+        return h.hexdigest()
+
+
+def dense(value):
+    """工具与模型需要普通数组：Mask 还原为 uint8，其余原样返回"""
+    return value.to_array() if isinstance(value, Mask) else value
@@ -1,32 +1,133 @@
 import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
 import numpy as np
 
+from agent.eval_cache import EvaluationCache
+from agent.mask import Mask
+from tools.base import TOOL_REGISTRY
+
+
+# ——————————————————————————— 单步记录 ———————————————————————————
+# 每一轮的工具调用记录：参数规范化为可 JSON 化的值，
+# 数组按工具声明换成 IMG / MASK 占位符（未声明的记录形状与内容哈希），
+# mask 本身只保留内容哈希，不随记忆与策略库复制。
+@dataclass(slots=True)
+class Step:
+    round: int
+    tool: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    metrics: Dict[str, Any] = field(default_factory=dict)
+    elapsed: float = 0.0                # 本步工具调用自身的耗时（秒），评估耗时见作业的 timings
+    mask: Optional[str] = None          # mask 内容哈希
+    candidate: bool = False             # 扇出轮中未被采用的候选（不属于最终策略路径）
+
+    @property
+    def score(self) -> Optional[float]:
+        return self.metrics.get("score")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """紧凑的字典形式：省略空参数 / 空指标 / 未知耗时与 mask"""
+        d: Dict[str, Any] = {"round": self.round, "tool": self.tool}
+        if self.params:
+            d["params"] = self.params
+        if self.metrics:
+            d["metrics"] = self.metrics
+        if self.elapsed:
+            d["elapsed"] = self.elapsed
+        if self.mask is not None:
+            d["mask"] = self.mask
+        if self.candidate:
+            d["candidate"] = True
+        return d
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> "Step":
+        return Step(
+            round=int(d.get("round", 0)),
+            tool=d["tool"],
+            params=dict(d.get("params") or {}),
+            metrics=dict(d.get("metrics") or {}),
+            elapsed=float(d.get("elapsed", 0.0)),
+            mask=d.get("mask"),
+            candidate=bool(d.get("candidate", False)),
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+
+def _placeholder(tool: str, name: str) -> Optional[str]:
+    spec = TOOL_REGISTRY.get(tool)
+    if spec is None:
+        return None
+    return spec.params.get(name, {}).get("placeholder")
+
+
+def normalize_params(tool: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """把工具参数转成可 JSON 化、可比较的形式"""
+    out = {}
+    for name in sorted(params):
+        value = params[name]
+        if isinstance(value, (np.ndarray, Mask)):
+            value = _placeholder(tool, name) or {
+                "ndarray": EvaluationCache.digest_array(value),
+                "shape": list(value.shape),
+                "dtype": str(value.dtype),
+            }
+        elif isinstance(value, np.generic):
+            value = value.item()
+        elif isinstance(value, tuple):
+            value = list(value)
+        elif not isinstance(value, (str, int, float, bool, list, dict, type(None))):
+            value = str(value)
+        out[name] = value
+    return out
+
+
+def normalize_metrics(result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not result:
+        return {}
+    return {k: (v.item() if isinstance(v, np.generic) else v) for k, v in result.items()}
+
 
 # ——————————————————————————— 记忆器设计 ———————————————————————————
 # 用于保存每一轮的操作、工具、参数、评分、mask 等关键信息，
 # 让 LLM 在后续决策时“知道自己之前干了什么”
 class Memory:
     def __init__(self):
-        self.steps = []
-
-    def _sanitize(self, obj):
-        """把不可 JSON 化的对象转成可读字符串"""
-        if isinstance(obj, dict):
-            return {k: self._sanitize(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [self._sanitize(v) for v in obj]
-        elif isinstance(obj, np.ndarray):
-            return f"<ndarray shape={obj.shape} dtype={obj.dtype}>"
-        elif hasattr(obj, "__dict__"):
-            return str(obj)
-        else:
-            return obj
-
-    def add_step(self, info: dict):
-        clean_info = self._sanitize(info)
-        self.steps.append(clean_info)
-
-    def summary(self, max_steps=5):
-        recent = self.steps[-max_steps:]
-        print(recent)
-        return json.dumps(recent, ensure_ascii=False, indent=2)
\ No newline at end of file
+        self.steps: List[Step] = []
+        # 每步的紧凑 JSON 在写入时序列化一次，summary 只做拼接
+        self._encoded: List[str] = []
+
+    def add_step(self, step: Step) -> Step:
+        self.steps.append(step)
+        self._encoded.append(step.to_json())
+        return step
+
+    def record(self, round_idx: int, tool: str, params: Dict[str, Any], result: Optional[Dict[str, Any]] = None,
+               mask: Optional[np.ndarray] = None, elapsed: float = 0.0, candidate: bool = False) -> Step:
+        """由一次工具调用的原始参数 / 评估结果 / mask 构造并记录一步"""
+        return self.add_step(Step(
+            round=round_idx,
+            tool=tool,
+            params=normalize_params(tool, params or {}),
+            metrics=normalize_metrics(result),
+            elapsed=round(float(elapsed), 4),
+            mask=EvaluationCache.digest_array(mask) if mask is not None else None,
+            candidate=candidate,
+        ))
+
+    def summary(self, max_steps=5) -> str:
+        return "[" + ",".join(self._encoded[-max_steps:]) + "]"
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        return [s.to_dict() for s in self.steps]
+
+    @staticmethod
+    def from_records(records: List[Dict[str, Any]]) -> "Memory":
+        memory = Memory()
+        for r in records:
+            memory.add_step(Step.from_dict(r))
+        return memory
@@ -0,0 +1,687 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from agent.evaluation import evaluate, HardGate, EvalInputPolicy
+from agent.eval_cache import EvaluationCache
+from agent.mask import Mask, dense
+from agent.planner import Planner, DEFAULT_THINKING_BUDGET
+from agent.prompts import task_understanding_prompt, router_prompt_rag, soft_evaluation_prompt
+from agent.memory import Memory
+from agent.replay import StrategyReplayer
+from agent.router import RuleRouter, FanOutProposer
+from agent.structured import TASK_SCHEMA, ROUTER_SCHEMA, parse_json_output
+
+from tools.base import TOOL_REGISTRY
+
+from rag.vision_rag import VisionRAG
+from rag.strategy_writer import StrategyWriter, summarize_strategy
+
+
+MAX_RETRY = 3
+RAG_WRITE_THRESHOLD = 0.8
+
+VISUAL_DB_PATH = "/home/kexin/hd1/zkf/VisionManus/rag/visual_concepts.jsonl"
+STRATEGY_DB_PATH = "/home/kexin/hd1/zkf/VisionManus/rag/strategy_cases.jsonl"
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+
+
+# ——————————————————————————— 任务定义 ———————————————————————————
+@dataclass
+class Job:
+    """
+    一个待处理的 (图像, 任务描述) 作业。
+    image 可以是文件路径、PIL.Image 或 numpy 数组。
+    """
+    job_id: str
+    image: Any
+    prompt: str
+
+    def load_image(self) -> np.ndarray:
+        if isinstance(self.image, np.ndarray):
+            return self.image
+        if isinstance(self.image, Image.Image):
+            return np.array(self.image.convert("RGB"))
+        return np.array(Image.open(self.image).convert("RGB"))
+
+
+@dataclass
+class JobResult:
+    job_id: str
+    prompt: str
+    status: str = ""                      # Pass | Terminate | max_retry | error
+    user_goal: str = ""
+    task_object: str = ""
+    rounds: int = 0
+    best_score: float = -1.0
+    final_result: Optional[Dict[str, Any]] = None
+    final_mask: Optional[Mask] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    tokens: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    llm_calls_saved: int = 0              # 规则路由省下的 LLM 路由调用次数
+    replayed: bool = False                # 是否由历史策略回放直接通过
+    error: Optional[str] = None
+
+    @staticmethod
+    def failed(job: Job, error: Exception, t0: float) -> "JobResult":
+        """单个作业失败时的结果记录"""
+        result = JobResult(job_id=job.job_id, prompt=job.prompt, status="error",
+                           error=f"{type(error).__name__}: {error}")
+        result.timings["total"] = time.perf_counter() - t0
+        return result
+
+    def add_tokens(self, stage: str, usage: Dict[str, Any]) -> None:
+        """累加 Planner.last_usage 中的思考 / 回答 token 数"""
+        acc = self.tokens.setdefault(stage, {"calls": 0, "thinking_tokens": 0, "answer_tokens": 0})
+        acc["calls"] += 1
+        acc["thinking_tokens"] += usage.get("thinking_tokens", 0)
+        acc["answer_tokens"] += usage.get("answer_tokens", 0)
+
+    def to_record(self) -> Dict[str, Any]:
+        """可 JSON 化的结果记录（不含 mask 本身）"""
+        return {
+            "job_id": self.job_id,
+            "prompt": self.prompt,
+            "status": self.status,
+            "user_goal": self.user_goal,
+            "task_object": self.task_object,
+            "rounds": self.rounds,
+            "best_score": self.best_score,
+            "final_result": self.final_result,
+            "timings": {k: round(v, 4) for k, v in self.timings.items()},
+            "tokens": self.tokens,
+            "llm_calls_saved": self.llm_calls_saved,
+            "replayed": self.replayed,
+            "error": self.error,
+        }
+
+
+# 一个作业依次经过的阶段；segment → evaluate → route 按路由结果循环
+STAGES = ("understand", "rag", "segment", "evaluate", "route")
+
+
+@dataclass
+class JobState:
+    """作业在各阶段之间流转的中间状态（原 run_job 主循环中的局部变量）"""
+    job: Job
+    result: JobResult
+    log: Callable[[str, str], None]
+    emit_mask: Callable[[Mask], None]
+    t_start: float
+    memory: Memory = field(default_factory=Memory)
+    enqueued_at: float = 0.0            # 进入当前阶段队列的时间（阶段流水线统计排队用）
+
+    # 任务理解与检索
+    thinking: str = ""
+    img: Optional[np.ndarray] = None
+    rag_visual_context: str = ""
+    rag_hits: List[Dict[str, Any]] = field(default_factory=list)
+    strategy_cases: str = ""
+    strategy_hits: List[Dict[str, Any]] = field(default_factory=list)
+
+    # 迭代优化：当前轮次、待执行的候选 [(工具, 参数)] 与其 mask、各自的工具耗时
+    attempt: int = 1
+    tool: str = ""
+    params: Dict[str, Any] = field(default_factory=dict)
+    candidates: List[Any] = field(default_factory=list)
+    pending: List[Mask] = field(default_factory=list)
+    pending_elapsed: List[float] = field(default_factory=list)
+    replay_steps: Optional[List[Any]] = None
+    replay_executed: Optional[List[Any]] = None
+    mask: Optional[Mask] = None
+    eval_result: Optional[Dict[str, Any]] = None
+
+    # 用于回退：记录历史最优结果
+    best_mask: Optional[Mask] = None
+    best_score: float = -1
+    best_result: Optional[Dict[str, Any]] = None
+
+    def update_best(self) -> None:
+        score_val = float(self.eval_result["score"])
+        if score_val > self.best_score:
+            self.best_score = score_val
+            self.best_mask = self.mask
+            self.best_result = self.eval_result
+
+
+def _unique_job_id(job_id: str, seen: set) -> str:
+    """作业 id 决定 masks/<job_id>.png 的文件名：重复时依次加 -2、-3 … 后缀"""
+    unique, n = job_id, 1
+    while unique in seen:
+        n += 1
+        unique = f"{job_id}-{n}"
+    seen.add(unique)
+    return unique
+
+
+def iter_jobs_from_dir(image_dir: str, prompt: str) -> Iterator[Job]:
+    """遍历目录下的所有图片，使用同一个任务描述；a.png 与 a.jpg 这类同名图片的 id 加序号区分"""
+    seen = set()
+    for name in sorted(os.listdir(image_dir)):
+        if not name.lower().endswith(IMAGE_EXTS):
+            continue
+        yield Job(
+            job_id=_unique_job_id(os.path.splitext(name)[0], seen),
+            image=os.path.join(image_dir, name),
+            prompt=prompt,
+        )
+
+
+def iter_jobs_from_jsonl(manifest_path: str, default_prompt: str = "") -> Iterator[Job]:
+    """
+    从 JSONL 清单读取作业，每行格式：
+        {"image": "path/to/img.png", "prompt": "...", "job_id": "可选"}
+    相对路径以清单所在目录为基准。
+    未指定 job_id 时取文件名（不含扩展名）；不同目录下的同名图片、重复的 job_id 加序号区分。
+    """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    seen = set()
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            d = json.loads(line)
+            image = d["image"]
+            if not os.path.isabs(image):
+                image = os.path.join(base, image)
+            job_id = str(d.get("job_id") or os.path.splitext(os.path.basename(image))[0] or i)
+            yield Job(
+                job_id=_unique_job_id(job_id, seen),
+                image=image,
+                prompt=d.get("prompt") or default_prompt,
+            )
+
+
+# ——————————————————————————— 结果落盘 ———————————————————————————
+class ResultWriter:
+    """
+    流式写出结果：
+        out_dir/results.jsonl       每个作业一行
+        out_dir/masks/<job_id>.png  最终 mask
+    """
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.mask_dir = os.path.join(out_dir, "masks")
+        os.makedirs(self.mask_dir, exist_ok=True)
+        self.results_path = os.path.join(out_dir, "results.jsonl")
+
+    def write(self, result: JobResult) -> None:
+        record = result.to_record()
+        if result.final_mask is not None:
+            mask_path = os.path.join(self.mask_dir, f"{result.job_id}.png")
+            Image.fromarray(np.asarray(result.final_mask, dtype=np.uint8)).save(mask_path)
+            record["mask_path"] = mask_path
+
+        # 每条结果立即 flush，中途中断也不会丢失已完成的作业
+        with open(self.results_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+
+
+class _Timer:
+    """把每个阶段的耗时累加到 timings 字典中"""
+
+    def __init__(self, timings: Dict[str, float], stage: str):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings[self.stage] = self.timings.get(self.stage, 0.0) + time.perf_counter() - self.t0
+        return False
+
+
+# ——————————————————————————— 主流程引擎 ———————————————————————————
+class VisionManusPipeline:
+    """
+    与 UI 解耦的 分割 → 评估 → 路由 主循环。
+    Streamlit 前端与批处理脚本共用这一个引擎，通过 on_log / on_mask 回调获取中间过程。
+    """
+
+    def __init__(
+            self,
+            rag: Optional[VisionRAG] = None,
+            planner: Optional[Planner] = None,
+            evaluator: Optional[evaluate] = None,
+            segmenter: Optional[Any] = None,
+            writer: Optional[StrategyWriter] = None,
+            max_retry: int = MAX_RETRY,
+            rag_write_threshold: float = RAG_WRITE_THRESHOLD,
+            eval_cache_dir: Optional[str] = None,
+            understand_thinking: str = "no_think",
+            route_thinking: str = "budget",
+            thinking_budget: int = DEFAULT_THINKING_BUDGET,
+            fast_router: Optional[RuleRouter] = None,
+            rule_routing: bool = True,
+            server_url: Optional[str] = None,
+            eval_max_batch: int = 1,
+            eval_max_wait: float = 0.01,
+            gate: Optional[HardGate] = None,
+            hard_gating: bool = True,
+            eval_max_side: Optional[int] = None,
+            eval_mask_render: str = "mask",
+            rag_retriever: str = "tfidf",
+            replayer: Optional[StrategyReplayer] = None,
+            strategy_replay: bool = True,
+            fanout: int = 1,
+            patch_workers: int = 1
+        ):
+        self.rag = rag or VisionRAG(
+            visual_db_path=VISUAL_DB_PATH,
+            strategy_db_path=STRATEGY_DB_PATH,
+            retriever=rag_retriever
+        )
+
+        # soft 评估默认送原图 + mask（与未引入输入策略前一致）；
+        # 指定长边上限或其他 mask 呈现方式时才启用 EvalInputPolicy
+        input_policy = None
+        if eval_max_side or eval_mask_render != "mask":
+            input_policy = EvalInputPolicy(max_side=eval_max_side, mask_render=eval_mask_render)
+
+        # hard 指标门控（hard_gating=False 时每个 mask 都做 soft 评估）
+        gate = (gate or HardGate()) if hard_gating else None
+
+        if server_url:
+            # 模型由常驻服务托管，本进程只持有客户端
+            from serving.client import ModelClient, RemotePlanner, RemoteEvaluator, RemoteSegmenter
+            client = ModelClient(server_url)
+            self.planner = planner or RemotePlanner(client)
+            self.evaluator = evaluator or RemoteEvaluator(
+                client,
+                cache=EvaluationCache(cache_dir=eval_cache_dir),
+                gate=gate,
+                input_policy=input_policy
+            )
+            self.segmenter = segmenter or RemoteSegmenter(client)
+        else:
+            self.planner = planner or Planner()
+            self.evaluator = evaluator or evaluate(
+                cache=EvaluationCache(cache_dir=eval_cache_dir),
+                gate=gate,
+                max_batch=eval_max_batch,
+                max_wait=eval_max_wait,
+                input_policy=input_policy
+            )
+            if segmenter is None:
+                from agent.segment import segmenter_iSeg
+                # patch_workers > 1 的线程安全前提见 segmenter_iSeg
+                segmenter = segmenter_iSeg(patch_workers=patch_workers)
+            self.segmenter = segmenter
+
+        # 分块 / ROI 分割与主分割共用同一个分割器（本地或远程），其余工具来自 TOOL_REGISTRY
+        self.tools = dict(TOOL_REGISTRY)
+        self.tools["split_image_patches"] = self.segmenter.patch_segment
+        self.tools["zoom_in_roi"] = self.segmenter.roi_segment
+
+        self.writer = writer or StrategyWriter()
+        self.max_retry = max_retry
+        self.rag_write_threshold = rag_write_threshold
+
+        # 任务理解与路由默认走低成本的思考模式
+        self.understand_thinking = understand_thinking
+        self.route_thinking = route_thinking
+        self.thinking_budget = thinking_budget
+
+        # 规则快速路由（rule_routing=False 时每轮都调用 LLM）
+        # 最后一轮的规则终止以入库阈值为界，与 finish_job 的写入条件一致
+        self.fast_router = (fast_router or RuleRouter(write_score=rag_write_threshold)) if rule_routing else None
+
+        # 历史策略回放（strategy_replay=False 时总是走路由循环）
+        # 回放的通过线与入库阈值一致，入库的策略以同样的评分重现时即可跳过路由循环
+        self.replayer = (replayer or StrategyReplayer(pass_score=rag_write_threshold)) if strategy_replay else None
+
+        # 扇出轮：每轮并发尝试 fanout 个候选（1 表示每轮只执行路由器选定的工具）
+        self.fanout = FanOutProposer(width=fanout) if fanout > 1 else None
+
+        self._planner_lock = threading.Lock()
+        # 本进程内的 GPU 工具共用一个 iSeg 模型，run_one_image 并发调用的线程安全没有保证：
+        # 扇出候选 / 多个分割工作线程的 GPU 调用经此锁串行，CPU 工具（后处理）仍与之并发。
+        # 远程服务由服务端攒批串行执行，客户端不加锁
+        self._gpu_lock = None if server_url else threading.Lock()
+
+    @staticmethod
+    def _bind_params(params: Dict[str, Any], img: np.ndarray, task_object: str, mask: Mask) -> Dict[str, Any]:
+        """把路由器输出中的 IMG / task_object / MASK 占位符换成实际对象（mask 保持紧凑形式，调用工具时才解码）"""
+        params = dict(params)
+        if params.get("img") == "IMG":
+            params["img"] = img
+        if params.get("class_name") == "task_object":
+            params["class_name"] = task_object
+        if params.get("mask") == "MASK":
+            params["mask"] = mask
+        return params
+
+    def _device_guard(self, tool: str):
+        """需要 GPU 的工具（未声明的工具如主分割按 GPU 处理）返回 GPU 锁，其余返回空上下文"""
+        spec = TOOL_REGISTRY.get(tool)
+        resources = spec.resources if spec is not None else ("cuda",)
+        if self._gpu_lock is not None and "cuda" in resources:
+            return self._gpu_lock
+        return contextlib.nullcontext()
+
+    def _call_tool(self, tool: str, params: Dict[str, Any]) -> Tuple[Mask, float]:
+        """执行一个候选工具；返回 (mask, 该次调用自身的耗时，不含等待 GPU 锁的时间)"""
+        args = {k: dense(v) for k, v in params.items()}
+        with self._device_guard(tool):
+            t0 = time.perf_counter()
+            mask = self.tools[tool](**args)
+            elapsed = time.perf_counter() - t0
+        return Mask.from_array(mask), elapsed
+
+    def run(
+            self,
+            jobs: Iterable[Job],
+            result_writer: Optional[ResultWriter] = None
+        ) -> Iterator[JobResult]:
+        """
+        逐个处理作业并流式返回结果。
+        单个作业失败只记录错误，不中断整个批次。
+        """
+        for job in jobs:
+            t0 = time.perf_counter()
+            try:
+                result = self.run_job(job)
+            except Exception as e:
+                result = JobResult.failed(job, e, t0)
+
+            if result_writer is not None:
+                result_writer.write(result)
+            yield result
+
+    def run_job(
+            self,
+            job: Job,
+            on_log: Optional[Callable[[str, str], None]] = None,
+            on_mask: Optional[Callable[[Mask], None]] = None
+        ) -> JobResult:
+        """按 理解 → 检索 → (分割 → 评估 → 路由)* 的顺序在当前线程中跑完一个作业"""
+        state = self.start_job(job, on_log, on_mask)
+        stage = STAGES[0]
+        while stage is not None:
+            stage = self.step(stage, state)
+        return self.finish_job(state)
+
+    # ——————————————————————————— 分阶段执行 ———————————————————————————
+    # 每个阶段只推进 JobState 并返回下一个阶段名（None 表示结束），
+    # run_job 顺序执行；agent.stage_runner.StagedRunner 让不同作业的阶段并发重叠。
+    def start_job(
+            self,
+            job: Job,
+            on_log: Optional[Callable[[str, str], None]] = None,
+            on_mask: Optional[Callable[[Mask], None]] = None
+        ) -> JobState:
+        return JobState(
+            job=job,
+            result=JobResult(job_id=job.job_id, prompt=job.prompt),
+            log=on_log or (lambda role, msg: None),
+            emit_mask=on_mask or (lambda m: None),
+            t_start=time.perf_counter(),
+        )
+
+    def step(self, stage: str, state: JobState) -> Optional[str]:
+        return getattr(self, f"_{stage}")(state)
+
+    def _understand(self, state: JobState) -> str:
+        result_out = state.result
+
+        # 使用 LLM 解析用户意图：返回思考过程和结构化任务
+        # 理解与路由共用同一个 Planner，加锁保证 last_usage 与本次调用对应
+        with self._planner_lock, _Timer(result_out.timings, "understand"):
+            state.thinking, task = self.planner.run(
+                task_understanding_prompt, state.job.prompt, schema=TASK_SCHEMA,
+                thinking=self.understand_thinking, thinking_budget=self.thinking_budget
+            )
+            result_out.add_tokens("understand", self.planner.last_usage)
+        content = parse_json_output(task, TASK_SCHEMA)
+        result_out.user_goal, result_out.task_object = content["user_goal"], content["task_object"]
+        return "rag"
+
+    def _rag(self, state: JobState) -> str:
+        log = state.log
+        task_object = state.result.task_object
+
+        # —— RAG：视觉概念检索（任务对象视觉知识增强）——
+        with _Timer(state.result.timings, "rag"):
+            state.rag_visual_context, state.rag_hits = self.rag.retrieve_visual_concept(task_object, top_k=2)
+            state.strategy_cases, state.strategy_hits = self.rag.retrieve_strategy_cases(task_object)
+
+        log("sys", f"RAG hits: {state.rag_hits}")
+        log("sys", f"Strategy hits: {state.strategy_hits}")
+        log("sys", f"思考: {state.thinking}")
+        log("sys", f"用户目标: {state.result.user_goal}, 任务对象: {task_object}")
+        log("sys", f"RAG 视觉先验:\n{state.rag_visual_context}")
+        log("sys", f"调用 iSeg-Plus 分割模型，最大尝试次数 {self.max_retry} 次")
+
+        # 获取输入图像
+        state.img = state.job.load_image()
+
+        # —— 策略回放：命中可信的历史策略时，第一轮直接执行其工具路径 ——
+        if self.replayer is not None:
+            state.replay_steps = self.replayer.select(state.strategy_hits, task_object)
+        return "segment"
+
+    def _segment(self, state: JobState) -> str:
+        log = state.log
+        timings = state.result.timings
+        img, task_object = state.img, state.result.task_object
+
+        if state.replay_steps is not None:
+            steps, state.replay_steps = state.replay_steps, None
+            log("sys", f"回放历史策略: {' -> '.join(t for t, _ in steps)}")
+            try:
+                with _Timer(timings, "replay"), self._device_guard("iSeg-Plus"):
+                    replay_mask, executed = self.replayer.run(
+                        steps, img, task_object, self.segmenter, self.tools
+                    )
+                state.replay_executed = [(t, p, Mask.from_array(m), e) for t, p, m, e in executed]
+                state.emit_mask(state.replay_executed[-1][2])
+                return "evaluate"
+            except Exception as e:
+                # 历史参数与当前工具不兼容等情况：放弃回放，走正常流程
+                log("sys", f"策略回放失败（{type(e).__name__}: {e}），回到路由循环")
+
+        log("sys", f"进行第 {state.attempt} 轮操作")
+        with _Timer(timings, "segment"):
+            if state.attempt == 1:
+                # 第一轮：直接分割
+                state.candidates = [("iSeg-Plus", {"class_name": task_object})]
+                with self._device_guard("iSeg-Plus"):
+                    t0 = time.perf_counter()
+                    mask = self.segmenter.segment(task_object, img)
+                    outputs = [(Mask.from_array(mask), time.perf_counter() - t0)]
+            elif len(state.candidates) > 1:
+                # 扇出：多个候选并发提交，各自计时；本地 GPU 工具由 _device_guard 串行，
+                # 远程服务则由服务端把并发请求攒成批
+                with ThreadPoolExecutor(max_workers=len(state.candidates)) as pool:
+                    outputs = list(pool.map(lambda c: self._call_tool(*c), state.candidates))
+            else:
+                # 非第一轮：使用工具微调
+                outputs = [self._call_tool(*state.candidates[0])]
+        state.pending = [m for m, _ in outputs]
+        state.pending_elapsed = [e for _, e in outputs]
+
+        if len(state.pending) == 1:
+            state.emit_mask(state.pending[0])
+        return "evaluate"
+
+    def _evaluate(self, state: JobState) -> Optional[str]:
+        if state.replay_executed is not None:
+            return self._evaluate_replay(state)
+
+        log = state.log
+        memory = state.memory
+        candidates, masks, elapsed = state.candidates, state.pending, state.pending_elapsed
+
+        # 对当前 mask 进行质量评估（扇出时一次批量评估全部候选）
+        with _Timer(state.result.timings, "evaluate"):
+            if len(masks) == 1:
+                outputs = [self.evaluator.run(state.img, masks[0], soft_evaluation_prompt, state.rag_visual_context)]
+            else:
+                outputs = self.evaluator.run_batch(state.img, masks, soft_evaluation_prompt, state.rag_visual_context)
+        state.pending, state.pending_elapsed = [], []
+
+        best = max(range(len(masks)), key=lambda i: float(outputs[i][0]["score"]))
+        if len(masks) > 1:
+            for i, (tool, _) in enumerate(candidates):
+                log("sys", f"候选 {tool}：评分 {outputs[i][0]}")
+            state.emit_mask(masks[best])
+
+        # ⭐ 记录进记忆器；最优候选最后写入，后续路由看到的“上一步”即被采用的结果
+        for i in sorted(range(len(masks)), key=lambda i: i == best):
+            tool, params = candidates[i]
+            memory.record(state.attempt, tool, params, outputs[i][0], mask=masks[i], elapsed=elapsed[i],
+                          candidate=i != best)
+
+        result, coverage_reason, semantic_reason = outputs[best]
+        log("sys", f"评分：{result}")
+        log("sys", f"覆盖率评估：{coverage_reason}")
+        log("sys", f"语义评估：{semantic_reason}")
+
+        state.tool, state.params = candidates[best]
+        state.mask, state.eval_result = masks[best], result
+        state.update_best()
+        return "route"
+
+    def _evaluate_replay(self, state: JobState) -> Optional[str]:
+        log = state.log
+        executed, state.replay_executed = state.replay_executed, None
+        replay_mask = executed[-1][2]
+
+        with _Timer(state.result.timings, "evaluate"):
+            result, coverage_reason, semantic_reason = self.evaluator.run(
+                state.img, replay_mask, soft_evaluation_prompt, state.rag_visual_context
+            )
+        log("sys", f"回放评分：{result}")
+        log("sys", f"覆盖率评估：{coverage_reason}")
+        log("sys", f"语义评估：{semantic_reason}")
+        for i, (t, p, m, elapsed) in enumerate(executed):
+            state.memory.record(state.attempt, t, p, result if i == len(executed) - 1 else None,
+                                mask=m, elapsed=elapsed)
+
+        state.mask, state.eval_result = replay_mask, result
+        state.update_best()
+        if state.best_score >= self.replayer.pass_score and not result.get("gated"):
+            self.replayer.passes += 1
+            state.result.replayed = True
+            state.tool = "Pass"
+            log("sys", "回放结果通过，跳过路由循环。")
+            return None
+
+        # 回放结果作为第一轮，交给路由器继续优化
+        state.tool, state.params = executed[-1][0], executed[-1][1]
+        log("sys", f"回放评分 {state.best_score} 低于 {self.replayer.pass_score}，回到路由循环")
+        return "route"
+
+    def _route(self, state: JobState) -> Optional[str]:
+        log = state.log
+        result_out = state.result
+        result = state.eval_result
+
+        # ---------- 路由器：结合历史记忆做决策 ----------
+        # 先走规则快速路由，明确的情况无需调用 LLM
+        router_answer = None
+        if self.fast_router is not None:
+            router_answer = self.fast_router.decide(result, state.memory, state.attempt, self.max_retry)
+
+        if router_answer is not None:
+            result_out.llm_calls_saved += 1
+            log("sys", f"规则路由: {json.dumps(router_answer, ensure_ascii=False)}")
+        else:
+            router_input = {
+                "current_result": result,
+                "history": state.memory.summary(),
+                "visual_prior": state.rag_visual_context,
+                "historical_strategies": state.strategy_cases
+            }
+
+            with self._planner_lock, _Timer(result_out.timings, "route"):
+                router_thinking, router_text = self.planner.run(
+                    sys_prompt=router_prompt_rag,
+                    user_prompt=json.dumps(router_input, ensure_ascii=False),
+                    schema=ROUTER_SCHEMA,
+                    thinking=self.route_thinking,
+                    thinking_budget=self.thinking_budget
+                )
+                result_out.add_tokens("route", self.planner.last_usage)
+            log("sys", f"思考: {router_thinking}")
+            log("sys", f"下一步: {router_text}")
+
+            # 解析模型输出
+            router_answer = parse_json_output(router_text, ROUTER_SCHEMA)
+
+        state.tool = router_answer["tool"]
+
+        # 如果模型认为流程应该终止
+        if state.tool == "Terminate":
+            log("sys", f"流程中止，原因: {router_answer.get('parameters', {}).get('reason', '无')}")
+            return None
+        if state.tool == "Pass":
+            log("sys", "通过，流程中止。")
+            return None
+
+        # 否则，准备下一步工具调用参数（扇出模式下补充候选）
+        decisions = self.fanout.propose(router_answer, state.memory) if self.fanout is not None else [router_answer]
+        state.candidates = [
+            (d["tool"], self._bind_params(d.get("parameters", {}), state.img, result_out.task_object, state.mask))
+            for d in decisions
+        ]
+        state.tool, state.params = state.candidates[0]
+        if len(state.candidates) > 1:
+            log("sys", f"扇出候选: {[d['tool'] for d in decisions]}")
+
+        state.attempt += 1
+        return "segment" if state.attempt <= self.max_retry else None
+
+    def finish_job(self, state: JobState) -> JobResult:
+        log = state.log
+        result_out = state.result
+        tool, mask, result = state.tool, state.mask, state.eval_result
+
+        # ——————————————————————————— 回退机制 ———————————————————————————
+        if tool == "Terminate" or state.attempt == self.max_retry + 1:
+            log("sys", f"未在 {self.max_retry} 轮内通过，回退到历史最佳结果，评分={state.best_score}")
+            mask = state.best_mask
+            result = state.best_result
+
+        result_out.status = tool if tool in ("Pass", "Terminate") else "max_retry"
+        result_out.rounds = min(state.attempt, self.max_retry)
+        result_out.best_score = float(state.best_score)
+        result_out.final_result = result
+        result_out.final_mask = mask
+
+        log("sys", "流程结束，输出最终 Mask")
+
+        # ——————————————————————————— 写入知识库 ———————————————————————————
+        if state.best_score >= self.rag_write_threshold and tool == "Pass":
+            img = state.img
+            written = self.writer.append({
+                "object": result_out.task_object,
+                "visual_tags": state.rag_hits[0]["tags"] if state.rag_hits else [],
+                "image_meta": {
+                    "resolution": f"{img.shape[1]}x{img.shape[0]}"
+                },
+                "final_score": result,
+                "strategy_summary": summarize_strategy(state.memory),
+                "confidence": float(state.best_score)
+            })
+            if written:
+                log("sys", "RAG：已将成功策略写入知识库")
+            else:
+                log("sys", "RAG：知识库中已有相同路径且置信度不低的策略，跳过写入")
+
+        result_out.timings["total"] = time.perf_counter() - state.t_start
+        return result_out
@@ -1,5 +1,24 @@
+import copy
+
 import streamlit as st
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM, DynamicCache, LogitsProcessor, LogitsProcessorList, StoppingCriteriaList
+
+from agent.structured import JsonSchema, JsonObjectStoppingCriteria
+
+THINK_END_TOKEN_ID = 151668     # </think>
+MAX_THINKING_TOKENS = 1280 * 8
+MAX_ANSWER_TOKENS = 1280
+
+# 思考模式：
+#   no_think  关闭思考，直接输出答案
+#   budget    允许思考，但思考 token 达到预算后强制输出 </think>
+#   full      不限制思考（最多 MAX_THINKING_TOKENS）
+THINK_MODES = ("no_think", "budget", "full")
+DEFAULT_THINKING_BUDGET = 512
+
+USER_TURN_MARKER = "<|im_start|>user"
+MAX_PREFIX_CACHES = 8
 
 
 @st.cache_resource
@@ -14,12 +33,87 @@ def load_model(model_name: str):
     return tokenizer, model
 
 
+class ThinkingBudgetProcessor(LogitsProcessor):
+    """思考 token 数达到 budget 仍未输出 </think> 时，强制下一个 token 为 </think>"""
+
+    def __init__(self, prompt_len: int, budget: int, think_end_id: int = THINK_END_TOKEN_ID):
+        self.prompt_len = prompt_len
+        self.budget = budget
+        self.think_end_id = think_end_id
+        self._ended = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self._ended is None:
+            self._ended = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+        n_generated = input_ids.shape[1] - self.prompt_len
+        if n_generated > 0:
+            self._ended |= input_ids[:, -1] == self.think_end_id
+
+        if n_generated >= self.budget:
+            force = ~self._ended
+            if force.any():
+                scores[force] = float("-inf")
+                scores[force, self.think_end_id] = 0.0
+        return scores
+
+
 class Planner:
-    def __init__(self):
+    def __init__(self, use_prefix_cache=True):
         self.model_name = "/home/kexin/hd1/zkf/Qwen3-4bit"
         self.tokenizer, self.model = load_model(self.model_name)
 
-    def run(self, sys_prompt: str, user_prompt: str):
+        # system prompt 前缀的 KV cache：{前缀文本: (前缀 token, DynamicCache)}
+        # 路由 / 任务理解的 system prompt 固定不变，只需 prefill 一次
+        self.use_prefix_cache = use_prefix_cache
+        self._prefix_caches = {}
+
+        # 最近一次调用与累计的 token 消耗（按思考模式分别统计）
+        self.last_usage = {}
+        self.usage = {mode: {"calls": 0, "thinking_tokens": 0, "answer_tokens": 0} for mode in THINK_MODES}
+
+    def _prefix_cache(self, text, input_ids):
+        """
+        返回 system prompt 部分（第一个 user 轮次之前）KV cache 的副本，
+        generate 只需 prefill 剩余的 user 部分。前缀无法对齐时返回 None。
+        """
+        pos = text.find(USER_TURN_MARKER)
+        if pos <= 0:
+            return None
+        prefix_text = text[:pos]
+
+        entry = self._prefix_caches.get(prefix_text)
+        if entry is None:
+            prefix_ids = self.tokenizer([prefix_text], return_tensors="pt").input_ids.to(self.model.device)
+            with torch.no_grad():
+                cache = self.model(
+                    input_ids=prefix_ids,
+                    past_key_values=DynamicCache(),
+                    use_cache=True
+                ).past_key_values
+            if len(self._prefix_caches) >= MAX_PREFIX_CACHES:
+                self._prefix_caches.pop(next(iter(self._prefix_caches)))
+            entry = (prefix_ids, cache)
+            self._prefix_caches[prefix_text] = entry
+
+        prefix_ids, cache = entry
+        n = prefix_ids.shape[1]
+        if input_ids.shape[1] <= n or not torch.equal(input_ids[0, :n], prefix_ids[0]):
+            return None
+
+        # generate 会原地扩展 cache，必须复制一份
+        return copy.deepcopy(cache)
+
+    def run(self, sys_prompt: str, user_prompt: str, schema: JsonSchema = None,
+            thinking: str = "full", thinking_budget: int = DEFAULT_THINKING_BUDGET):
+        """
+        schema 不为 None 时启用结构化输出：回答部分的 JSON 对象一闭合就停止生成，
+        且回答部分最多 schema.max_new_tokens 个 token。
+        thinking 为思考模式（no_think / budget / full），budget 模式下最多思考 thinking_budget 个 token。
+        """
+        if thinking not in THINK_MODES:
+            raise ValueError(f"unknown thinking mode: {thinking}, expected one of {THINK_MODES}")
+
         messages = [
             {"role": "system", "content": sys_prompt},
             {"role": "user", "content": user_prompt}
@@ -29,21 +123,51 @@ class Planner:
             messages,
             tokenize=False,
             add_generation_prompt=True,
-            enable_thinking=True
+            enable_thinking=thinking != "no_think"
         )
 
         model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
+        prompt_len = model_inputs.input_ids.shape[1]
+
+        answer_tokens = schema.max_new_tokens if schema is not None else MAX_ANSWER_TOKENS
+        if thinking == "no_think":
+            max_new_tokens = answer_tokens
+        elif thinking == "budget":
+            max_new_tokens = thinking_budget + 1 + answer_tokens
+        else:
+            max_new_tokens = MAX_THINKING_TOKENS + answer_tokens
+
+        gen_kwargs = {}
+        if self.use_prefix_cache:
+            past_key_values = self._prefix_cache(text, model_inputs.input_ids)
+            if past_key_values is not None:
+                gen_kwargs["past_key_values"] = past_key_values
+        if thinking == "budget":
+            gen_kwargs["logits_processor"] = LogitsProcessorList([
+                ThinkingBudgetProcessor(prompt_len, thinking_budget)
+            ])
+        if schema is not None:
+            # no_think 模式下 </think> 已包含在模板里，回答从第一个 token 开始
+            gen_kwargs["stopping_criteria"] = StoppingCriteriaList([
+                JsonObjectStoppingCriteria(
+                    self.tokenizer,
+                    prompt_len=prompt_len,
+                    max_answer_tokens=schema.max_new_tokens,
+                    start_token_id=None if thinking == "no_think" else THINK_END_TOKEN_ID
+                )
+            ])
 
         generated_ids = self.model.generate(
             **model_inputs,
-            max_new_tokens=1280*8
+            max_new_tokens=max_new_tokens,
+            **gen_kwargs
         )
 
-        output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
+        output_ids = generated_ids[0][prompt_len:].tolist()
 
         # 找 </think> 的 token（151668）
         try:
-            index = len(output_ids) - output_ids[::-1].index(151668)
+            index = len(output_ids) - output_ids[::-1].index(THINK_END_TOKEN_ID)
         except ValueError:
             index = 0
 
@@ -55,4 +179,15 @@ class Planner:
             output_ids[index:], skip_special_tokens=True
         ).strip("\n")
 
+        self.last_usage = {
+            "mode": thinking,
+            "prompt_tokens": prompt_len,
+            "thinking_tokens": index,
+            "answer_tokens": len(output_ids) - index
+        }
+        usage = self.usage[thinking]
+        usage["calls"] += 1
+        usage["thinking_tokens"] += index
+        usage["answer_tokens"] += len(output_ids) - index
+
         return thinking_content, content
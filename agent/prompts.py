@@ -93,6 +93,55 @@ Return a JSON object in the following format:
 """          
 
 
+# soft evaluation prompt（单张叠加图）
+"""
+与 soft_evaluation_prompt 相同的评估任务，但只输入一张图：
+分割结果以半透明红色区域（overlay）或绿色轮廓线（contour）叠加在原图上。
+"""
+soft_evaluation_overlay_prompt = """
+You are an expert in visual understanding and segmentation evaluation.
+
+You are given:
+- Image 1: the original image with the segmentation result drawn on top of it
+  (highlighted in semi-transparent red, or outlined with green contours)
+
+## Visual Concept
+{}
+
+## Tasks:
+Task 1: Coverage Evaluation  
+Compare the highlighted region with the underlying image.
+Judge whether the highlighted region covers the region that should be covered.
+Focus on:
+- Whether the main target is included
+- Whether large important parts are missing
+- Whether too much background is incorrectly included
+
+Give:
+- coverage_score: a float in [0,1]
+- coverage_reason: a concise explanation
+
+Task 2: Semantic Evaluation  
+Compare the highlighted region with the Visual Concept.
+Judge whether the highlighted region matches the semantic meaning:
+- Object type
+- Shape characteristics
+
+Give:
+- semantic_score: a float in [0,1]
+- semantic_reason: a concise explanation
+
+## Output Format
+Return a JSON object in the following format:
+{{
+  "coverage_score": float,
+  "coverage_reason": string,
+  "semantic_score": float,
+  "semantic_reason": string
+}}
+"""
+
+
 # 路径规划prompt
 """您是视觉Manus系统的决策代理。
 您的职责不是执行视觉算法，也不是编写代码。
@@ -121,6 +170,14 @@ class_name: task_object
 - cols: int
 - overlap: int
 
+zoom_in_roi
+参数：
+class_name: task_object
+- img: IMG
+- mask: MASK
+- margin: float
+- max_rois: int
+
 postprocess_preserve_small
 
 Terminate
@@ -142,6 +199,7 @@ Pass
 - 优先进行全局分割。
 - 当全局分割结果不佳时，使用基于块的分割。
 - 如果之前的块分割结果不理想，可以自由调整块参数（行数、列数、重叠度）。
+- 当全局掩膜已大致定位目标、但目标较小或边界粗糙时，优先使用 ROI 放大重分割，而不是对整图分块。
 - 仅当结构基本正确但需要进一步优化时才进行后处理。
 - 如果仍有改进空间，可以使用不同的参数重试同一工具。
 - 如果结果足够好，则必须通过。
@@ -183,6 +241,15 @@ Available Tools:
     - cols: int
     - overlap: int
 
+- zoom_in_roi
+  Functionality: Crop and upsample the regions around the current mask's components, re-segment them, and paste the results back
+  Parameters:
+    - class_name: task_object
+    - img: IMG
+    - mask: MASK
+    - margin: float (relative padding around each region, default 0.25)
+    - max_rois: int (default 4)
+
 - postprocess_preserve_small
 
 - Terminate
@@ -208,6 +275,7 @@ Strategy Guidelines:
 - Prefer global segmentation first.
 - Use patch-based segmentation when global result is poor.
 - Adjust patch parameters (rows, cols, overlap) freely if previous patch result is unsatisfactory.
+- If the current mask already locates the target but it is small or its boundary is coarse, prefer zoom_in_roi over whole-image patches.
 - Apply post-processing ONLY when structure is mostly correct but needs refinement.
 - You may retry the same tool with different parameters if improvement is still possible.
 - If result is good enough, MUST Pass.
@@ -252,6 +320,15 @@ Available Tools:
     - cols: int
     - overlap: int
 
+- zoom_in_roi
+  Functionality: Crop and upsample the regions around the current mask's components, re-segment them, and paste the results back
+  Parameters:
+    - class_name: task_object
+    - img: IMG
+    - mask: MASK
+    - margin: float (relative padding around each region, default 0.25)
+    - max_rois: int (default 4)
+
 - postprocess_preserve_small
   Functionality: Preserve small targets + Denoising
   Parameters:
@@ -280,6 +357,7 @@ Strategy Guidelines:
 - Prefer global segmentation first.
 - Use patch-based segmentation when global result is poor.
 - Adjust patch parameters (rows, cols, overlap) freely if previous patch result is unsatisfactory.
+- If the current mask already locates the target but it is small or its boundary is coarse, prefer zoom_in_roi over whole-image patches.
 - Apply post-processing ONLY when structure is mostly correct but needs refinement.
 - You may retry the same tool with different parameters if improvement is still possible.
 - If result is good enough, MUST Pass.
@@ -0,0 +1,143 @@
+import ast
+import re
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from agent.mask import dense
+from tools.base import TOOL_REGISTRY
+
+
+# 第一轮的全局分割不在 TOOL_REGISTRY 中，由分割器直接执行
+SEGMENT_TOOL = "iSeg-Plus"
+
+
+def _normalize(name) -> str:
+    return " ".join(str(name or "").split()).lower()
+
+
+_STEP_PATTERN = re.compile(r"^\s*([\w\-]+)\s*(?:\((.*)\))?\s*$", re.S)
+
+
+def parse_strategy_step(step) -> Tuple[str, Dict[str, Any]]:
+    """
+    把策略库中的一步还原为 (工具名, 参数)。
+    兼容旧版策略库的 "tool({...})" 字符串与 Step.to_dict() 形式的 {"tool": ..., "params": ...} 字典。
+    无法解析时抛出 ValueError。
+    """
+    if isinstance(step, Mapping):
+        return step["tool"], dict(step.get("params") or {})
+
+    m = _STEP_PATTERN.match(str(step))
+    if m is None:
+        raise ValueError(f"unrecognized strategy step: {step!r}")
+    tool, args = m.group(1), m.group(2)
+    if not args or not args.strip():
+        return tool, {}
+    try:
+        params = ast.literal_eval(args)
+    except (ValueError, SyntaxError) as e:
+        raise ValueError(f"unparsable parameters in strategy step: {step!r}") from e
+    if not isinstance(params, dict):
+        raise ValueError(f"strategy step parameters are not a dict: {step!r}")
+    return tool, params
+
+
+# ——————————————————————————— 策略回放 ———————————————————————————
+# 检索到高相似度、高置信度的历史策略时，直接按其工具路径执行，
+# 不再逐轮调用 LLM 路由器；回放结果评分不够时才回到正常的路由循环。
+# pass_score 默认与策略库的写入阈值（RAG_WRITE_THRESHOLD）一致：
+# 策略以不低于该阈值的评分入库，回放达到同样的评分即视为通过。
+class StrategyReplayer:
+
+    def __init__(
+            self,
+            min_similarity=0.5,
+            min_confidence=0.8,
+            pass_score=0.8,
+            max_steps=6,
+            registry=TOOL_REGISTRY
+        ):
+        self.min_similarity = min_similarity
+        self.min_confidence = min_confidence
+        self.pass_score = pass_score
+        self.max_steps = max_steps
+        self.registry = registry
+
+        self.attempts = 0
+        self.passes = 0
+
+    def select(self, strategy_hits: List[Dict[str, Any]], task_object: str = "") -> Optional[List[Tuple[str, Dict[str, Any]]]]:
+        """
+        从检索命中中挑出可回放的策略，返回解析后的步骤；没有合适的策略返回 None。
+        策略文本包含整条工具路径，与短查询的 TF-IDF 相似度天然偏低，
+        因此对象名（规范化后）与当前任务对象一致的命中不受 min_similarity 限制。
+        """
+        target = _normalize(task_object)
+        for hit in strategy_hits:
+            same_object = bool(target) and _normalize(hit.get("object")) == target
+            if not same_object and float(hit.get("similarity") or 0.0) < self.min_similarity:
+                continue
+            if float(hit.get("confidence") or 0.0) < self.min_confidence:
+                continue
+            plan = self.plan(hit.get("steps") or hit.get("path") or [])
+            if plan is not None:
+                return plan
+        return None
+
+    def plan(self, path) -> Optional[List[Tuple[str, Dict[str, Any]]]]:
+        if not path or len(path) > self.max_steps:
+            return None
+        steps = []
+        for step in path:
+            try:
+                tool, params = parse_strategy_step(step)
+            except ValueError:
+                return None
+            if tool != SEGMENT_TOOL and tool not in self.registry:
+                return None
+            steps.append((tool, params))
+        # 回放必须从全局分割开始，后续工具才有输入 mask
+        if steps[0][0] != SEGMENT_TOOL:
+            return None
+        return steps
+
+    def bind(self, tool: str, params: Dict[str, Any], img: np.ndarray, task_object: str,
+             mask: Optional[np.ndarray]) -> Dict[str, Any]:
+        """按工具声明的占位符把历史参数换成当前作业的图像 / 任务对象 / mask"""
+        if tool == SEGMENT_TOOL:
+            return {"class_name": task_object}
+
+        runtime = {"IMG": img, "task_object": task_object, "MASK": dense(mask)}
+        bound = {}
+        for name, value in params.items():
+            placeholder = self.registry[tool].params.get(name, {}).get("placeholder")
+            if placeholder in runtime:
+                bound[name] = runtime[placeholder]
+            elif isinstance(value, str) and value in runtime:
+                bound[name] = runtime[value]
+            else:
+                bound[name] = value
+        for name, spec in self.registry[tool].params.items():
+            if name not in bound and spec.get("placeholder") in runtime:
+                bound[name] = runtime[spec["placeholder"]]
+        return bound
+
+    def run(self, steps, img: np.ndarray, task_object: str, segmenter, tools):
+        """依次执行步骤，返回 (最终 mask, 实际执行的 [(工具, 参数, mask, 耗时)])"""
+        self.attempts += 1
+        mask = None
+        executed = []
+        for tool, params in steps:
+            t0 = time.perf_counter()
+            bound = self.bind(tool, params, img, task_object, mask)
+            if tool == SEGMENT_TOOL:
+                mask = segmenter.segment(task_object, img)
+            else:
+                mask = tools[tool](**bound)
+            executed.append((tool, bound, mask, time.perf_counter() - t0))
+        return mask, executed
+
+    def stats(self) -> dict:
+        return {"replay_attempts": self.attempts, "replay_passes": self.passes}
@@ -0,0 +1,155 @@
+import json
+from typing import Any, Dict, List, Optional
+
+
+# ——————————————————————————— 规则快速路由 ———————————————————————————
+# router_prompt_rag 中的决策原则大多是确定性的：
+#   评分足够高 → Pass；覆盖率过低 → 分块分割；碎片化 → 后处理
+# 这些明确的情况由规则直接给出决策，只有规则无法判断时才调用 LLM 路由器。
+# 最后一轮只在评分低于知识库写入阈值时直接 Terminate，否则仍由 LLM 决定是否 Pass，
+# 以免 [write_score, pass_score) 区间内可以入库的结果被规则提前终止。
+# 返回的决策与 LLM 输出格式一致（参数使用 IMG / task_object / MASK 占位符）。
+class RuleRouter:
+
+    # 分块分割逐轮加密的网格
+    PATCH_GRIDS = ((2, 2), (3, 3), (4, 4))
+
+    def __init__(
+            self,
+            pass_score=0.85,
+            low_coverage=0.2,
+            low_connectivity=0.6,
+            patch_overlap=32,
+            write_score=0.8
+        ):
+        self.pass_score = pass_score
+        self.write_score = write_score
+        self.low_coverage = low_coverage
+        self.low_connectivity = low_connectivity
+        self.patch_overlap = patch_overlap
+
+        self.rule_decisions = 0
+        self.llm_fallbacks = 0
+
+    def decide(self, result: Dict[str, Any], memory, attempt: int, max_retry: int) -> Optional[Dict[str, Any]]:
+        """
+        根据当前评估结果与历史记忆做决策；返回 None 表示情况不明确，需要交给 LLM。
+        """
+        decision = self._decide(result, memory, attempt, max_retry)
+        if decision is None:
+            self.llm_fallbacks += 1
+        else:
+            self.rule_decisions += 1
+        return decision
+
+    def _decide(self, result, memory, attempt, max_retry):
+        score = float(result.get("score", 0.0))
+        coverage = float(result.get("coverage", 0.0))
+        connectivity = float(result.get("connectivity", 0.0))
+
+        # 1. 结果足够好 → Pass
+        if score >= self.pass_score and not result.get("gated"):
+            return {"tool": "Pass", "parameters": {"reason": f"score {score} >= {self.pass_score}"}}
+
+        # 2. 已是最后一轮，再调用工具也不会被评估：
+        #    评分达不到入库阈值 → Terminate（回退到历史最优）；否则交给 LLM 判断是否 Pass
+        if attempt >= max_retry:
+            if score < self.write_score or result.get("gated"):
+                return {"tool": "Terminate", "parameters": {"reason": f"reached max retry {max_retry}"}}
+            return None
+
+        steps = memory.steps
+        last_tool = steps[-1].tool if steps else None
+
+        # 3. 覆盖率过低：全局分割可能失败 → 分块分割，网格逐轮加密
+        if coverage < self.low_coverage:
+            grid = self._next_patch_grid(steps)
+            if grid is None:
+                return None
+            rows, cols = grid
+            return {
+                "tool": "split_image_patches",
+                "parameters": {
+                    "class_name": "task_object",
+                    "img": "IMG",
+                    "rows": rows,
+                    "cols": cols,
+                    "overlap": self.patch_overlap
+                }
+            }
+
+        # 4. 覆盖率正常但碎片化 → 后处理（刚做过后处理则交给 LLM）
+        if connectivity < self.low_connectivity and last_tool != "postprocess_preserve_small":
+            return {"tool": "postprocess_preserve_small", "parameters": {"mask": "MASK"}}
+
+        return None
+
+    def _next_patch_grid(self, steps):
+        """返回比历史上用过的分块网格更密的下一档；已用到最密则返回 None"""
+        used = -1
+        for s in steps:
+            if s.tool != "split_image_patches":
+                continue
+            grid = (s.params.get("rows"), s.params.get("cols"))
+            if grid in self.PATCH_GRIDS:
+                used = max(used, self.PATCH_GRIDS.index(grid))
+        if used + 1 >= len(self.PATCH_GRIDS):
+            return None
+        return self.PATCH_GRIDS[used + 1]
+
+    def stats(self) -> dict:
+        return {"rule_decisions": self.rule_decisions, "llm_fallbacks": self.llm_fallbacks}
+
+
+# ——————————————————————————— 扇出候选 ———————————————————————————
+# 每轮只试一个工具时，MAX_RETRY 轮内常常来不及找到好结果。
+# 扇出模式在路由器选定的工具之外补充若干候选（对当前 mask 后处理、ROI 放大重分割、未用过的分块网格），
+# 由流水线并发执行、一次批量评估，保留评分最高的一个。
+class FanOutProposer:
+
+    def __init__(self, width=3, patch_grids=RuleRouter.PATCH_GRIDS, patch_overlap=32):
+        self.width = width
+        self.patch_grids = patch_grids
+        self.patch_overlap = patch_overlap
+
+    def propose(self, decision: Dict[str, Any], memory) -> List[Dict[str, Any]]:
+        """返回至多 width 个候选决策（第一个总是路由器的选择），参数仍为占位符形式"""
+        candidates = []
+        seen = set()
+
+        def add(d):
+            sig = (d["tool"], json.dumps(d.get("parameters", {}), sort_keys=True, default=str))
+            if sig not in seen and len(candidates) < self.width:
+                seen.add(sig)
+                candidates.append(d)
+
+        add(decision)
+
+        steps = memory.steps
+        if steps and steps[-1].tool != "postprocess_preserve_small":
+            add({"tool": "postprocess_preserve_small", "parameters": {"mask": "MASK"}})
+        # 当前 mask 已定位到目标时，放大其所在区域重分割
+        if steps and steps[-1].tool != "zoom_in_roi" and float(steps[-1].metrics.get("coverage") or 0.0) > 0:
+            add({
+                "tool": "zoom_in_roi",
+                "parameters": {"class_name": "task_object", "img": "IMG", "mask": "MASK"}
+            })
+
+        used = {(s.params.get("rows"), s.params.get("cols")) for s in steps if s.tool == "split_image_patches"}
+        if decision["tool"] == "split_image_patches":
+            p = decision.get("parameters", {})
+            used.add((p.get("rows"), p.get("cols")))
+        for rows, cols in self.patch_grids:
+            if (rows, cols) in used:
+                continue
+            add({
+                "tool": "split_image_patches",
+                "parameters": {
+                    "class_name": "task_object",
+                    "img": "IMG",
+                    "rows": rows,
+                    "cols": cols,
+                    "overlap": self.patch_overlap
+                }
+            })
+        return candidates
@@ -1,9 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import cv2
 import numpy as np
 from iSeg_Plus.demo import run_one_image, load_model
-from PIL import Image
 
 import streamlit as st
 
+from tools.roi import roi_boxes, zoom_factor
+
 
 @st.cache_resource
 def load_iseg_model(device="cuda"):
@@ -13,10 +18,41 @@ def load_iseg_model(device="cuda"):
     return model
 
 
+@lru_cache(maxsize=64)
+def _blend_window(h, w):
+    """按 patch 尺寸缓存的融合权重（中心大、边缘小），只读"""
+    wy = np.linspace(0, 1, h)
+    wx = np.linspace(0, 1, w)
+    window = np.outer(np.minimum(wy, wy[::-1]),
+                      np.minimum(wx, wx[::-1])) + 1e-6
+    window.setflags(write=False)
+    return window
+
+
+def _patch_probability(mask):
+    """单个 patch 的输出统一为 [0, 1] 的 float32 单通道"""
+    if mask.ndim == 3:
+        mask = mask[..., 0]
+    mask = mask.astype(np.float32)
+    if mask.max() > 1:
+        mask /= 255.0
+    return mask
+
+
+def _is_binary(prob):
+    """patch 概率图是否只含 0 与 1"""
+    return not np.any((prob > 0) & (prob < 1))
+
+
 class segmenter_iSeg:
-    def __init__(self, device="cuda"):
+    def __init__(self, device="cuda", patch_workers=1):
         self.device = device
         self.model = load_iseg_model(device)
+        # 单次 patch / ROI 分割内部的最大并发数，1 表示串行（默认）。
+        # 并发时多个线程在同一个共享模型上调用 run_one_image：
+        # 只有确认所用 iSeg 版本推理时不修改模型上的状态时才应设为 > 1，
+        # 且多个 patch 的 kernel 仍排在同一块 GPU 上，加速取决于单次推理占不满 GPU 的程度
+        self.patch_workers = patch_workers
 
 
     def segment(self, class_name, img):
@@ -26,68 +62,141 @@ class segmenter_iSeg:
 
 
     def patch_segment(self, class_name, img, rows=2, cols=2, overlap=0,
-                          run_args=None):
+                          run_args=None, max_workers=None):
         """
         将输入图片 np_img 拆成 rows×cols 个 patch（可带重叠），
         分别送入 run_one_image(model, patch, ...)，
         最终拼接回原图。
+        max_workers > 1 时 patch 推理由线程池并发执行（默认取 self.patch_workers），
+        融合仍按行列顺序累加，结果与串行完全一致。
         保证输出：
             - 尺寸与输入一致
             - 仅包含黑白（0 与 255）两种像素值
         """
         H, W = img.shape[:2]
         run_args = {} if run_args is None else run_args.copy()
+        max_workers = self.patch_workers if max_workers is None else max_workers
         ph = H // rows
         pw = W // cols
 
-        stitched = np.zeros((H, W), dtype=np.float32)
-        weight = np.zeros((H, W), dtype=np.float32)
-
+        # ---- 计算 patch 范围（带重叠）----
+        boxes = []
         for r in range(rows):
             for c in range(cols):
-                # ---- 计算 patch 范围（带重叠）----
                 y0 = max(0, r * ph - overlap)
                 y1 = min(H, (r + 1) * ph + overlap if r < rows - 1 else H)
                 x0 = max(0, c * pw - overlap)
                 x1 = min(W, (c + 1) * pw + overlap if c < cols - 1 else W)
+                boxes.append((y0, y1, x0, x1))
+
+        # ---- 单 patch 推理 ----
+        def infer(box):
+            y0, y1, x0, x1 = box
+            return run_one_image(
+                self.model, class_name, img[y0:y1, x0:x1],
+                iter_count=run_args.get("iter_count", 5),
+                thr=run_args.get("thr", 0.5),
+                ent=run_args.get("ent", 0.5),
+                device=run_args.get("device", None),
+            )
+
+        if max_workers > 1 and len(boxes) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(boxes))) as pool:
+                masks = list(pool.map(infer, boxes))
+        else:
+            masks = [infer(box) for box in boxes]
+
+        binary = np.zeros((H, W), dtype=np.uint8)
+        threshold = 0.5  # 可根据任务调整
+
+        if overlap <= 0:
+            # ---- 无重叠且各 patch 输出已是 0 / 1：每个像素只属于一个 patch，融合结果恰为原值，直接写回 ----
+            # 非二值输出（概率图）的 m·w / w 在 float32 下可能在阈值附近舍入，仍走下面的融合以与串行结果一致
+            masks = [_patch_probability(mask) for mask in masks]
+            if all(_is_binary(mask) for mask in masks):
+                for (y0, y1, x0, x1), mask in zip(boxes, masks):
+                    binary[y0:y1, x0:x1] = (mask >= threshold) * 255
+                return binary
+
+        stitched = np.zeros((H, W), dtype=np.float32)
+        weight = np.zeros((H, W), dtype=np.float32)
+
+        for (y0, y1, x0, x1), mask in zip(boxes, masks):
+            mask = _patch_probability(mask)
+
+            # ---- 融合权重（平滑边界）----
+            window = _blend_window(*mask.shape)
 
-                patch = img[y0:y1, x0:x1]
-
-                # ---- 单 patch 推理 ----
-                mask = run_one_image(
-                    self.model, class_name, patch,
-                    iter_count=run_args.get("iter_count", 5),
-                    thr=run_args.get("thr", 0.5),
-                    ent=run_args.get("ent", 0.5),
-                    device=run_args.get("device", None),
-                )
-                if mask.ndim == 3:
-                    mask = mask[..., 0]
-                mask = mask.astype(np.float32)
-                if mask.max() > 1:
-                    mask /= 255.0
-
-                # ---- 融合权重（平滑边界）----
-                h, w = mask.shape
-                wy = np.linspace(0, 1, h)
-                wx = np.linspace(0, 1, w)
-                window = np.outer(np.minimum(wy, wy[::-1]),
-                                np.minimum(wx, wx[::-1])) + 1e-6
-
-                stitched[y0:y1, x0:x1] += mask * window
-                weight[y0:y1, x0:x1] += window
-
-        # ---- 融合并归一化 ----
+            stitched[y0:y1, x0:x1] += mask * window
+            weight[y0:y1, x0:x1] += window
+
+        # ---- 融合并归一化（原地计算，不再分配新的 H×W 浮点数组）----
         weight[weight == 0] = 1e-6
-        merged = stitched / weight
-        merged = np.clip(merged, 0, 1)
+        np.divide(stitched, weight, out=stitched)
+        del weight
 
-        # ---- 二值化（仅保留 0 / 255）----
-        threshold = 0.5  # 可根据任务调整
-        binary = (merged >= threshold).astype(np.uint8) * 255
+        # ---- 二值化（仅保留 0 / 255）；阈值在 (0, 1) 内，无需先裁剪到 [0, 1] ----
+        np.greater_equal(stitched, threshold, out=binary, casting="unsafe")
+        binary *= 255
 
         # ---- 强制校验尺寸一致 ----
-        binary = np.array(Image.fromarray(binary).resize((W, H), Image.NEAREST))
         assert binary.shape == (H, W), f"Size mismatch: got {binary.shape}, expected {(H, W)}"
 
         return binary
+
+
+    def roi_segment(self, class_name, img, mask, margin=0.25, max_rois=4, zoom_side=1024,
+                    max_zoom=4.0, min_area=None, run_args=None, max_workers=None):
+        """
+        以当前 mask 为定位：取各连通域外接框外扩 margin 后的区域（重叠的合并），
+        裁剪并放大到长边 zoom_side（至多 max_zoom 倍）后重新分割，
+        结果缩回原尺寸贴回这些区域，区域外保持原 mask 不变。
+        模型调用次数等于区域数（至多 max_rois），与 rows×cols 无关；
+        mask 为空时原样返回。
+        保证输出：
+            - 尺寸与输入一致
+            - 仅包含黑白（0 与 255）两种像素值
+        """
+        run_args = {} if run_args is None else run_args.copy()
+        max_workers = self.patch_workers if max_workers is None else max_workers
+
+        base = np.asarray(mask)
+        if base.ndim == 3:
+            base = base[..., 0]
+        out = ((base > 0) * 255).astype(np.uint8)
+
+        boxes = roi_boxes(out, margin=margin, min_area=min_area, max_rois=max_rois)
+        if not boxes:
+            return out
+
+        # ---- 单个区域：放大 → 分割 → 缩回 ----
+        def infer(box):
+            y0, y1, x0, x1 = box
+            crop = img[y0:y1, x0:x1]
+            h, w = crop.shape[:2]
+            scale = zoom_factor(h, w, zoom_side, max_zoom)
+            if scale > 1.0:
+                crop = cv2.resize(crop, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_CUBIC)
+            refined = _patch_probability(run_one_image(
+                self.model, class_name, crop,
+                iter_count=run_args.get("iter_count", 5),
+                thr=run_args.get("thr", 0.5),
+                ent=run_args.get("ent", 0.5),
+                device=run_args.get("device", None),
+            ))
+            if refined.shape != (h, w):
+                refined = cv2.resize(refined, (w, h), interpolation=cv2.INTER_AREA)
+            return refined
+
+        if max_workers > 1 and len(boxes) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(boxes))) as pool:
+                refined = list(pool.map(infer, boxes))
+        else:
+            refined = [infer(box) for box in boxes]
+
+        # ---- 贴回（合并后的区域互不重叠）----
+        threshold = 0.5
+        for (y0, y1, x0, x1), m in zip(boxes, refined):
+            out[y0:y1, x0:x1] = (m >= threshold) * 255
+
+        return out
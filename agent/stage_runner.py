@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional
+
+from agent.pipeline import VisionManusPipeline, Job, JobResult, JobState, ResultWriter, STAGES
+
+
+_STOP = object()
+# 投递线程等待空闲名额时检查结束标志的间隔（秒）
+_FEED_POLL = 0.05
+
+
+class _StageStats:
+    """单个阶段的累计统计：处理次数、忙碌时间、排队等待时间、最大队列深度"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.items = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def add(self, busy: float, wait: float) -> None:
+        with self._lock:
+            self.items += 1
+            self.busy_time += busy
+            self.wait_time += wait
+
+    def observe_depth(self, depth: int) -> None:
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+
+    def to_dict(self, wall: float) -> dict:
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "busy_time": round(self.busy_time, 4),
+            "utilization": round(self.busy_time / (wall * self.workers), 4) if wall > 0 else 0.0,
+            "avg_service": round(self.busy_time / self.items, 4) if self.items else 0.0,
+            "avg_wait": round(self.wait_time / self.items, 4) if self.items else 0.0,
+            "max_queue": self.max_depth,
+        }
+
+
+# ——————————————————————————— 阶段流水线 ———————————————————————————
+class StagedRunner:
+    """
+    把 理解 / 检索 / 分割 / 评估 / 路由 拆成独立阶段，每个阶段由自己的工作线程
+    从有界队列中取作业，处理完放入下一个阶段的队列；路由结果需要继续优化时回到分割队列。
+    这样作业 k 在评估时作业 k+1 可以同时分割，各模型不再互相空等。
+
+    - 同时在流水线中的作业数不超过 max_in_flight，各阶段队列容量按此设定，
+      路由 → 分割的回环因此不会因队列满而死锁
+    - 结果按完成顺序流式返回；单个作业失败只记录错误
+    - 调用方提前停止迭代时，投递线程不再投入新作业并退出，各阶段工作线程收到结束标记
+    - stats() 给出各阶段利用率（忙碌时间 / 墙钟时间 / 工作线程数），利用率最高的即瓶颈
+    """
+
+    def __init__(
+            self,
+            pipeline: VisionManusPipeline,
+            max_in_flight: int = 4,
+            workers: Optional[Dict[str, int]] = None
+        ):
+        self.pipeline = pipeline
+        self.max_in_flight = max(1, max_in_flight)
+        # 每个阶段默认一个工作线程（各自独占一个模型）
+        self.workers = {stage: 1 for stage in STAGES}
+        self.workers.update(workers or {})
+
+        self._stats = {stage: _StageStats(self.workers[stage]) for stage in STAGES}
+        self._wall = 0.0
+
+    def run(
+            self,
+            jobs: Iterable[Job],
+            result_writer: Optional[ResultWriter] = None
+        ) -> Iterator[JobResult]:
+        # 容量为在途作业数 + 工作线程数（留给结束标记），put 不会无限阻塞
+        queues = {stage: queue.Queue(maxsize=self.max_in_flight + self.workers[stage]) for stage in STAGES}
+        done: "queue.Queue" = queue.Queue()
+        slots = threading.Semaphore(self.max_in_flight)
+        closed = threading.Event()      # 调用方提前停止迭代（break / close）时置位，投递线程随之退出
+        fed = []            # 投入的作业总数，投递线程结束时写入
+
+        threads = [
+            threading.Thread(target=self._work, args=(stage, queues, done), name=f"stage-{stage}-{i}", daemon=True)
+            for stage in STAGES for i in range(self.workers[stage])
+        ]
+
+        def feed():
+            n = 0
+            try:
+                for job in jobs:
+                    while not slots.acquire(timeout=_FEED_POLL):
+                        if closed.is_set():
+                            break
+                    if closed.is_set():
+                        break
+                    state = self.pipeline.start_job(job)
+                    self._put(queues, STAGES[0], state)
+                    n += 1
+            except Exception as e:
+                # 作业清单本身读取失败：交给主线程抛出
+                done.put(e)
+            fed.append(n)
+            done.put(_STOP)
+
+        t0 = time.perf_counter()
+        feeder = threading.Thread(target=feed, name="stage-feeder", daemon=True)
+        for t in threads:
+            t.start()
+        feeder.start()
+
+        n_out = 0
+        try:
+            while not fed or n_out < fed[0]:
+                item = done.get()
+                if item is _STOP:
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                slots.release()
+                n_out += 1
+                if result_writer is not None:
+                    result_writer.write(item)
+                yield item
+        finally:
+            self._wall += time.perf_counter() - t0
+            closed.set()
+            for stage in STAGES:
+                for _ in range(self.workers[stage]):
+                    queues[stage].put(_STOP)
+
+    def _put(self, queues, stage: str, state: JobState) -> None:
+        state.enqueued_at = time.perf_counter()
+        queues[stage].put(state)
+        self._stats[stage].observe_depth(queues[stage].qsize())
+
+    def _work(self, stage: str, queues, done) -> None:
+        stats = self._stats[stage]
+        while True:
+            state = queues[stage].get()
+            if state is _STOP:
+                break
+
+            t0 = time.perf_counter()
+            wait = t0 - state.enqueued_at
+            try:
+                nxt = self.pipeline.step(stage, state)
+                out = self.pipeline.finish_job(state) if nxt is None else None
+            except Exception as e:
+                nxt, out = None, JobResult.failed(state.job, e, state.t_start)
+            stats.add(time.perf_counter() - t0, wait)
+
+            if nxt is None:
+                done.put(out)
+            else:
+                self._put(queues, nxt, state)
+
+    def stats(self) -> Dict[str, dict]:
+        return {stage: self._stats[stage].to_dict(self._wall) for stage in STAGES}
+
+    def bottleneck(self) -> str:
+        return max(STAGES, key=lambda s: self._stats[s].busy_time / self._stats[s].workers)
@@ -0,0 +1,150 @@
+import json
+import re
+from typing import Dict, List, Optional, Sequence
+
+import torch
+from transformers import StoppingCriteria
+
+
+# ——————————————————————————— 结构化输出 ———————————————————————————
+# 任务理解 / 路由 / soft 评估三个 prompt 的输出都是固定的小 JSON 对象。
+# 这里提供：
+#   - JsonSchema：声明必需字段与回答部分的 token 预算
+#   - JsonObjectStoppingCriteria：顶层 JSON 对象闭合即停止生成
+#   - parse_json_output：从原始文本中提取并校验 JSON 对象
+class JsonSchema:
+
+    def __init__(self, name: str, required: Sequence[str], max_new_tokens: int):
+        self.name = name
+        self.required = tuple(required)
+        self.max_new_tokens = max_new_tokens
+
+
+TASK_SCHEMA = JsonSchema("task_understanding", ["user_goal", "task_object"], max_new_tokens=128)
+ROUTER_SCHEMA = JsonSchema("router", ["tool"], max_new_tokens=256)
+SOFT_EVAL_SCHEMA = JsonSchema(
+    "soft_evaluation",
+    ["coverage_score", "coverage_reason", "semantic_score", "semantic_reason"],
+    max_new_tokens=384
+)
+
+SCHEMAS = {s.name: s for s in (TASK_SCHEMA, ROUTER_SCHEMA, SOFT_EVAL_SCHEMA)}
+
+
+class _JsonScanner:
+    """逐字符跟踪 JSON 括号深度（忽略字符串内部的括号）"""
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape = False
+        self.closed = False
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if self.closed:
+                break
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"' and self.started:
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+                self.started = True
+            elif ch == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.closed = True
+        return self.closed
+
+
+class JsonObjectStoppingCriteria(StoppingCriteria):
+    """
+    顶层 JSON 对象闭合后立即停止，回答部分超过 token 预算也停止。
+    start_token_id 不为 None 时（如 </think> 的 151668），只在该 token 之后开始计数，
+    避免思考内容中的花括号提前触发停止。
+    """
+
+    def __init__(self, tokenizer, prompt_len: int, max_answer_tokens: int,
+                 start_token_id: Optional[int] = None):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.max_answer_tokens = max_answer_tokens
+        self.start_token_id = start_token_id
+
+        self._seen = prompt_len
+        self._scanners: List[_JsonScanner] = []
+        self._answer_started: List[bool] = []
+        self._answer_tokens: List[int] = []
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        batch = input_ids.shape[0]
+        if not self._scanners:
+            self._scanners = [_JsonScanner() for _ in range(batch)]
+            self._answer_started = [self.start_token_id is None] * batch
+            self._answer_tokens = [0] * batch
+
+        new_tokens = input_ids[:, self._seen:].tolist()
+        self._seen = input_ids.shape[1]
+
+        done = []
+        for i, tokens in enumerate(new_tokens):
+            scanner = self._scanners[i]
+            for tok in tokens:
+                if scanner.closed:
+                    break
+                if not self._answer_started[i]:
+                    self._answer_started[i] = tok == self.start_token_id
+                    continue
+                self._answer_tokens[i] += 1
+                scanner.feed(self.tokenizer.decode([tok], skip_special_tokens=True))
+            done.append(scanner.closed or self._answer_tokens[i] >= self.max_answer_tokens)
+
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def extract_json_object(text: str) -> Optional[str]:
+    """返回 text 中第一个完整的顶层 JSON 对象（兼容 ```json 代码块与前后多余文字）"""
+    start = text.find("{")
+    while start != -1:
+        scanner = _JsonScanner()
+        for j in range(start, len(text)):
+            if scanner.feed(text[j]):
+                return text[start:j + 1]
+        start = text.find("{", start + 1)
+    return None
+
+
+def parse_json_output(text: str, schema: Optional[JsonSchema] = None) -> Dict:
+    """
+    解析模型输出的 JSON 对象，并校验 schema 中的必需字段。
+    失败时抛出 ValueError，附带原始输出便于排查。
+    """
+    obj_text = extract_json_object(text)
+    if obj_text is None:
+        raise ValueError(f"no JSON object in model output: {text!r}")
+
+    try:
+        obj = json.loads(obj_text)
+    except json.JSONDecodeError as e:
+        # 常见错误：照抄 prompt 示例里的尾逗号
+        try:
+            obj = json.loads(_TRAILING_COMMA.sub(r"\1", obj_text))
+        except json.JSONDecodeError:
+            raise ValueError(f"malformed JSON in model output ({e}): {obj_text!r}") from e
+
+    if schema is not None:
+        missing = [k for k in schema.required if k not in obj]
+        if missing:
+            raise ValueError(f"{schema.name} output missing keys {missing}: {obj_text!r}")
+    return obj
@@ -0,0 +1,64 @@
+# python -m benchmarks.bench_planner_prefix_cache
+"""
+Planner system prompt 前缀 KV cache 基准：对比有无前缀缓存时的首 token 延迟（TTFT）。
+"""
+import json
+import time
+
+import torch
+
+from agent.planner import Planner
+from agent.prompts import router_prompt_rag, task_understanding_prompt
+
+
+ROUTER_INPUT = json.dumps({
+    "current_result": {"score": 0.62, "hard_score": 0.55, "soft_score": 0.67,
+                       "coverage": 0.08, "connectivity": 0.41, "smoothness": 0.98},
+    "history": "[]",
+    "visual_prior": "[Visual Concept]\n- object: pantograph\n",
+    "historical_strategies": "[Historical Strategies]\n- No high-confidence matched strategies.\n"
+}, ensure_ascii=False)
+
+
+def ttft(planner, sys_prompt, user_prompt, use_cache):
+    """首 token 延迟：生成 1 个 token 的耗时"""
+    planner.use_prefix_cache = use_cache
+    text = planner.tokenizer.apply_chat_template(
+        [{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}],
+        tokenize=False, add_generation_prompt=True, enable_thinking=False
+    )
+    inputs = planner.tokenizer([text], return_tensors="pt").to(planner.model.device)
+
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t0 = time.perf_counter()
+    kwargs = {}
+    if use_cache:
+        kwargs["past_key_values"] = planner._prefix_cache(text, inputs.input_ids)
+    planner.model.generate(**inputs, max_new_tokens=1, do_sample=False, **kwargs)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return time.perf_counter() - t0, inputs.input_ids.shape[1]
+
+
+def main(repeat=10):
+    planner = Planner()
+    cases = [
+        ("router", router_prompt_rag, ROUTER_INPUT),
+        ("task_understanding", task_understanding_prompt, "Segmenting the pantograph in the image."),
+    ]
+    for name, sys_prompt, user_prompt in cases:
+        # 预热（同时建立前缀缓存）
+        ttft(planner, sys_prompt, user_prompt, use_cache=False)
+        ttft(planner, sys_prompt, user_prompt, use_cache=True)
+
+        t_plain = sum(ttft(planner, sys_prompt, user_prompt, False)[0] for _ in range(repeat)) / repeat
+        t_cached = sum(ttft(planner, sys_prompt, user_prompt, True)[0] for _ in range(repeat)) / repeat
+        n_tokens = ttft(planner, sys_prompt, user_prompt, False)[1]
+
+        print(f"{name} ({n_tokens} prompt tokens): TTFT no cache {t_plain * 1000:.1f} ms, "
+              f"prefix cache {t_cached * 1000:.1f} ms, speedup x{t_plain / t_cached:.2f}")
+
+
+if __name__ == "__main__":
+    main()
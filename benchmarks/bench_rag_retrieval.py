@@ -0,0 +1,171 @@
+# python -m benchmarks.bench_rag_retrieval
+# python -m benchmarks.bench_rag_retrieval --dense --embed-model BAAI/bge-small-zh-v1.5
+"""
+知识库检索基准：
+  1. TF-IDF：整体 cosine_similarity + 全量 argsort（旧实现）与 argpartition top-k 的延迟，结果一致性
+  2. IVF 近似检索：与精确内积相比的 recall@k 与延迟（合成的成簇单位向量）
+  3. --dense：在真实视觉概念库上对比 TF-IDF 与稠密向量对同义 / 描述式查询的命中率（需要向量模型）
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from rag.retriever import TfidfRetriever, DenseRetriever, TextEmbedder, IVFIndex, top_k_indices, EMBED_MODEL
+from rag.vision_rag import _visual_text
+
+
+WORDS = ("pantograph collector bolt screw nut person pedestrian insulator wire cable catenary "
+         "bracket rail sleeper clamp spring rod arm frame roof wheel axle brake crack rust "
+         "thin metal small large cylindrical articulated slender fragmented occluded").split()
+
+# (查询, 期望命中的 object)
+SEMANTIC_QUERIES = [
+    ("pantograph", "pantograph"),
+    ("collector", "pantograph"),
+    ("current collector on the train roof", "pantograph"),
+    ("受电弓", "pantograph"),
+    ("bolt", "bolt"),
+    ("fastener", "bolt"),
+    ("threaded fastener head", "bolt"),
+    ("螺栓", "bolt"),
+    ("person", "person"),
+    ("worker standing on the platform", "person"),
+    ("human", "person"),
+    ("行人", "person"),
+]
+
+
+def write_synthetic_db(path, n, seed=0):
+    rng = np.random.default_rng(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            words = rng.choice(WORDS, 8)
+            f.write(json.dumps({
+                "object": f"{words[0]}-{i}",
+                "aliases": list(words[1:3]),
+                "tags": list(words[3:6]),
+                "prior": " ".join(words[6:]),
+            }) + "\n")
+
+
+def bench_tfidf(sizes, top_k, n_queries, repeat):
+    print("== TF-IDF 打分 + top-k ==")
+    queries = list(WORDS[:n_queries])
+    with tempfile.TemporaryDirectory() as d:
+        for n in sizes:
+            path = os.path.join(d, f"db_{n}.jsonl")
+            write_synthetic_db(path, n)
+            retriever = TfidfRetriever(path, _visual_text)
+            index = retriever.index
+            matrix = index.matrix
+
+            def legacy():
+                out = []
+                for q in queries:
+                    sims = cosine_similarity(index.transform([q]), matrix).reshape(-1)
+                    out.append(np.argsort(-sims)[:top_k])
+                return out
+
+            def current():
+                return retriever.search(queries, top_k)
+
+            legacy_out, current_out = legacy(), current()
+            same = all(
+                np.allclose(sorted(cosine_similarity(index.transform([q]), matrix).reshape(-1)[a])[::-1],
+                            [s for _, s in b])
+                for q, a, b in zip(queries, legacy_out, current_out)
+            )
+
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                legacy()
+            t_legacy = (time.perf_counter() - t0) / repeat / len(queries)
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                current()
+            t_current = (time.perf_counter() - t0) / repeat / len(queries)
+            print(f"N={n:>7}: legacy {t_legacy * 1e3:7.2f} ms/query, "
+                  f"argpartition {t_current * 1e3:7.2f} ms/query "
+                  f"({t_legacy / t_current:.1f}x), same top-{top_k} scores: {same}")
+
+
+def bench_ivf(n, dim, n_clusters, top_k, n_queries, nprobes, seed=0):
+    print(f"== IVF 近似检索（N={n}, dim={dim}）==")
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n)] + 1.0 * rng.normal(size=(n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[rng.choice(n, n_queries, replace=False)] + 0.5 * rng.normal(size=(n_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    t0 = time.perf_counter()
+    # 线上检索一次只有一个 query，逐条计时
+    exact = [set(top_k_indices(vectors @ q, top_k).tolist()) for q in queries]
+    t_exact = (time.perf_counter() - t0) / n_queries
+    print(f"exact: {t_exact * 1e3:.2f} ms/query")
+
+    ivf = IVFIndex(nlist=int(np.sqrt(n)))
+    t0 = time.perf_counter()
+    ivf.train(vectors)
+    print(f"train: {time.perf_counter() - t0:.2f}s, nlist={len(ivf.lists)}")
+
+    for nprobe in nprobes:
+        ivf.nprobe = nprobe
+        t0 = time.perf_counter()
+        approx = [ivf.search(vectors, q[None], top_k)[0] for q in queries]
+        t_ivf = (time.perf_counter() - t0) / n_queries
+        recall = np.mean([len(e & {i for i, _ in a}) / top_k for e, a in zip(exact, approx)])
+        print(f"nprobe={nprobe:>3}: {t_ivf * 1e3:.2f} ms/query ({t_exact / t_ivf:.1f}x), recall@{top_k} {recall:.3f}")
+
+
+def bench_semantic(db_path, embed_model, top_k):
+    print(f"== 同义 / 描述式查询命中率（{db_path}）==")
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "visual_concepts.jsonl")
+        with open(db_path, "rb") as src, open(path, "wb") as dst:
+            dst.write(src.read())
+        retrievers = {
+            "tfidf": TfidfRetriever(path, _visual_text),
+            "dense": DenseRetriever(path, _visual_text, embedder=TextEmbedder(embed_model)),
+        }
+        for name, retriever in retrievers.items():
+            hits, latencies = 0, []
+            for query, expected in SEMANTIC_QUERIES:
+                t0 = time.perf_counter()
+                ranked = retriever.search([query], top_k)[0]
+                latencies.append(time.perf_counter() - t0)
+                objects = [retriever.get_item(i)["object"] for i, s in ranked if s > 0]
+                hits += expected in objects
+            print(f"{name:>6}: hit@{top_k} {hits}/{len(SEMANTIC_QUERIES)}, "
+                  f"latency {np.mean(latencies) * 1e3:.2f} ms/query")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--ivf-n", type=int, default=100000)
+    parser.add_argument("--ivf-dim", type=int, default=512)
+    parser.add_argument("--ivf-top-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--dense", action="store_true", help="加载向量模型，对比语义检索命中率")
+    parser.add_argument("--embed-model", default=EMBED_MODEL)
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(__file__), "..", "rag", "visual_concepts.jsonl"))
+    args = parser.parse_args()
+
+    bench_tfidf(args.sizes, args.top_k, args.queries, args.repeat)
+    bench_ivf(args.ivf_n, args.ivf_dim, n_clusters=256, top_k=args.ivf_top_k,
+              n_queries=200, nprobes=args.nprobe)
+    if args.dense:
+        bench_semantic(args.db, args.embed_model, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
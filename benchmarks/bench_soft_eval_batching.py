@@ -0,0 +1,63 @@
+# python -m benchmarks.bench_soft_eval_batching
+"""
+soft 评估微批处理基准：N 个并发作业同时请求 soft 评估，
+对比不同 max_batch / max_wait 下的吞吐量与单请求延迟。
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from agent.evaluation import evaluate
+from agent.prompts import soft_evaluation_prompt
+
+
+def make_sample(seed, h=720, w=1280):
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.ellipse(mask, (w // 2, h // 2), (w // 5, h // 4), 0, 0, 360, 255, -1)
+    return img, mask
+
+
+def run_concurrent(evaluator, samples, prompt, serial):
+    latencies = [0.0] * len(samples)
+    lock = threading.Lock()
+
+    def worker(i):
+        img, mask = samples[i]
+        t0 = time.perf_counter()
+        if serial:
+            # 不攒批时，同一模型上的请求逐个排队执行
+            with lock:
+                evaluator.soft_evaluate(img, mask, prompt)
+        else:
+            evaluator.soft_evaluate(img, mask, prompt)
+        latencies[i] = time.perf_counter() - t0
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(samples))]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0, latencies
+
+
+def main(n_jobs=8):
+    prompt = soft_evaluation_prompt.format("[Visual Concept]\n- object: pantograph\n")
+    samples = [make_sample(i) for i in range(n_jobs)]
+
+    for max_batch, max_wait in ((1, 0.0), (2, 0.01), (4, 0.01), (8, 0.02)):
+        evaluator = evaluate(max_batch=max_batch, max_wait=max_wait)
+        evaluator.soft_evaluate(*samples[0], prompt)  # 预热
+
+        wall, latencies = run_concurrent(evaluator, samples, prompt, serial=max_batch == 1)
+        p50, p95 = np.percentile(latencies, [50, 95])
+        print(f"max_batch={max_batch} max_wait={max_wait * 1000:.0f}ms: "
+              f"throughput {n_jobs / wall:.2f} req/s, latency p50 {p50:.2f}s p95 {p95:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# python -m benchmarks.bench_stage_pipeline --image-dir images/ --limit 16
+"""
+阶段流水线基准：同一批图像分别用顺序执行（VisionManusPipeline.run）
+与阶段流水线（StagedRunner）处理，对比吞吐量，并打印流水线各阶段利用率。
+为避免两次运行互相影响，关闭策略回放与评估缓存。
+"""
+import argparse
+import itertools
+import time
+
+from agent.pipeline import VisionManusPipeline, iter_jobs_from_dir
+from agent.stage_runner import StagedRunner
+
+
+def timed(results):
+    t0 = time.perf_counter()
+    n = sum(1 for _ in results)
+    return n, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image-dir", required=True)
+    parser.add_argument("--prompt", default="Segmenting the pantograph in the image.")
+    parser.add_argument("--limit", type=int, default=16)
+    parser.add_argument("--max-in-flight", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--server", default=None)
+    args = parser.parse_args()
+
+    pipeline = VisionManusPipeline(server_url=args.server, strategy_replay=False)
+    pipeline.evaluator.cache = None
+    jobs = lambda: itertools.islice(iter_jobs_from_dir(args.image_dir, args.prompt), args.limit)
+
+    next(pipeline.run(jobs()))  # 预热
+
+    n, wall = timed(pipeline.run(jobs()))
+    print(f"sequential: {n} jobs in {wall:.1f}s ({n / wall:.2f} jobs/s)")
+
+    for max_in_flight in args.max_in_flight:
+        runner = StagedRunner(pipeline, max_in_flight=max_in_flight)
+        n, wall = timed(runner.run(jobs()))
+        print(f"staged max_in_flight={max_in_flight}: {n} jobs in {wall:.1f}s ({n / wall:.2f} jobs/s), "
+              f"bottleneck {runner.bottleneck()}")
+        for stage, stats in runner.stats().items():
+            print(f"  {stage:>10}: utilization {stats['utilization']:.2f}, "
+                  f"avg service {stats['avg_service']:.3f}s, avg wait {stats['avg_wait']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
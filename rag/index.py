@@ -0,0 +1,334 @@
+# rag/index.py
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+INDEX_VERSION = 1
+
+
+def _make_vectorizer(vocabulary=None) -> TfidfVectorizer:
+    return TfidfVectorizer(
+        analyzer="char",
+        ngram_range=(2, 5),
+        min_df=1,
+        vocabulary=vocabulary
+    )
+
+
+def open_jsonl(path: str):
+    """
+    打开源 JSONL，返回 (句柄, 该句柄对应文件的 stat)；文件不存在时返回 (None, None)。
+    索引里的字节偏移只对建立索引时的那个 inode 有效：检索器持有这个句柄读取记录，
+    文件被压缩（os.replace）后，在下一次 refresh 换句柄之前仍从旧文件读取，偏移不会错位。
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None, None
+    return f, os.fstat(f.fileno())
+
+
+def read_jsonl_lines(f, start: int, text_fn: Callable[[Dict[str, Any]], str]):
+    """从句柄 f 的字节位置 start 读取完整的行；返回 (偏移列表, 检索文本列表, 已读到的位置)"""
+    offsets, texts = [], []
+    f.seek(start)
+    pos = start
+    for raw in f:
+        line = raw.strip()
+        if line:
+            try:
+                d = json.loads(line.decode("utf-8"))
+            except ValueError:
+                if raw.endswith(b"\n"):
+                    raise
+                break       # 写入中的半行，下次再读
+            offsets.append(pos)
+            texts.append(text_fn(d))
+        pos += len(raw)
+    return offsets, texts, pos
+
+
+def read_jsonl_item(f, offset: int, chunk_size: int = 4096) -> Dict[str, Any]:
+    """用 pread 读取句柄 f 中从 offset 开始的一行，不改变句柄的读写位置，可与 read_jsonl_lines 并发"""
+    fd, pos, chunks = f.fileno(), int(offset), []
+    while True:
+        chunk = os.pread(fd, chunk_size, pos)
+        if not chunk:
+            break
+        nl = chunk.find(b"\n")
+        if nl >= 0:
+            chunks.append(chunk[:nl])
+            break
+        chunks.append(chunk)
+        pos += len(chunk)
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+
+class TfidfIndex:
+    """
+    JSONL 知识库的持久化 TF-IDF 索引。
+
+    磁盘格式（<source>.index/ 目录）：
+        meta.json                 源文件大小 / mtime、文档数、当前版本
+        vocab.<v>.json            n-gram → 列号
+        idf.<v>.npy               idf 向量
+        data/indices/indptr.<v>.npy  CSR 矩阵（行已 L2 归一化）
+        offsets.<v>.npy           每条记录在 JSONL 中的字节偏移
+    数组以 mmap 方式加载，启动时无需重新读取 JSONL 与拟合。
+
+    增量更新：源文件只追加时，用已冻结的词表与 idf 变换新增记录并追加到矩阵；
+    追加量超过拟合文档数的 rebuild_ratio 倍、新增记录的 n-gram 在词表中的比例
+    低于 min_vocab_coverage，或源文件被改写时，整体重建。
+    每次检索前 refresh() 检查源文件的 inode / size / mtime，实现热更新；
+    压缩（os.replace 整体替换）后即使文件又变大，inode 不同也按改写处理。
+    记录通过 refresh 时打开的句柄按偏移读取（见 open_jsonl），两次 refresh 之间文件被替换也不会读错记录。
+    """
+
+    def __init__(
+            self,
+            source_path: str,
+            text_fn: Callable[[Dict[str, Any]], str],
+            index_dir: Optional[str] = None,
+            rebuild_ratio: float = 0.2,
+            flush_every: int = 64,
+            min_vocab_coverage: float = 0.9
+        ):
+        self.source_path = source_path
+        self.text_fn = text_fn
+        self.index_dir = index_dir or source_path + ".index"
+        self.rebuild_ratio = rebuild_ratio
+        self.flush_every = flush_every
+        self.min_vocab_coverage = min_vocab_coverage
+
+        self.vectorizer: Optional[TfidfVectorizer] = None
+        self.matrix = None
+        self.offsets = np.zeros(0, dtype=np.int64)
+
+        self._source = None                 # 当前 offsets 所对应文件的只读句柄
+        self._source_ino = 0
+        self._source_size = 0
+        self._source_mtime = 0.0
+        self._n_fit_docs = 0
+        self._n_unflushed = 0
+        self._version = ""
+        self._lock = threading.RLock()
+        self._items: Dict[int, Dict[str, Any]] = {}
+
+        if not self._load():
+            self.rebuild()
+        else:
+            self.refresh()
+
+    # ——————————————————————————— 查询 ———————————————————————————
+    def __len__(self):
+        return len(self.offsets)
+
+    def transform(self, queries: List[str]):
+        return self.vectorizer.transform(queries)
+
+    def scores(self, q_vec) -> np.ndarray:
+        """q_vec: (n_query, n_features)；返回 (n_query, n_docs) 的余弦相似度（行已归一化，点积即余弦）"""
+        return np.asarray((q_vec @ self.matrix.T).todense())
+
+    def get_item(self, i: int) -> Dict[str, Any]:
+        """按偏移从建立索引时的文件句柄读取第 i 条记录（带缓存）"""
+        item = self._items.get(i)
+        if item is None:
+            with self._lock:
+                item = read_jsonl_item(self._source, self.offsets[i])
+            self._items[i] = item
+        return item
+
+    # ——————————————————————————— 更新 ———————————————————————————
+    def refresh(self) -> bool:
+        """源文件变化时增量追加或重建；返回索引是否发生变化"""
+        with self._lock:
+            try:
+                st = os.stat(self.source_path)
+            except FileNotFoundError:
+                if len(self):
+                    self._reset()
+                    return True
+                return False
+
+            if (self._source is not None and st.st_ino == self._source_ino
+                    and st.st_size == self._source_size and st.st_mtime == self._source_mtime):
+                return False
+
+            # 之后的判断与读取都基于新打开的句柄，stat 与 open 之间文件被替换也保持一致
+            f, st = open_jsonl(self.source_path)
+            if f is None:
+                return self.refresh()
+            if st.st_ino != self._source_ino:
+                # 文件被替换（压缩）：整体重建
+                self._rebuild(f, st)
+                return True
+            if self._source is None:
+                self._source = f            # 从磁盘加载的索引：首次 refresh 时打开同一个 inode
+            else:
+                f.close()
+            if st.st_size == self._source_size and st.st_mtime == self._source_mtime:
+                return False
+
+            # 变小或大小不变但被改写：不是单纯追加，整体重建
+            if st.st_size <= self._source_size or self.vectorizer is None:
+                self.rebuild()
+                return True
+
+            new_offsets, new_texts, end = self._read_lines(self._source_size)
+            appended = len(self) - self._n_fit_docs + len(new_texts)
+            if (appended > max(self.rebuild_ratio * self._n_fit_docs, self.flush_every)
+                    or self._has_new_terms(new_texts)):
+                self.rebuild()
+                return True
+
+            if new_texts:
+                self.matrix = sp.vstack([self.matrix, self.transform(new_texts)], format="csr")
+                self.offsets = np.concatenate([self.offsets, np.asarray(new_offsets, dtype=np.int64)])
+                self._n_unflushed += len(new_texts)
+            self._source_size = end
+            self._source_mtime = st.st_mtime
+
+            if self._n_unflushed >= self.flush_every:
+                self._save()
+            return bool(new_texts)
+
+    def _has_new_terms(self, texts: List[str]) -> bool:
+        """新增记录中词表外的 n-gram 过多（如全新的对象名）时，冻结词表检索不到它，需要重建"""
+        analyzer = self.vectorizer.build_analyzer()
+        vocab = getattr(self.vectorizer, "vocabulary_", None) or self.vectorizer.vocabulary
+        for text in texts:
+            grams = analyzer(text)
+            if grams and sum(g in vocab for g in grams) < self.min_vocab_coverage * len(grams):
+                return True
+        return False
+
+    def rebuild(self) -> None:
+        """重新读取整个 JSONL、拟合词表并落盘"""
+        with self._lock:
+            f, st = open_jsonl(self.source_path)
+            if f is None:
+                self._reset()
+                return
+            self._rebuild(f, st)
+
+    def _rebuild(self, f, st) -> None:
+        with self._lock:
+            self._set_source(f)
+            offsets, texts, end = self._read_lines(0)
+            self._items.clear()
+            self.offsets = np.asarray(offsets, dtype=np.int64)
+            self._source_ino = st.st_ino
+            self._source_size = end
+            self._source_mtime = st.st_mtime
+            self._n_fit_docs = len(texts)
+
+            if not texts:
+                self.vectorizer, self.matrix = None, None
+                return
+
+            self.vectorizer = _make_vectorizer()
+            try:
+                self.matrix = self.vectorizer.fit_transform(texts).tocsr()
+            except ValueError:
+                # 文本过短，提取不到任何 n-gram
+                self.vectorizer, self.matrix = None, None
+                return
+            self._save()
+
+    def _set_source(self, f) -> None:
+        if self._source is not None and self._source is not f:
+            self._source.close()
+        self._source = f
+
+    def _reset(self):
+        self._set_source(None)
+        self.vectorizer, self.matrix = None, None
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self._items.clear()
+        self._source_ino, self._source_size, self._source_mtime, self._n_fit_docs = 0, 0, 0.0, 0
+
+    def _read_lines(self, start: int):
+        return read_jsonl_lines(self._source, start, self.text_fn)
+
+    # ——————————————————————————— 持久化 ———————————————————————————
+    def _path(self, name: str, version: str) -> str:
+        return os.path.join(self.index_dir, f"{name}.{version}.{'json' if name == 'vocab' else 'npy'}")
+
+    def _save(self) -> None:
+        os.makedirs(self.index_dir, exist_ok=True)
+        # 版本号带时间戳与进程号，多个进程同时落盘也不会互相覆盖文件
+        old, ver = self._version, f"{time.time_ns()}-{os.getpid()}"
+
+        with open(self._path("vocab", ver), "w", encoding="utf-8") as f:
+            json.dump({k: int(v) for k, v in self.vectorizer.vocabulary_.items()}, f, ensure_ascii=False)
+        np.save(self._path("idf", ver), self.vectorizer.idf_)
+        np.save(self._path("data", ver), self.matrix.data)
+        np.save(self._path("indices", ver), self.matrix.indices)
+        np.save(self._path("indptr", ver), self.matrix.indptr)
+        np.save(self._path("offsets", ver), self.offsets)
+
+        meta = {
+            "format": INDEX_VERSION,
+            "version": ver,
+            "source_ino": self._source_ino,
+            "source_size": self._source_size,
+            "source_mtime": self._source_mtime,
+            "n_docs": len(self),
+            "n_fit_docs": self._n_fit_docs,
+            "n_features": self.matrix.shape[1],
+        }
+        # meta.json 最后原子替换，读者总能看到一致的版本
+        tmp = os.path.join(self.index_dir, f"meta.json.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.index_dir, "meta.json"))
+
+        self._version = ver
+        self._n_unflushed = 0
+        if old:
+            for name in ("vocab", "idf", "data", "indices", "indptr", "offsets"):
+                try:
+                    os.remove(self._path(name, old))
+                except FileNotFoundError:
+                    pass
+
+    def _load(self) -> bool:
+        meta_path = os.path.join(self.index_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return False
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("format") != INDEX_VERSION:
+                return False
+            ver = meta["version"]
+
+            with open(self._path("vocab", ver), "r", encoding="utf-8") as f:
+                vocab = json.load(f)
+            vectorizer = _make_vectorizer(vocabulary=vocab)
+            vectorizer.idf_ = np.load(self._path("idf", ver))
+
+            data = np.load(self._path("data", ver), mmap_mode="r")
+            indices = np.load(self._path("indices", ver), mmap_mode="r")
+            indptr = np.load(self._path("indptr", ver), mmap_mode="r")
+            offsets = np.load(self._path("offsets", ver), mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return False
+
+        self.vectorizer = vectorizer
+        self.matrix = sp.csr_matrix((data, indices, indptr), shape=(meta["n_docs"], meta["n_features"]), copy=False)
+        self.offsets = offsets
+        self._source_ino = meta.get("source_ino", 0)
+        self._source_size = meta["source_size"]
+        self._source_mtime = meta["source_mtime"]
+        self._n_fit_docs = meta["n_fit_docs"]
+        self._version = ver
+        return True
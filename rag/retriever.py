@@ -0,0 +1,453 @@
+# rag/retriever.py
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rag.index import TfidfIndex, open_jsonl, read_jsonl_lines, read_jsonl_item
+
+
+EMBED_MODEL = "BAAI/bge-small-zh-v1.5"
+STALE_CACHE_SECONDS = 600
+
+Hits = List[Tuple[int, float]]
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """按分数从高到低返回前 k 个下标；argpartition 选出候选后只对 k 个排序，O(N + k log k)"""
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+# ——————————————————————————— 检索器接口 ———————————————————————————
+# VisionRAG 只依赖以下接口：
+#   refresh()                源 JSONL 变化时更新索引
+#   ready                    是否可检索（库为空 / 文本无法建索引时为 False）
+#   search(queries, top_k)   每个 query 返回 [(记录下标, 相似度), ...]，按相似度降序
+#   get_item(i)              读取第 i 条原始记录
+#   min_scores               各知识库的默认相似度阈值（{"visual": ..., "strategy": ...}），
+#                            不同检索器的相似度取值范围不同，阈值随检索器给出
+class Retriever(ABC):
+
+    min_scores: Dict[str, float]
+
+    @abstractmethod
+    def refresh(self) -> bool:
+        ...
+
+    @property
+    @abstractmethod
+    def ready(self) -> bool:
+        ...
+
+    @abstractmethod
+    def search(self, queries: List[str], top_k: int) -> List[Hits]:
+        ...
+
+    @abstractmethod
+    def get_item(self, i: int) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def __len__(self):
+        ...
+
+
+class TfidfRetriever(Retriever):
+    """字符 n-gram TF-IDF（持久化索引见 rag/index.py）"""
+
+    min_scores = {"visual": 0.10, "strategy": 0.15}
+
+    def __init__(self, source_path: str, text_fn: Callable[[Dict[str, Any]], str], **kwargs):
+        self.index = TfidfIndex(source_path, text_fn, **kwargs)
+
+    def refresh(self) -> bool:
+        return self.index.refresh()
+
+    @property
+    def ready(self) -> bool:
+        return self.index.vectorizer is not None and len(self.index) > 0
+
+    def search(self, queries: List[str], top_k: int) -> List[Hits]:
+        sims = self.index.scores(self.index.transform(queries))
+        return [[(int(i), float(row[i])) for i in top_k_indices(row, top_k)] for row in sims]
+
+    def get_item(self, i: int) -> Dict[str, Any]:
+        return self.index.get_item(i)
+
+    def __len__(self):
+        return len(self.index)
+
+
+# ——————————————————————————— 稠密向量 ———————————————————————————
+class TextEmbedder:
+    """
+    本地文本向量模型（默认 bge-small-zh，中英文均可），输出 L2 归一化向量。
+    模型在第一次 encode 时才加载。
+    """
+
+    def __init__(self, model_name: str = EMBED_MODEL, device: Optional[str] = None,
+                 pooling: str = "cls", batch_size: int = 32, max_length: int = 256):
+        if pooling not in ("cls", "mean"):
+            raise ValueError(f"unknown pooling: {pooling}")
+        self.model_name = model_name
+        self.device = device
+        self.pooling = pooling
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+        self.tokenizer = None
+        self.model = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"{self.model_name}:{self.pooling}:{self.max_length}"
+
+    def _load(self):
+        with self._lock:
+            if self.model is not None:
+                return
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+            device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.model = AutoModel.from_pretrained(self.model_name).to(device).eval()
+            self.device = device
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if self.model is None:
+            self._load()
+        import torch
+
+        out = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = self.tokenizer(
+                texts[i:i + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="pt"
+            ).to(self.device)
+            with torch.inference_mode():
+                hidden = self.model(**batch).last_hidden_state
+            if self.pooling == "cls":
+                emb = hidden[:, 0]
+            else:
+                m = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                emb = (hidden * m).sum(1) / m.sum(1).clamp(min=1e-6)
+            emb = torch.nn.functional.normalize(emb.float(), dim=-1)
+            out.append(emb.cpu().numpy())
+        if not out:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(out).astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def shared_embedder(model_name: str = EMBED_MODEL) -> TextEmbedder:
+    """同一进程内按模型名共享的向量模型：视觉概念库与策略库的检索器共用一份权重"""
+    return TextEmbedder(model_name)
+
+
+class IVFIndex:
+    """
+    倒排文件（IVF）近似最近邻：k-means 把向量分到 nlist 个簇，
+    查询时只在与 query 最近的 nprobe 个簇内做精确内积。
+    新增向量直接归入最近的簇，不重新训练。
+    """
+
+    def __init__(self, nlist: int, nprobe: int = 8, n_iter: int = 10, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.seed = seed
+
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        self.n_trained = 0
+
+    def train(self, vectors: np.ndarray) -> None:
+        n = vectors.shape[0]
+        nlist = max(1, min(self.nlist, n))
+        rng = np.random.default_rng(self.seed)
+        centroids = vectors[rng.choice(n, nlist, replace=False)].copy()
+
+        for _ in range(self.n_iter):
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = vectors[assign == c]
+                if len(members):
+                    v = members.sum(0)
+                    centroids[c] = v / max(np.linalg.norm(v), 1e-12)
+
+        self.centroids = centroids
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        self.lists = [np.flatnonzero(assign == c) for c in range(nlist)]
+        self.n_trained = n
+
+    def add(self, vectors: np.ndarray, start: int) -> None:
+        assign = np.argmax(vectors @ self.centroids.T, axis=1)
+        for c in np.unique(assign):
+            ids = start + np.flatnonzero(assign == c)
+            self.lists[c] = np.concatenate([self.lists[c], ids])
+
+    def search(self, vectors: np.ndarray, queries: np.ndarray, top_k: int) -> List[Hits]:
+        nprobe = min(self.nprobe, len(self.lists))
+        coarse = queries @ self.centroids.T
+        results = []
+        for q, row in zip(queries, coarse):
+            probe = top_k_indices(row, nprobe)
+            cand = np.concatenate([self.lists[c] for c in probe])
+            sims = vectors[cand] @ q
+            results.append([(int(cand[j]), float(sims[j])) for j in top_k_indices(sims, top_k)])
+        return results
+
+
+class DenseRetriever(Retriever):
+    """
+    稠密向量检索，能召回“collector ↔ pantograph”这类字面不相似的同义表达。
+
+    向量按 文本哈希 缓存在 <source>.dense/ 下（vectors.npy + keys.json），
+    只有新增 / 修改过的记录需要重新编码；缓存超过 max_cache_items 条时丢弃最早编码且当前未用到的向量。
+    未指定 embedder 时使用进程内共享的 shared_embedder()，多个库只加载一次模型。
+    库规模小于 ann_min_items 时做精确内积 + argpartition，否则走 IVF 近似检索。
+    bge 类模型的归一化向量之间，无关文本的余弦相似度通常也在 0.3 左右，阈值相应更高。
+    """
+
+    min_scores = {"visual": 0.45, "strategy": 0.5}
+
+    def __init__(
+            self,
+            source_path: str,
+            text_fn: Callable[[Dict[str, Any]], str],
+            embedder: Optional[TextEmbedder] = None,
+            index_dir: Optional[str] = None,
+            ann_min_items: int = 4096,
+            nprobe: int = 16,
+            retrain_ratio: float = 0.5,
+            max_cache_items: int = 200_000
+        ):
+        self.source_path = source_path
+        self.text_fn = text_fn
+        self.embedder = embedder or shared_embedder()
+        self.index_dir = index_dir or source_path + ".dense"
+        self.ann_min_items = ann_min_items
+        self.nprobe = nprobe
+        self.retrain_ratio = retrain_ratio
+        self.max_cache_items = max_cache_items
+
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.ivf: Optional[IVFIndex] = None
+
+        self._source = None                 # 当前 offsets 所对应文件的只读句柄（见 rag.index.open_jsonl）
+        self._source_ino = 0
+        self._source_size = 0
+        self._source_mtime = 0.0
+        self._lock = threading.RLock()
+        self._items: Dict[int, Dict[str, Any]] = {}
+
+        self._cache_keys: List[str] = []
+        self._cache_vectors = np.zeros((0, 0), dtype=np.float32)
+        self._cache_files: Tuple[str, ...] = ()      # 本实例上次写出的缓存文件
+        self._load_cache()
+        self.refresh()
+
+    # ——————————————————————————— 查询 ———————————————————————————
+    @property
+    def ready(self) -> bool:
+        return len(self) > 0
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def search(self, queries: List[str], top_k: int) -> List[Hits]:
+        q = self.embedder.encode(queries)
+        if self.ivf is not None:
+            return self.ivf.search(self.vectors, q, top_k)
+        sims = q @ self.vectors.T
+        return [[(int(i), float(row[i])) for i in top_k_indices(row, top_k)] for row in sims]
+
+    def get_item(self, i: int) -> Dict[str, Any]:
+        item = self._items.get(i)
+        if item is None:
+            with self._lock:
+                item = read_jsonl_item(self._source, self.offsets[i])
+            self._items[i] = item
+        return item
+
+    # ——————————————————————————— 更新 ———————————————————————————
+    def refresh(self) -> bool:
+        with self._lock:
+            try:
+                st = os.stat(self.source_path)
+            except FileNotFoundError:
+                return self._clear()
+
+            if (st.st_ino == self._source_ino and st.st_size == self._source_size
+                    and st.st_mtime == self._source_mtime):
+                return False
+
+            f, st = open_jsonl(self.source_path)
+            if f is None:
+                return self._clear()
+
+            # 同一文件只追加时从上次读到的位置继续；被替换（压缩）或改写时换用新句柄整体重读
+            append = (st.st_ino == self._source_ino and st.st_size > self._source_size
+                      and len(self) > 0)
+            if append:
+                f.close()
+            else:
+                if self._source is not None:
+                    self._source.close()
+                self._source = f
+            start = self._source_size if append else 0
+            offsets, texts, end = read_jsonl_lines(self._source, start, self.text_fn)
+            new_vectors = self._embed(texts)
+
+            if append:
+                base = len(self)
+                self.vectors = np.concatenate([self.vectors, new_vectors]) if len(new_vectors) else self.vectors
+                self.offsets = np.concatenate([self.offsets, np.asarray(offsets, dtype=np.int64)])
+            else:
+                base = 0
+                self.vectors = new_vectors
+                self.offsets = np.asarray(offsets, dtype=np.int64)
+                self._items.clear()
+                self.ivf = None
+            self._source_ino = st.st_ino
+            self._source_size = end
+            self._source_mtime = st.st_mtime
+
+            self._update_ann(base)
+            return bool(texts) or not append
+
+    def _clear(self) -> bool:
+        changed = len(self) > 0
+        if self._source is not None:
+            self._source.close()
+        self._source = None
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.ivf = None
+        self._items.clear()
+        self._source_ino, self._source_size, self._source_mtime = 0, 0, 0.0
+        return changed
+
+    def _update_ann(self, base: int) -> None:
+        n = len(self)
+        if n < self.ann_min_items:
+            self.ivf = None
+            return
+        if self.ivf is None or n > self.ivf.n_trained * (1 + self.retrain_ratio):
+            self.ivf = IVFIndex(nlist=int(np.sqrt(n)), nprobe=self.nprobe)
+            self.ivf.train(self.vectors)
+        elif n > base:
+            self.ivf.add(self.vectors[base:], base)
+
+    # ——————————————————————————— 向量缓存 ———————————————————————————
+    def _key(self, text: str) -> str:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        keys = [self._key(t) for t in texts]
+        known = {k: i for i, k in enumerate(self._cache_keys)}
+        missing = sorted({k: t for k, t in zip(keys, texts) if k not in known}.items())
+
+        if missing:
+            new = self.embedder.encode([t for _, t in missing])
+            if len(self._cache_keys):
+                self._cache_vectors = np.concatenate([self._cache_vectors, new])
+            else:
+                self._cache_vectors = new
+            for k, _ in missing:
+                known[k] = len(self._cache_keys)
+                self._cache_keys.append(k)
+            if len(self._cache_keys) > self.max_cache_items:
+                self._trim_cache(set(keys))
+                known = {k: i for i, k in enumerate(self._cache_keys)}
+            self._save_cache()
+
+        if not keys:
+            return np.zeros((0, self._cache_vectors.shape[1] if self._cache_vectors.ndim == 2 else 0),
+                            dtype=np.float32)
+        return np.ascontiguousarray(self._cache_vectors[[known[k] for k in keys]], dtype=np.float32)
+
+    def _load_cache(self) -> None:
+        meta_path = os.path.join(self.index_dir, "meta.json")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("embedder") != self.embedder.name:
+                return
+            with open(os.path.join(self.index_dir, meta["keys"]), "r", encoding="utf-8") as f:
+                keys = json.load(f)
+            vectors = np.load(os.path.join(self.index_dir, meta["vectors"]))
+        except (OSError, ValueError, KeyError):
+            return
+        if len(keys) == len(vectors):
+            self._cache_keys, self._cache_vectors = keys, vectors
+
+    def _trim_cache(self, in_use) -> None:
+        """按编码先后丢弃最早的向量，直到不超过 max_cache_items；本次要用到的向量保留"""
+        excess = len(self._cache_keys) - self.max_cache_items
+        keep = np.ones(len(self._cache_keys), dtype=bool)
+        for i, k in enumerate(self._cache_keys):
+            if excess <= 0:
+                break
+            if k not in in_use:
+                keep[i] = False
+                excess -= 1
+        self._cache_keys = [k for k, kept in zip(self._cache_keys, keep) if kept]
+        self._cache_vectors = self._cache_vectors[keep]
+
+    def _save_cache(self) -> None:
+        os.makedirs(self.index_dir, exist_ok=True)
+        ver = f"{time.time_ns()}-{os.getpid()}"
+        keys_name, vectors_name = f"keys.{ver}.json", f"vectors.{ver}.npy"
+        with open(os.path.join(self.index_dir, keys_name), "w", encoding="utf-8") as f:
+            json.dump(self._cache_keys, f)
+        np.save(os.path.join(self.index_dir, vectors_name), self._cache_vectors)
+
+        meta = {"embedder": self.embedder.name, "keys": keys_name, "vectors": vectors_name}
+        tmp = os.path.join(self.index_dir, f"meta.json.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.index_dir, "meta.json"))
+
+        # 只删除本实例上次写出的文件；其他进程写出的旧版本可能正被加载，
+        # 超过 STALE_CACHE_SECONDS 且不再被 meta.json 引用时才清理
+        old, self._cache_files = self._cache_files, (keys_name, vectors_name)
+        now = time.time()
+        for name in os.listdir(self.index_dir):
+            if not name.startswith(("keys.", "vectors.")) or name in self._cache_files:
+                continue
+            path = os.path.join(self.index_dir, name)
+            try:
+                if name in old or now - os.path.getmtime(path) > STALE_CACHE_SECONDS:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+RETRIEVERS = {
+    "tfidf": TfidfRetriever,
+    "dense": DenseRetriever,
+}
+
+
+def make_retriever(kind: str, source_path: str, text_fn: Callable[[Dict[str, Any]], str], **kwargs) -> Retriever:
+    if kind not in RETRIEVERS:
+        raise ValueError(f"unknown retriever: {kind} (choose from {list(RETRIEVERS)})")
+    return RETRIEVERS[kind](source_path, text_fn, **kwargs)
@@ -1,36 +1,203 @@
 # rag/strategy_writer.py
+import fcntl
 import json
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Any, Dict, List, Tuple
 
 
 def summarize_strategy(memory):
-    steps = memory.steps   # 假设你内部是 list[dict]
-
-    path = []
-
-    for s in steps:
-        tool = s["tool"]
-        params = s.get("params", {})
-        if params:
-            path.append(f"{tool}({params})")
-        else:
-            path.append(tool)
-
+    """
+    path: 工具名序列（供检索与展示）
+    steps: 完整的步骤记录（Step.to_dict），可无损还原为 Memory 并直接回放
+    扇出轮中未被采用的候选不计入策略
+    """
+    steps = [s for s in memory.steps if not s.candidate]
     return {
-        "path": path,
+        "path": [s.tool for s in steps],
+        "steps": [s.to_dict() for s in steps],
     }
 
 
+def strategy_key(record: Dict[str, Any]) -> Tuple[str, Tuple[str, ...]]:
+    """去重键：(规范化对象名, 策略路径)；有结构化步骤时按 工具 + 参数 比较"""
+    obj = " ".join(str(record.get("object") or "").split()).lower()
+    ss = record.get("strategy_summary") or {}
+    if ss.get("steps"):
+        path = [json.dumps([s.get("tool"), s.get("params") or {}], sort_keys=True, ensure_ascii=False)
+                for s in ss["steps"]]
+    else:
+        path = ss.get("path") or []
+    return obj, tuple(path)
+
+
 class StrategyWriter:
+    """
+    成功策略库（JSONL，VisionRAG 直接检索这个文件）。
+
+    - 写入：对 <path>.lock 加排他文件锁后追加整行，多进程 / 多线程并发写不会交错
+    - 去重：(对象, 策略路径) 相同且置信度不更高的记录直接丢弃
+    - 压缩：每个对象只保留置信度最高的 max_per_object 条，
+      出现重复或超额时在后台线程重写文件（临时文件 + os.replace，读者总能读到完整文件）
+    """
 
-    def __init__(self, path="/home/kexin/hd1/zkf/VisionManus/rag/strategy_cases.jsonl"):
+    def __init__(
+            self,
+            path="/home/kexin/hd1/zkf/VisionManus/rag/strategy_cases.jsonl",
+            max_per_object: int = 5,
+            background_compaction: bool = True
+        ):
         self.path = path
-        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock_path = path + ".lock"
+        self.max_per_object = max_per_object
+        self.background_compaction = background_compaction
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        # 已有记录的去重信息，文件变化（其他进程写入 / 压缩）时重新读取
+        self._best: Dict[Tuple[str, Tuple[str, ...]], float] = {}
+        self._counts: Dict[str, int] = {}
+        self._stat = None
+
+        self._thread_lock = threading.Lock()
+        self._compacting = threading.Event()
+        self.appended = 0
+        self.skipped = 0
+        self.compactions = 0
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_records(self) -> List[Dict[str, Any]]:
+        records = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        records.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+        return records
+
+    def _sync(self) -> None:
+        """文件自上次读取后有变化时重建去重信息（调用方持有锁）"""
+        try:
+            st = os.stat(self.path)
+            stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            stat = None
+        if stat == self._stat:
+            return
+
+        self._best.clear()
+        self._counts.clear()
+        for r in self._read_records():
+            self._track(r)
+        self._stat = stat
+
+    def _track(self, record: Dict[str, Any]) -> None:
+        key = strategy_key(record)
+        conf = float(record.get("confidence", 0.0))
+        self._best[key] = max(conf, self._best.get(key, float("-inf")))
+        self._counts[key[0]] = self._counts.get(key[0], 0) + 1
 
-    def append(self, record: dict):
+    # ——————————————————————————— 写入 ———————————————————————————
+    def append(self, record: dict) -> bool:
+        """写入一条策略；被去重丢弃时返回 False"""
         record = dict(record)
         record["created_at"] = datetime.now().strftime("%Y-%m-%d")
+        key = strategy_key(record)
+        conf = float(record.get("confidence", 0.0))
+
+        with self._locked():
+            self._sync()
+            prev = self._best.get(key)
+            if prev is not None and prev >= conf:
+                self.skipped += 1
+                return False
+
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+            self._track(record)
+            st = os.stat(self.path)
+            self._stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+            self.appended += 1
+            # 替换了更低置信度的同路径记录，或该对象超出配额 → 需要压缩
+            need_compact = prev is not None or self._counts[key[0]] > self.max_per_object
+
+        if need_compact:
+            self._schedule_compaction()
+        return True
+
+    # ——————————————————————————— 压缩 ———————————————————————————
+    def _schedule_compaction(self) -> None:
+        if not self.background_compaction:
+            self.compact()
+            return
+        if self._compacting.is_set():
+            return
+        self._compacting.set()
+
+        def worker():
+            try:
+                self.compact()
+            finally:
+                self._compacting.clear()
+
+        threading.Thread(target=worker, name="strategy-compaction", daemon=True).start()
+
+    def compact(self) -> int:
+        """去重并按对象保留置信度最高的记录；返回删除的条数"""
+        with self._locked():
+            records = self._read_records()
+
+            # 同一 (对象, 路径) 只保留置信度最高的一条（相同则保留较新的）
+            best: Dict[Tuple[str, Tuple[str, ...]], Tuple[int, Dict[str, Any]]] = {}
+            for i, r in enumerate(records):
+                key = strategy_key(r)
+                if key not in best or float(r.get("confidence", 0.0)) >= float(best[key][1].get("confidence", 0.0)):
+                    best[key] = (i, r)
+
+            by_object: Dict[str, List[Tuple[int, Dict[str, Any]]]] = {}
+            for key, item in best.items():
+                by_object.setdefault(key[0], []).append(item)
+
+            kept = []
+            for items in by_object.values():
+                items.sort(key=lambda x: (-float(x[1].get("confidence", 0.0)), -x[0]))
+                kept.extend(items[:self.max_per_object])
+            kept.sort(key=lambda x: x[0])   # 保持原有写入顺序
+
+            removed = len(records) - len(kept)
+            if removed:
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    for _, r in kept:
+                        f.write(json.dumps(r, ensure_ascii=False) + "\n")
+                os.replace(tmp, self.path)
+                self.compactions += 1
+
+            self._stat = None
+            self._sync()
+            return removed
 
-        with open(self.path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    def stats(self) -> dict:
+        return {
+            "appended": self.appended,
+            "skipped_duplicates": self.skipped,
+            "compactions": self.compactions,
+            "objects": len(self._counts),
+        }
@@ -1,12 +1,10 @@
 # rag/vision_rag.py
-import json
 import os
+import threading
 from dataclasses import dataclass
 from typing import List, Dict, Any, Optional, Tuple
 
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from rag.retriever import Hits, Retriever, make_retriever
 
 
 @dataclass
@@ -47,123 +45,147 @@ class VisualConcept:
         )
 
 
+def _normalize(task_object: str) -> str:
+    """对象名规范化：去首尾空白、合并连续空白、转小写"""
+    return " ".join((task_object or "").split()).lower()
+
+
+def _visual_text(d: Dict[str, Any]) -> str:
+    # 构造可检索文本：object + aliases + tags + prior + failure_modes + suggestions
+    vc = VisualConcept.from_dict(d)
+    return " ".join(
+        [vc.object]
+        + vc.aliases
+        + vc.tags
+        + [vc.prior]
+        + vc.failure_modes
+        + vc.suggestions
+    )
+
+
+def _strategy_text(d: Dict[str, Any]) -> str:
+    ss = d.get("strategy_summary", {})
+    return " ".join(
+        [d.get("object", "")]
+        + ss.get("path", [])
+        + ss.get("key_decisions", [])
+    )
+
+
+# 作为占位符或由任务绑定的参数，不在策略路径中展示
+_BOUND_PARAMS = {"class_name", "img", "mask"}
+
+
+def _format_path(ss: Dict[str, Any]) -> str:
+    """策略路径：有结构化步骤时带上各步的关键参数，如 split_image_patches(cols=2, overlap=32, rows=2)"""
+    steps = ss.get("steps")
+    if not steps:
+        return " -> ".join(ss.get("path", []))
+    parts = []
+    for step in steps:
+        params = step.get("params") or {}
+        shown = ", ".join(
+            f"{k}={v}" for k, v in params.items()
+            if k not in _BOUND_PARAMS and not isinstance(v, (dict, list))
+        )
+        parts.append(f"{step.get('tool')}({shown})" if shown else str(step.get("tool")))
+    return " -> ".join(parts)
+
+
 class VisionRAG:
     """
     轻量级 RAG：TF-IDF + cosine 相似度，用于“任务对象视觉知识增强”.
+
+    两个知识库的索引持久化在 <db>.jsonl.index/ 下（见 rag/index.py），
+    启动时直接 mmap 加载；每次检索前检查源文件，新写入的策略无需重启即可检索到。
+    retriever="dense" 时改用稠密向量 + ANN 检索（见 rag/retriever.py）。
+    min_score 不指定时使用检索器自己的默认阈值（Retriever.min_scores）。
     """
 
     def __init__(
             self, 
             visual_db_path: str,
-            strategy_db_path: str
+            strategy_db_path: str,
+            retriever: str = "tfidf",
+            **retriever_kwargs
         ):
         self.strategy_db_path = strategy_db_path
         self.visual_db_path = visual_db_path
 
-        self.strategy_items: List[Dict[str, Any]] = []
-        self.items: List[VisualConcept] = []
-        self.doc_matrix = None
-        
-        self._load_and_build()
-        self._load_strategy_cases()
-
-    def _load_and_build(self) -> None:
         if not os.path.exists(self.visual_db_path):
             raise FileNotFoundError(f"visual concept db not found: {self.visual_db_path}")
 
-        items: List[VisualConcept] = []
-        texts: List[str] = []
-
-        with open(self.visual_db_path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                d = json.loads(line)
-                vc = VisualConcept.from_dict(d)
-                items.append(vc)
-
-                # 构造可检索文本：object + aliases + tags + prior + failure_modes + suggestions
-                text = " ".join(
-                    [vc.object]
-                    + vc.aliases
-                    + vc.tags
-                    + [vc.prior]
-                    + vc.failure_modes
-                    + vc.suggestions
-                )
-                texts.append(text)
-
-        self.items = items
-        self.vectorizer = TfidfVectorizer(
-            analyzer="char",
-            ngram_range=(2, 5),
-            min_df=1
-        )
-        self.doc_matrix = self.vectorizer.fit_transform(texts)
-
-    def _load_strategy_cases(self) -> None:
-        items = []
-        texts = []
-
-        with open(self.strategy_db_path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                d = json.loads(line)
-                items.append(d)
-
-                ss = d.get("strategy_summary", {})
-                text = " ".join(
-                    [d.get("object", "")]
-                    + ss.get("path", [])
-                    + ss.get("key_decisions", [])
-                )
-                texts.append(text)
-
-        if not items:
-            self.strategy_items = []
-            self.strategy_vectorizer = None
-            self.strategy_doc_matrix = None
-            return
-
-        self.strategy_items = items
-        self.strategy_vectorizer = TfidfVectorizer(
-            analyzer="char",
-            ngram_range=(2, 5),
-            min_df=1
-        )
-        self.strategy_doc_matrix = self.strategy_vectorizer.fit_transform(texts)
+        self.visual_index: Retriever = make_retriever(retriever, visual_db_path, _visual_text, **retriever_kwargs)
+        self.strategy_index: Retriever = make_retriever(retriever, strategy_db_path, _strategy_text, **retriever_kwargs)
+
+        # (规范化对象名, top_k) → [(记录下标, 相似度), ...]
+        self._visual_memo: Dict[Tuple[str, int], Hits] = {}
+        self._strategy_memo: Dict[Tuple[str, int], Hits] = {}
+        self._memo_lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """热更新：源 JSONL 有追加 / 改写时更新索引"""
+        with self._memo_lock:
+            if self.visual_index.refresh():
+                self._visual_memo.clear()
+            if self.strategy_index.refresh():
+                self._strategy_memo.clear()
 
+    def _search_memoized(self, index: Retriever, memo: Dict, task_objects: List[str], top_k: int) -> List[Hits]:
+        """
+        批量检索：未命中缓存的对象名一次性向量化、做一次矩阵乘法；
+        结果按 规范化对象名 缓存，索引变化（refresh 返回 True）时清空。
+        """
+        keys = [(_normalize(t), top_k) for t in task_objects]
+        todo = sorted({k for k in keys if k[0] and k not in memo})
+        if todo and index.ready:
+            ranked = index.search([name for name, _ in todo], top_k)
+            with self._memo_lock:
+                memo.update(zip(todo, ranked))
+        return [memo.get(k, []) for k in keys]
+
+    # ——————————————————————————— 视觉概念 ———————————————————————————
     def retrieve_visual_concept(
         self,
         task_object: str,
         top_k: int = 2,
-        min_score: float = 0.10
+        min_score: Optional[float] = None
     ) -> Tuple[str, List[Dict[str, Any]]]:
         """
         返回：
           - prompt_context: 适合直接注入 LLM 的文本块
           - debug_hits: 命中详情（用于日志/调试）
         """
-        if not task_object or self.vectorizer is None or self.doc_matrix is None:
-            return "[Visual Concept]\n- No prior available.\n", []
+        return self.retrieve_visual_concept_batch([task_object], top_k, min_score)[0]
 
-        q = task_object.strip()
-        q_vec = self.vectorizer.transform([q])
-        sims = cosine_similarity(q_vec, self.doc_matrix).reshape(-1)
+    def retrieve_visual_concept_batch(
+        self,
+        task_objects: List[str],
+        top_k: int = 2,
+        min_score: Optional[float] = None
+    ) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """批处理前已知全部任务对象时使用；返回值与 retrieve_visual_concept 逐个对应"""
+        self.refresh()
+        index = self.visual_index
+        if min_score is None:
+            min_score = index.min_scores["visual"]
+        ranked_list = self._search_memoized(index, self._visual_memo, task_objects, top_k)
+        return [
+            self._format_visual(index, task_object, ranked, top_k, min_score)
+            for task_object, ranked in zip(task_objects, ranked_list)
+        ]
+
+    def _format_visual(self, index, task_object, ranked, top_k, min_score):
+        if not task_object or not index.ready:
+            return "[Visual Concept]\n- No prior available.\n", []
 
-        # 取 top_k
-        idxs = np.argsort(-sims)[:top_k]
         hits = []
         blocks = []
 
-        for idx in idxs:
-            score = float(sims[idx])
+        for idx, score in ranked:
             if score < min_score:
                 continue
-            vc = self.items[idx]
+            vc = VisualConcept.from_dict(index.get_item(idx))
             blocks.append(vc.to_prompt_block())
             hits.append({
                 "object": vc.object,
@@ -183,22 +205,37 @@ class VisionRAG:
         # 合并为一个 context（可控长度）
         prompt_context = "\n".join(blocks[:top_k])
         return prompt_context, hits
-    
+
+    # ——————————————————————————— 历史策略 ———————————————————————————
     def retrieve_strategy_cases(
         self,
         task_object: str,
         top_k: int = 2,
-        min_score: float = 0.15,
+        min_score: Optional[float] = None,
         min_confidence: float = 0.6
     ) -> Tuple[str, List[Dict[str, Any]]]:
+        return self.retrieve_strategy_cases_batch([task_object], top_k, min_score, min_confidence)[0]
 
+    def retrieve_strategy_cases_batch(
+        self,
+        task_objects: List[str],
+        top_k: int = 2,
+        min_score: Optional[float] = None,
+        min_confidence: float = 0.6
+    ) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        self.refresh()
+        index = self.strategy_index
+        if min_score is None:
+            min_score = index.min_scores["strategy"]
+        ranked_list = self._search_memoized(index, self._strategy_memo, task_objects, top_k)
+        return [
+            self._format_strategy(index, task_object, ranked, top_k, min_score, min_confidence)
+            for task_object, ranked in zip(task_objects, ranked_list)
+        ]
+
+    def _format_strategy(self, index, task_object, ranked, top_k, min_score, min_confidence):
         # ===== 防御：策略库不可用 =====
-        if (
-            not task_object
-            or self.strategy_vectorizer is None
-            or self.strategy_doc_matrix is None
-            or not self.strategy_items
-        ):
+        if not task_object or not index.ready:
             return (
                 "[Historical Strategies]\n"
                 f"- object: {task_object}\n"
@@ -206,21 +243,14 @@ class VisionRAG:
                 []
             )
 
-        q = task_object.strip()
-        q_vec = self.strategy_vectorizer.transform([q])
-        sims = cosine_similarity(q_vec, self.strategy_doc_matrix).reshape(-1)
-
-        # 取 top_k
-        idxs = np.argsort(-sims)[:top_k]
         hits = []
         blocks = []
 
-        for idx in idxs:
-            sim = float(sims[idx])
+        for idx, sim in ranked:
             if sim < min_score:
                 continue
 
-            case = self.strategy_items[idx]
+            case = index.get_item(idx)
             if case.get("confidence", 0) < min_confidence:
                 continue
 
@@ -231,7 +261,7 @@ class VisionRAG:
                 "[Historical Strategy]\n"
                 f"- object: {case.get('object')}\n"
                 f"- rounds: {ss.get('rounds')}\n"
-                f"- strategy path: {' -> '.join(ss.get('path', []))}\n"
+                f"- strategy path: {_format_path(ss)}\n"
                 f"- key decisions: {'；'.join(ss.get('key_decisions', []))}\n"
                 f"- final score: {fs}\n"
             )
@@ -241,7 +271,8 @@ class VisionRAG:
                 "similarity": sim,
                 "confidence": case.get("confidence"),
                 "rounds": ss.get("rounds"),
-                "path": ss.get("path")
+                "path": ss.get("path"),
+                "steps": ss.get("steps")
             })
 
             if len(blocks) >= top_k:
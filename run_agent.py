@@ -1,21 +1,14 @@
 # streamlit run run_agent.py --server.address 0.0.0.0
 import streamlit as st
-import numpy as np
 from PIL import Image
-import time, json
-
-from agent.evaluation import evaluate
-from agent.planner import Planner
-from agent.prompts import task_understanding_prompt, router_prompt, router_prompt_rag, soft_evaluation_prompt
-from agent.segment import segmenter_iSeg
-from agent.memory import Memory
+import numpy as np
+import io
+import os
+import time
 
-from tools.base import TOOL_REGISTRY
+from agent.pipeline import VisionManusPipeline, Job, MAX_RETRY, VISUAL_DB_PATH, STRATEGY_DB_PATH
 
 from rag.vision_rag import VisionRAG
-from rag.strategy_writer import StrategyWriter, summarize_strategy
-
-MAX_RETRY=3
 
 
 # ——————————————————————————— 页面基础 ———————————————————————————
@@ -41,18 +34,36 @@ st.markdown(
 USER_AVATAR="https://cdn-icons-png.flaticon.com/512/149/149071.png"
 SYS_AVATAR="https://cdn-icons-png.flaticon.com/512/4712/4712109.png"
 
+# 每条消息的 HTML 只生成一次；页面重跑时历史消息合并为一个元素输出，
+# 运行过程中只追加新消息，不再整段重绘
+def chat_bubble(role, msg):
+    if role == "user":
+        return f"""<div class="chat-row-user">
+        <img class="chat-avatar" src="{USER_AVATAR}">
+        <div class="chat-bubble-user">{msg}</div></div>"""
+    return f"""<div class="chat-row-sys">
+    <img class="chat-avatar" src="{SYS_AVATAR}">
+    <div class="chat-bubble-sys">{msg}</div></div>"""
+
+
 def render_chat(logs):
-    st.markdown('<div class="chat-area">', unsafe_allow_html=True)
-    for role,msg in logs:
-        if role=="user":
-            st.markdown(f"""<div class="chat-row-user">
-            <img class="chat-avatar" src="{USER_AVATAR}">
-            <div class="chat-bubble-user">{msg}</div></div>""", unsafe_allow_html=True)
-        else:
-            st.markdown(f"""<div class="chat-row-sys">
-            <img class="chat-avatar" src="{SYS_AVATAR}">
-            <div class="chat-bubble-sys">{msg}</div></div>""", unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
+    if logs:
+        st.markdown('<div class="chat-area">' + "".join(chat_bubble(r, m) for r, m in logs) + "</div>",
+                    unsafe_allow_html=True)
+
+
+# mask 在产生时编码一次为缩小的 PNG 缩略图，历史视图只发送缩略图；
+# 原分辨率 mask 以 bit-packed 的 Mask 保存在会话中，仅在用户选择查看时解码发送
+THUMB_MAX_SIDE = 400
+
+
+def encode_thumbnail(mask, max_side=THUMB_MAX_SIDE):
+    img = Image.fromarray(np.asarray(mask, dtype=np.uint8))
+    # BOX 采样按面积平均，细小结构缩小后仍以灰度保留
+    img.thumbnail((max_side, max_side), Image.BOX)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
 
 
 # ——————————————————————————— Session State ———————————————————————————
@@ -62,6 +73,8 @@ if "running" not in st.session_state:
     st.session_state.running=False
 if "masks" not in st.session_state: 
     st.session_state.masks=[]
+if "mask_thumbs" not in st.session_state:
+    st.session_state.mask_thumbs=[]
 
 
 # ——————————————————————————— Sidebar ———————————————————————————
@@ -76,253 +89,120 @@ with st.sidebar:
     run = st.button("运行 Vision Manus")
 
 
+# ——————————————————————————— 新任务 ———————————————————————————
+# 在绘制页面之前清空上一次的中间结果
+if run and user_prompt and st.session_state.get("image") is not None:
+    st.session_state.running=True
+    st.session_state.masks=[]
+    st.session_state.mask_thumbs=[]
+    st.session_state.final_mask = None
+    st.session_state.final_thumb = None
+
+
 # ——————————————————————————— 主布局 ———————————————————————————
 st.title("Vision Manus")
 st.markdown("---")
 main_col, right_col = st.columns([3,2])
 
 with main_col:
-    log_box = st.empty()
+    log_box = st.container()
     image_box = st.empty()
 with right_col:
-    right_box = st.empty()
+    st.markdown("## 🧩 历史 Mask")
+    history_box = st.container()
+    final_box = st.empty()
+    detail_box = st.container()
 
+with log_box:
+    render_chat(st.session_state.logs)
 
-def render_history():
-    with right_box.container():
-        st.markdown("## 🧩 历史 Mask")
-
-        # 历史过程
-        if not st.session_state.masks:
-            st.info("暂无中间结果")
-        else:
-            for i, m in enumerate(st.session_state.masks, 1):
-                st.markdown(f"### 第 {i} 轮 Mask")
-                st.image(m, width=400)
-
-        # 最终结果
-        if st.session_state.get("final_mask") is not None:
+
+def render_mask_entry(i, thumb):
+    with history_box:
+        st.markdown(f"### 第 {i} 轮 Mask")
+        st.image(thumb, width=400)
+
+
+def render_final():
+    if st.session_state.get("final_thumb") is not None:
+        with final_box.container():
             st.markdown("## ✅ 最终 Mask")
-            st.image(st.session_state.final_mask, width=400)
+            st.image(st.session_state.final_thumb, width=400)
 
 
-# ——————————————————————————— RAG ———————————————————————————
+def render_history():
+    """页面重跑时绘制一次已有的缩略图；运行过程中由 on_mask 逐条追加"""
+    with history_box:
+        empty_hint = st.empty()
+    if not st.session_state.mask_thumbs:
+        empty_hint.info("暂无中间结果")
+    for i, thumb in enumerate(st.session_state.mask_thumbs, 1):
+        render_mask_entry(i, thumb)
+    render_final()
+    return empty_hint
+
+
+def render_detail():
+    """按需查看原分辨率 mask"""
+    options = [f"第 {i} 轮" for i in range(1, len(st.session_state.masks) + 1)]
+    if st.session_state.get("final_mask") is not None:
+        options.append("最终")
+    if not options or st.session_state.running:
+        return
+    with detail_box:
+        choice = st.selectbox("查看原分辨率 Mask", ["不显示"] + options)
+        if choice == "最终":
+            st.image(np.asarray(st.session_state.final_mask))
+        elif choice != "不显示":
+            st.image(np.asarray(st.session_state.masks[options.index(choice)]))
+
+
+history_hint = render_history()
+render_detail()
+
+
+# ——————————————————————————— 引擎 ———————————————————————————
 @st.cache_resource
-def load_rag():
-    return VisionRAG(
-        visual_db_path="/home/kexin/hd1/zkf/VisionManus/rag/visual_concepts.jsonl",
-        strategy_db_path="/home/kexin/hd1/zkf/VisionManus/rag/strategy_cases.jsonl"
+def load_pipeline():
+    return VisionManusPipeline(
+        rag=VisionRAG(visual_db_path=VISUAL_DB_PATH, strategy_db_path=STRATEGY_DB_PATH),
+        max_retry=MAX_RETRY,
+        # 设置 VISION_MANUS_SERVER 后多个会话共享常驻模型服务
+        server_url=os.environ.get("VISION_MANUS_SERVER")
     )
 
-rag = load_rag()
-writer = StrategyWriter()
+pipeline = load_pipeline()
 
-RAG_WRITE_THRESHOLD = 0.8
 
+def on_log(role, msg):
+    st.session_state.logs.append((role, msg))
+    with log_box:
+        st.markdown(chat_bubble(role, msg), unsafe_allow_html=True)
 
-# ——————————————————————————— 主流程 ———————————————————————————
-if run and user_prompt and st.session_state.get("image") is not None:
-    st.session_state.running=True
-    st.session_state.masks=[]
-    st.session_state.final_mask = None
-    render_history()
+
+def on_mask(mask):
+    thumb = encode_thumbnail(mask)
+    st.session_state.masks.append(mask)
+    st.session_state.mask_thumbs.append(thumb)
+    history_hint.empty()
+    render_mask_entry(len(st.session_state.mask_thumbs), thumb)
 
 
+# ——————————————————————————— 主流程 ———————————————————————————
 if st.session_state.running:
     with main_col:
-        # 初始化
-        evaluator = evaluate()
-        understander = Planner()
-        memory = Memory()
-
         # 记录用户输入
-        st.session_state.logs.append(("user", user_prompt))
-        with log_box.container(): 
-            render_chat(st.session_state.logs)
-
-        # 使用 LLM 解析用户意图：返回思考过程和结构化任务
-        thinking, task = understander.run(task_understanding_prompt, user_prompt)
-        content = json.loads(task)
-        user_goal,task_object = content["user_goal"],content["task_object"]
-
-        # —— RAG：视觉概念检索（任务对象视觉知识增强）——
-        rag_visual_context, rag_hits = rag.retrieve_visual_concept(task_object, top_k=2)
-        strategy_cases, strategy_hits = rag.retrieve_strategy_cases(task_object)
-
-        st.session_state.logs += [
-            ("sys",f"RAG hits: {rag_hits}"),
-            ("sys",f"Strategy hits: {strategy_hits}"),
-            ("sys",f"思考: {thinking}"),
-            ("sys",f"用户目标: {user_goal}, 任务对象: {task_object}"),
-            ("sys",f"RAG 视觉先验:\n{rag_visual_context}"),
-            ("sys",f"调用 iSeg-Plus 分割模型，最大尝试次数 {MAX_RETRY} 次")
-        ]
-        with log_box.container(): 
-            render_chat(st.session_state.logs)
-
-        # 初始化分割模型
-        image_seg = segmenter_iSeg()
-
-        # 获取输入图像
-        IMG = np.array(st.session_state.image)
-
-        # 初始化尝试次数与工具名
-        attempt=1
-        tool=""
-        params = {}
-
-        # 用于回退：记录历史最优结果
-        best_mask = None
-        best_score = -1
-        best_result = None
-
-        # 进入迭代优化
-        while attempt <= MAX_RETRY:
-            st.session_state.logs += [("sys",f"进行第 {attempt} 轮操作")]
-            with log_box.container(): 
-                render_chat(st.session_state.logs)
-
-            # 第一轮：直接分割
-            if attempt == 1:
-                mask = image_seg.segment(task_object, IMG)
-
-                st.session_state.masks.append(mask)
-                render_history()
-
-                # 评估初始分割结果
-                result, coverage_reason, semantic_reason = evaluator.run(IMG, mask, soft_evaluation_prompt, rag_visual_context)
-                st.session_state.logs.append(("sys", f"评分：{result}"))
-                st.session_state.logs.append(("sys", f"覆盖率评估：{coverage_reason}"))
-                st.session_state.logs.append(("sys", f"语义评估：{semantic_reason}"))
-                with log_box.container(): 
-                    render_chat(st.session_state.logs)
-
-                # 记录初始分割
-                memory.add_step({
-                    "round": attempt,
-                    "tool": "iSeg-Plus",
-                    "params": {"class_name": task_object},
-                    "score": result
-                })
-
-            # 非第一轮：使用工具微调
-            if tool != "Terminate" and attempt > 1:
-                mask=TOOL_REGISTRY[tool](**params)
-
-                st.session_state.masks.append(mask)   
-                render_history()
-
-                # 对当前 mask 进行质量评估
-                result, coverage_reason, semantic_reason = evaluator.run(IMG, mask, soft_evaluation_prompt, rag_visual_context)
-                st.session_state.logs.append(("sys", f"评分：{result}"))
-                st.session_state.logs.append(("sys", f"覆盖率评估：{coverage_reason}"))
-                st.session_state.logs.append(("sys", f"语义评估：{semantic_reason}"))
-                with log_box.container(): 
-                    render_chat(st.session_state.logs)
-
-                # ⭐ 记录进记忆器
-                memory.add_step({
-                    "round": attempt,
-                    "tool": tool,
-                    "params": params,
-                    "score": result
-                })
-
-            # print(result)
-            # -------- 更新历史最优 --------
-            score_val = float(result["score"])
-            # print(score_val)
-
-            if score_val > best_score:
-                best_score = score_val
-                best_mask = mask
-                best_result = result
-
-            # ---------- 路由器：结合历史记忆做决策 ----------
-            memory_text = memory.summary()   # 最近几步的摘要
-
-            router_input = {
-                "current_result": result,
-                "history": memory_text,
-                "visual_prior": rag_visual_context,
-                "historical_strategies": strategy_cases
-            }
-            # print(router_input)
-
-            router_thinking, router_answer = understander.run(
-                sys_prompt = router_prompt_rag,
-                user_prompt = json.dumps(router_input, ensure_ascii=False)
-            )
-
-            st.session_state.logs += [
-                ("sys",f"思考: {router_thinking}"),
-                ("sys",f"下一步: {router_answer}")
-            ]
-            with log_box.container(): 
-                render_chat(st.session_state.logs)
-
-            # 解析模型输出
-            router_answer = json.loads(router_answer)
-            tool = router_answer["tool"]
-
-            # 如果模型认为流程应该终止
-            if tool == "Terminate":
-                st.session_state.logs.append(
-                    ("sys",f"流程中止，原因: {router_answer.get('parameters',{}).get('reason','无')}")
-                )
-                render_history()
-                break
-            elif tool == "Pass":
-                st.session_state.logs.append(
-                    ("sys",f"通过，流程中止。")
-                )
-                render_history()
-                break
-            else:
-                # 否则，准备下一步工具调用参数
-                params=router_answer.get("parameters",{})
-                if params.get("img") == "IMG": 
-                    params["img"] = IMG
-                if params.get("class_name") == "task_object":
-                    params["class_name"] = task_object
-                if params.get("mask") == "MASK":
-                    params["mask"] = mask
-
-            attempt += 1
-            time.sleep(0.1)
-
-        # ——————————————————————————— 回退机制 ———————————————————————————
-        if tool == "Terminate" or attempt == MAX_RETRY + 1:
-            st.session_state.logs.append(
-                ("sys", f"未在 {MAX_RETRY} 轮内通过，回退到历史最佳结果，评分={best_score}")
-            )
-            mask = best_mask
+        on_log("user", user_prompt)
+
+        job = Job(job_id=str(int(time.time())), image=st.session_state.image, prompt=user_prompt)
+        result = pipeline.run_job(job, on_log=on_log, on_mask=on_mask)
 
         # ——————————————————————————— 最终输出 ———————————————————————————
-        st.session_state.final_mask = mask
-        render_history()
-
-        st.session_state.logs.append(("sys", "流程结束，输出最终 Mask"))
-        with log_box.container():
-            render_chat(st.session_state.logs)
-
-        # ——————————————————————————— 写入知识库 ———————————————————————————
-        if best_score >= RAG_WRITE_THRESHOLD and tool == "Pass":
-            strategy_summary = summarize_strategy(memory)
-
-            writer.append({
-                "object": task_object,
-                "visual_tags": rag_hits[0]["tags"] if rag_hits else [],
-                "image_meta": {
-                    "resolution": f"{IMG.shape[1]}x{IMG.shape[0]}"
-                },
-                "final_score": result,
-                "strategy_summary": strategy_summary,
-                "confidence": float(best_score)
-            })
-
-            st.session_state.logs.append(("sys", "RAG：已将成功策略写入知识库"))
-            with log_box.container():
-                render_chat(st.session_state.logs)
+        st.session_state.final_mask = result.final_mask
+        if result.final_mask is not None:
+            st.session_state.final_thumb = encode_thumbnail(result.final_mask)
+        render_final()
 
         st.session_state.running=False
+        # 重跑一次页面以显示原分辨率查看入口
+        st.rerun()
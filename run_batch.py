@@ -0,0 +1,105 @@
+# python run_batch.py --manifest jobs.jsonl --out outputs/
+# python run_batch.py --image-dir images/ --prompt "Segmenting the pantograph in the image." --out outputs/
+import argparse
+import time
+
+from agent.pipeline import VisionManusPipeline, ResultWriter, iter_jobs_from_dir, iter_jobs_from_jsonl, MAX_RETRY
+from agent.evaluation import HardGate
+from agent.planner import THINK_MODES, DEFAULT_THINKING_BUDGET
+from agent.stage_runner import StagedRunner
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Vision Manus 无界面批处理")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--manifest", help="JSONL 作业清单，每行 {\"image\": ..., \"prompt\": ...}")
+    src.add_argument("--image-dir", help="图片目录，所有图片共用 --prompt")
+    parser.add_argument("--prompt", default="Segmenting the pantograph in the image.", help="任务描述")
+    parser.add_argument("--out", required=True, help="输出目录（results.jsonl + masks/）")
+    parser.add_argument("--max-retry", type=int, default=MAX_RETRY)
+    parser.add_argument("--understand-thinking", choices=THINK_MODES, default="no_think", help="任务理解的思考模式")
+    parser.add_argument("--route-thinking", choices=THINK_MODES, default="budget", help="路由的思考模式")
+    parser.add_argument("--thinking-budget", type=int, default=DEFAULT_THINKING_BUDGET, help="budget 模式下的思考 token 上限")
+    parser.add_argument("--no-rule-routing", action="store_true", help="关闭规则快速路由，每轮都调用 LLM")
+    parser.add_argument("--server", default=None, help="模型服务地址，例如 http://127.0.0.1:8765（不填则在本进程加载模型）")
+    parser.add_argument("--eval-max-side", type=int, default=0,
+                        help="soft 评估输入的长边上限（如 1024），默认 0 表示原分辨率")
+    parser.add_argument("--eval-mask-render", choices=("mask", "overlay", "contour"), default="mask",
+                        help="mask 的呈现方式：独立 mask 图 / 叠加 / 轮廓")
+    parser.add_argument("--gate-min-coverage", type=float, default=0.01, help="门控：覆盖率低于此值时跳过 VLM 评估")
+    parser.add_argument("--gate-max-coverage", type=float, default=0.95, help="门控：覆盖率高于此值时跳过 VLM 评估")
+    parser.add_argument("--gate-min-hard-score", type=float, default=0.3, help="门控：hard 分低于此值时跳过 VLM 评估")
+    parser.add_argument("--no-hard-gate", action="store_true", help="关闭 hard 指标门控，每个 mask 都做 VLM 评估")
+    parser.add_argument("--eval-cache-dir", default=None, help="评估结果磁盘缓存目录（可选）")
+    parser.add_argument("--fanout", type=int, default=1, help="每轮并发尝试的候选工具数（1 表示关闭扇出）")
+    parser.add_argument("--patch-workers", type=int, default=1,
+                        help="本进程分块 / ROI 分割时并发推理的区域数（1 为串行；>1 要求 iSeg 推理在共享模型上线程安全）")
+    parser.add_argument("--no-strategy-replay", action="store_true", help="关闭历史策略回放，总是走路由循环")
+    parser.add_argument("--rag-retriever", choices=("tfidf", "dense"), default="tfidf",
+                        help="知识库检索方式：字符 TF-IDF / 稠密向量")
+    parser.add_argument("--staged", action="store_true",
+                        help="阶段流水线：理解 / 检索 / 分割 / 评估 / 路由 各自一个工作线程，不同图像的阶段重叠执行")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="阶段流水线中同时处理的作业数上限")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.manifest:
+        jobs = iter_jobs_from_jsonl(args.manifest, default_prompt=args.prompt)
+    else:
+        jobs = iter_jobs_from_dir(args.image_dir, args.prompt)
+
+    pipeline = VisionManusPipeline(
+        max_retry=args.max_retry,
+        eval_cache_dir=args.eval_cache_dir,
+        understand_thinking=args.understand_thinking,
+        route_thinking=args.route_thinking,
+        thinking_budget=args.thinking_budget,
+        rule_routing=not args.no_rule_routing,
+        server_url=args.server,
+        gate=HardGate(
+            min_coverage=args.gate_min_coverage,
+            max_coverage=args.gate_max_coverage,
+            min_hard_score=args.gate_min_hard_score
+        ),
+        hard_gating=not args.no_hard_gate,
+        eval_max_side=args.eval_max_side or None,
+        eval_mask_render=args.eval_mask_render,
+        rag_retriever=args.rag_retriever,
+        strategy_replay=not args.no_strategy_replay,
+        fanout=args.fanout,
+        patch_workers=args.patch_workers
+    )
+    result_writer = ResultWriter(args.out)
+    runner = StagedRunner(pipeline, max_in_flight=args.max_in_flight) if args.staged else pipeline
+
+    n_done, n_failed = 0, 0
+    t0 = time.perf_counter()
+    for result in runner.run(jobs, result_writer):
+        n_done += 1
+        if result.status == "error":
+            n_failed += 1
+        print(f"[{n_done}] {result.job_id}: status={result.status} "
+              f"score={result.best_score:.4f} time={result.timings.get('total', 0.0):.2f}s "
+              f"llm_saved={result.llm_calls_saved} replayed={result.replayed}")
+
+    elapsed = time.perf_counter() - t0
+    print(f"完成 {n_done} 个作业（失败 {n_failed} 个），总耗时 {elapsed:.1f}s")
+    if args.staged:
+        for stage, stats in runner.stats().items():
+            print(f"阶段 {stage}: {stats}")
+        print(f"瓶颈阶段: {runner.bottleneck()}")
+    if pipeline.fast_router is not None:
+        print(f"规则路由: {pipeline.fast_router.stats()}")
+    if pipeline.replayer is not None:
+        print(f"策略回放: {pipeline.replayer.stats()}")
+    print(f"Planner token 消耗: {pipeline.planner.usage}")
+    print(f"VLM 评估: 调用 {pipeline.evaluator.vlm_calls} 次，门控跳过 {pipeline.evaluator.vlm_skipped} 次")
+    if pipeline.evaluator.cache is not None:
+        print(f"评估缓存: {pipeline.evaluator.cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import json
+import re
+
+import numpy as np
+
+from agent.mask import Mask
+
+
+# ——————————————————————————— 模型后端 ———————————————————————————
+# 每个后端提供三个批处理入口，输入输出均为可序列化的 dict：
+#   planner_batch    [{sys_prompt, user_prompt, schema, thinking, thinking_budget}] → [{thinking, content, usage}]
+#   soft_eval_batch  [{img, mask, prompt, policy?}] → [{coverage_score, coverage_reason, semantic_score, semantic_reason}]
+#   segment_batch    [{class_name, img, patch? / roi?, rows, cols, overlap, mask, margin, ..., run_args}]
+#                    → [{mask}]（mask 以 Mask 返回）
+# 单项失败以 Exception 实例返回，不影响同批的其他请求。
+class LocalBackend:
+    """
+    在本进程加载 Qwen3 / Qwen3-VL / iSeg 三个模型（每台机器只加载一次）。
+    只有 soft_eval_batch 真正把一批请求合并成一次 batched generate；
+    planner_batch 与 segment_batch 在批内逐个串行执行（Planner 的 KV 前缀缓存与
+    iSeg 的 run_one_image 都只支持单条输入），攒批对这两个模型只减少排队与线程切换，不提高吞吐。
+    """
+
+    name = "local"
+
+    def __init__(self):
+        from agent.planner import Planner
+        from agent.evaluation import evaluate, EvalInputPolicy
+        from agent.segment import segmenter_iSeg
+        from agent.structured import SCHEMAS
+
+        self.schemas = SCHEMAS
+        self.EvalInputPolicy = EvalInputPolicy
+        self.planner = Planner()
+        self.evaluator = evaluate()
+        self.segmenter = segmenter_iSeg()
+
+    def planner_batch(self, reqs):
+        # 逐条串行生成
+        outputs = []
+        for r in reqs:
+            try:
+                thinking, content = self.planner.run(
+                    sys_prompt=r["sys_prompt"],
+                    user_prompt=r["user_prompt"],
+                    schema=self.schemas.get(r.get("schema")),
+                    thinking=r.get("thinking", "full"),
+                    thinking_budget=r.get("thinking_budget", 512)
+                )
+                outputs.append({"thinking": thinking, "content": content, "usage": dict(self.planner.last_usage)})
+            except Exception as e:
+                outputs.append(e)
+        return outputs
+
+    def soft_eval_batch(self, reqs):
+        # 同批中输入策略相同的请求合并成一次 batched generate
+        groups = {}
+        for i, r in enumerate(reqs):
+            policy = r.get("policy")
+            groups.setdefault(json.dumps(policy, sort_keys=True), (policy, []))[1].append(i)
+
+        results = [None] * len(reqs)
+        for policy, idxs in groups.values():
+            input_policy = self.EvalInputPolicy(**policy) if policy else None
+            outs = self.evaluator.soft_evaluate_batch(
+                [(reqs[i]["img"], reqs[i]["mask"], reqs[i]["prompt"]) for i in idxs],
+                input_policy=input_policy
+            )
+            for i, out in zip(idxs, outs):
+                results[i] = out
+
+        outputs = []
+        for out in results:
+            if isinstance(out, Exception):
+                outputs.append(out)
+                continue
+            coverage_score, coverage_reason, semantic_score, semantic_reason = out
+            outputs.append({
+                "coverage_score": coverage_score,
+                "coverage_reason": coverage_reason,
+                "semantic_score": semantic_score,
+                "semantic_reason": semantic_reason
+            })
+        return outputs
+
+    def segment_batch(self, reqs):
+        # 逐条串行分割
+        outputs = []
+        for r in reqs:
+            try:
+                if r.get("patch"):
+                    mask = self.segmenter.patch_segment(
+                        r["class_name"], r["img"],
+                        rows=r.get("rows", 2), cols=r.get("cols", 2), overlap=r.get("overlap", 0),
+                        run_args=r.get("run_args")
+                    )
+                elif r.get("roi"):
+                    mask = self.segmenter.roi_segment(
+                        r["class_name"], r["img"], np.asarray(r["mask"]),
+                        margin=r.get("margin", 0.25), max_rois=r.get("max_rois", 4),
+                        zoom_side=r.get("zoom_side", 1024), max_zoom=r.get("max_zoom", 4.0),
+                        min_area=r.get("min_area"), run_args=r.get("run_args")
+                    )
+                else:
+                    mask = self.segmenter.segment(r["class_name"], r["img"])
+                outputs.append({"mask": Mask.from_array(mask)})
+            except Exception as e:
+                outputs.append(e)
+        return outputs
+
+
+class StubBackend:
+    """
+    不依赖 GPU / 模型权重的确定性假后端，用于联调与测试：
+        - 任务理解：从任务描述中取出 “the <object>” 作为任务对象
+        - 路由：总是 Pass
+        - soft 评估：固定分数
+        - 分割：灰度高于均值的像素记为前景（ROI 重分割原样返回输入 mask）
+    """
+
+    name = "stub"
+
+    def planner_batch(self, reqs):
+        outputs = []
+        for r in reqs:
+            if r.get("schema") == "task_understanding":
+                m = re.search(r"\bthe\s+([\w\-]+)", r["user_prompt"], re.IGNORECASE)
+                answer = {"user_goal": "Segmentation", "task_object": m.group(1) if m else "object"}
+            elif r.get("schema") == "router":
+                answer = {"tool": "Pass", "parameters": {"reason": "stub backend"}}
+            else:
+                answer = {}
+            content = json.dumps(answer, ensure_ascii=False)
+            outputs.append({
+                "thinking": "",
+                "content": content,
+                "usage": {"mode": r.get("thinking", "full"), "prompt_tokens": 0,
+                          "thinking_tokens": 0, "answer_tokens": len(content)}
+            })
+        return outputs
+
+    def soft_eval_batch(self, reqs):
+        return [{
+            "coverage_score": 0.8,
+            "coverage_reason": "stub backend",
+            "semantic_score": 0.8,
+            "semantic_reason": "stub backend"
+        } for _ in reqs]
+
+    def segment_batch(self, reqs):
+        outputs = []
+        for r in reqs:
+            if r.get("roi"):
+                # ROI 重分割：原样返回输入 mask
+                outputs.append({"mask": r["mask"]})
+                continue
+            img = np.asarray(r["img"])
+            gray = img.mean(axis=-1) if img.ndim == 3 else img
+            outputs.append({"mask": Mask.from_array((gray > gray.mean()) * 255)})
+        return outputs
+
+
+BACKENDS = {
+    "local": LocalBackend,
+    "stub": StubBackend,
+}
@@ -0,0 +1,98 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+
+_STOP = object()
+
+
+# ——————————————————————————— 动态批处理 ———————————————————————————
+class MicroBatcher:
+    """
+    把并发到达的请求在 max_wait 秒的时间窗口内攒成一批（最多 max_batch 个），
+    由单个工作线程调用 batch_fn 一次性处理，再把结果分发回各个调用方。
+
+    batch_fn(items) 返回与 items 等长的列表；某一项为 Exception 实例时，
+    只有对应的调用方收到该异常。
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch: int = 4,
+                 max_wait: float = 0.01, name: str = "micro-batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.name = name
+
+        self.batches = 0
+        self.items = 0
+        self.busy_time = 0.0
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        fut = Future()
+        self._queue.put((item, fut))
+        return fut
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def close(self) -> None:
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "busy_time": round(self.busy_time, 4),
+            "pending": self._queue.qsize(),
+        }
+
+    def _loop(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                batch.append(nxt)
+
+            self._run(batch)
+
+    def _run(self, batch):
+        items = [item for item, _ in batch]
+        t0 = time.perf_counter()
+        try:
+            outputs = self.batch_fn(items)
+            if len(outputs) != len(items):
+                raise RuntimeError(f"{self.name}: batch_fn returned {len(outputs)} outputs for {len(items)} items")
+        except Exception as e:
+            outputs = [e] * len(items)
+        self.busy_time += time.perf_counter() - t0
+        self.batches += 1
+        self.items += len(items)
+
+        for (_, fut), out in zip(batch, outputs):
+            if isinstance(out, Exception):
+                fut.set_exception(out)
+            else:
+                fut.set_result(out)
@@ -0,0 +1,123 @@
+import json
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from agent.evaluation import evaluate
+from agent.mask import Mask
+from agent.planner import THINK_MODES, DEFAULT_THINKING_BUDGET
+from serving import protocol
+from serving.server import DEFAULT_HOST, DEFAULT_PORT
+
+
+# ——————————————————————————— 模型服务客户端 ———————————————————————————
+class ModelClient:
+
+    def __init__(self, url=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout=600):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def call(self, path, payload):
+        req = urllib.request.Request(
+            self.url + path,
+            data=protocol.dumps(payload),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return protocol.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", errors="replace")
+            try:
+                detail = json.loads(detail).get("error", detail)
+            except ValueError:
+                pass
+            raise RuntimeError(f"model server {path} failed: {detail}") from None
+
+    def health(self):
+        with urllib.request.urlopen(self.url + "/health", timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+
+# 以下三个类与本地的 Planner / evaluate / segmenter_iSeg 接口一致，可直接注入 VisionManusPipeline
+class RemotePlanner:
+
+    def __init__(self, client: ModelClient):
+        self.client = client
+        self.last_usage = {}
+        self.usage = {mode: {"calls": 0, "thinking_tokens": 0, "answer_tokens": 0} for mode in THINK_MODES}
+
+    def run(self, sys_prompt, user_prompt, schema=None, thinking="full",
+            thinking_budget=DEFAULT_THINKING_BUDGET):
+        out = self.client.call("/planner/run", {
+            "sys_prompt": sys_prompt,
+            "user_prompt": user_prompt,
+            "schema": schema.name if schema is not None else None,
+            "thinking": thinking,
+            "thinking_budget": thinking_budget
+        })
+        self.last_usage = out.get("usage", {})
+        usage = self.usage.setdefault(thinking, {"calls": 0, "thinking_tokens": 0, "answer_tokens": 0})
+        usage["calls"] += 1
+        usage["thinking_tokens"] += self.last_usage.get("thinking_tokens", 0)
+        usage["answer_tokens"] += self.last_usage.get("answer_tokens", 0)
+        return out["thinking"], out["content"]
+
+
+class RemoteSegmenter:
+
+    def __init__(self, client: ModelClient):
+        self.client = client
+
+    def segment(self, class_name, img):
+        return self.client.call("/segment", {"class_name": class_name, "img": img})["mask"]
+
+    def patch_segment(self, class_name, img, rows=2, cols=2, overlap=0, run_args=None, max_workers=None):
+        return self.client.call("/segment", {
+            "patch": True,
+            "class_name": class_name,
+            "img": img,
+            "rows": rows,
+            "cols": cols,
+            "overlap": overlap,
+            "run_args": run_args
+        })["mask"]
+
+    def roi_segment(self, class_name, img, mask, margin=0.25, max_rois=4, zoom_side=1024,
+                    max_zoom=4.0, min_area=None, run_args=None, max_workers=None):
+        return self.client.call("/segment", {
+            "roi": True,
+            "class_name": class_name,
+            "img": img,
+            "mask": Mask.from_array(mask),
+            "margin": margin,
+            "max_rois": max_rois,
+            "zoom_side": zoom_side,
+            "max_zoom": max_zoom,
+            "min_area": min_area,
+            "run_args": run_args
+        })["mask"]
+
+
+class RemoteEvaluator(evaluate):
+    """hard 评估、缓存与门控在本地完成，只有 VLM 的 soft 评估发往模型服务"""
+
+    def __init__(self, client: ModelClient, cache=None, gate=None, input_policy=None):
+        self.client = client
+        super().__init__(cache=cache, gate=gate, input_policy=input_policy)
+
+    def _load_model(self):
+        return None, None
+
+    def soft_evaluate_many(self, items):
+        # 并发发送，由服务端的微批处理合并成一次 generate
+        if len(items) == 1:
+            return [self.soft_evaluate(*items[0])]
+        with ThreadPoolExecutor(max_workers=len(items)) as pool:
+            return list(pool.map(lambda item: self.soft_evaluate(*item), items))
+
+    def soft_evaluate(self, img, mask, prompt):
+        policy = self.input_policy.to_dict() if self.input_policy is not None else None
+        out = self.client.call("/evaluate/soft", {"img": img, "mask": mask, "prompt": prompt, "policy": policy})
+        return out["coverage_score"], out["coverage_reason"], out["semantic_score"], out["semantic_reason"]
@@ -0,0 +1,71 @@
+import base64
+import io
+import json
+
+import numpy as np
+
+from agent.mask import Mask
+
+
+# ——————————————————————————— 序列化协议 ———————————————————————————
+# 请求 / 响应都是 JSON；numpy 数组以 .npy 字节 + base64 的形式嵌入：
+#   {"__ndarray__": "<base64>"}
+# Mask 直接传输按行打包的 bit（约为 uint8 数组的 1/8）：
+#   {"__mask__": "<base64>", "shape": [H, W], "value": 255}
+def encode_array(arr: np.ndarray) -> dict:
+    buf = io.BytesIO()
+    np.save(buf, np.ascontiguousarray(arr), allow_pickle=False)
+    return {"__ndarray__": base64.b64encode(buf.getvalue()).decode("ascii")}
+
+
+def decode_array(d: dict) -> np.ndarray:
+    return np.load(io.BytesIO(base64.b64decode(d["__ndarray__"])), allow_pickle=False)
+
+
+def encode_mask(mask: Mask) -> dict:
+    return {
+        "__mask__": base64.b64encode(np.ascontiguousarray(mask.bits).tobytes()).decode("ascii"),
+        "shape": list(mask.shape),
+        "value": mask.value,
+    }
+
+
+def decode_mask(d: dict) -> Mask:
+    h, w = d["shape"]
+    bits = np.frombuffer(base64.b64decode(d["__mask__"]), dtype=np.uint8).reshape(h, (w + 7) // 8)
+    return Mask((h, w), bits, d.get("value", 255))
+
+
+def pack(obj):
+    """递归地把数组替换为可 JSON 化的编码"""
+    if isinstance(obj, Mask):
+        return encode_mask(obj)
+    if isinstance(obj, np.ndarray):
+        return encode_array(obj)
+    if isinstance(obj, dict):
+        return {k: pack(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [pack(v) for v in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def unpack(obj):
+    if isinstance(obj, dict):
+        if "__ndarray__" in obj:
+            return decode_array(obj)
+        if "__mask__" in obj:
+            return decode_mask(obj)
+        return {k: unpack(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [unpack(v) for v in obj]
+    return obj
+
+
+def dumps(obj) -> bytes:
+    return json.dumps(pack(obj), ensure_ascii=False).encode("utf-8")
+
+
+def loads(data: bytes):
+    return unpack(json.loads(data.decode("utf-8")))
@@ -0,0 +1,117 @@
+# python -m serving.server --backend local --port 8765
+# python -m serving.server --backend stub  --port 8765   # 无 GPU 联调
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from serving import protocol
+from serving.backends import BACKENDS
+from serving.batching import MicroBatcher
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+# ——————————————————————————— 常驻模型服务 ———————————————————————————
+class ModelServer:
+    """
+    在一个进程内常驻 Qwen3 / Qwen3-VL / iSeg，多个 Streamlit 会话与批处理 worker 通过 HTTP 共享。
+    每个模型一个请求队列 + 工作线程，同一模型的并发请求在时间窗口内攒批交给后端。
+    local 后端只有 soft 评估按批推理，Planner 与 iSeg 在批内串行执行（见 LocalBackend）。
+    """
+
+    def __init__(self, backend, host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=4, max_wait=0.01):
+        self.backend = backend
+        self.routes = {
+            "/planner/run": MicroBatcher(backend.planner_batch, max_batch, max_wait, name="planner"),
+            "/evaluate/soft": MicroBatcher(backend.soft_eval_batch, max_batch, max_wait, name="evaluate"),
+            "/segment": MicroBatcher(backend.segment_batch, max_batch, max_wait, name="segment"),
+        }
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stats(self) -> dict:
+        return {path.strip("/"): b.stats() for path, b in self.routes.items()}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _reply(self, code, body: bytes):
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path != "/health":
+                    return self._reply(404, b'{"error": "not found"}')
+                body = {"status": "ok", "backend": server.backend.name, "stats": server.stats()}
+                self._reply(200, json.dumps(body).encode("utf-8"))
+
+            def do_POST(self):
+                batcher = server.routes.get(self.path)
+                if batcher is None:
+                    return self._reply(404, b'{"error": "not found"}')
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    payload = protocol.loads(self.rfile.read(length))
+                    result = batcher(payload)
+                    self._reply(200, protocol.dumps(result))
+                except Exception as e:
+                    body = {"error": f"{type(e).__name__}: {e}"}
+                    self._reply(500, json.dumps(body, ensure_ascii=False).encode("utf-8"))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        """后台线程启动（测试 / 嵌入使用）"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for b in self.routes.values():
+            b.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vision Manus 模型服务")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="local")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch", type=int, default=4, help="每批最多请求数")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0, help="攒批等待时间（毫秒）")
+    args = parser.parse_args()
+
+    server = ModelServer(
+        BACKENDS[args.backend](),
+        host=args.host, port=args.port,
+        max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000.0
+    )
+    print(f"Vision Manus model server ({args.backend}) listening on {server.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""路由器 / 扇出测试共用的记忆构造工具"""
+from agent.memory import Memory
+
+
+def memory_with(*steps):
+    memory = Memory()
+    for i, (tool, params, metrics) in enumerate(steps):
+        memory.record(i + 1, tool, params, metrics)
+    return memory
+
+
+def patch_step(rows, cols, coverage=0.05):
+    return ("split_image_patches", {"class_name": "bolt", "rows": rows, "cols": cols, "overlap": 32},
+            {"score": 0.3, "coverage": coverage, "connectivity": 1.0})
+
+
+FIRST = ("iSeg-Plus", {"class_name": "bolt"}, {"score": 0.3, "coverage": 0.05, "connectivity": 1.0})
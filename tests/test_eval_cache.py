@@ -0,0 +1,63 @@
+import os
+import threading
+
+from agent.eval_cache import EvaluationCache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = EvaluationCache(max_items=2)
+    cache.put("a", [1])
+    cache.put("b", [2])
+    assert cache.get("a") == [1]            # a 变为最近使用
+    cache.put("c", [3])
+
+    assert cache.get("b") is None
+    assert cache.get("a") == [1] and cache.get("c") == [3]
+    assert cache.stats() == {"hits": 3, "misses": 1, "size": 2}
+
+
+def test_values_are_copied():
+    cache = EvaluationCache()
+    value = [{"score": 0.5}]
+    cache.put("k", value)
+    value[0]["score"] = 0.0
+    cache.get("k")[0]["score"] = 0.1
+    assert cache.get("k") == [{"score": 0.5}]
+
+
+def test_disk_round_trip(tmp_path):
+    EvaluationCache(cache_dir=str(tmp_path)).put("k", [{"score": 0.7}, "coverage", "semantic"])
+
+    fresh = EvaluationCache(cache_dir=str(tmp_path))
+    assert fresh.get("k") == [{"score": 0.7}, "coverage", "semantic"]
+    assert fresh.stats()["size"] == 1
+    assert fresh.get("missing") is None
+
+
+def test_concurrent_puts_of_same_key(tmp_path):
+    cache = EvaluationCache(cache_dir=str(tmp_path))
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(50):
+                cache.put("same", [n, i])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    assert os.listdir(tmp_path) == ["same.json"]          # 没有残留的临时文件
+    assert len(EvaluationCache(cache_dir=str(tmp_path)).get("same")) == 2
+
+
+def test_disk_write_failure_keeps_memory_entry(tmp_path):
+    cache = EvaluationCache(cache_dir=str(tmp_path / "gone"))
+    os.rmdir(tmp_path / "gone")
+    cache.put("k", [1])
+    assert cache.get("k") == [1]
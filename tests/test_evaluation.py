@@ -0,0 +1,157 @@
+import cv2
+import numpy as np
+import pytest
+
+# agent.evaluation 在导入时加载 transformers / streamlit
+pytest.importorskip("transformers")
+pytest.importorskip("streamlit")
+
+from agent.eval_cache import EvaluationCache
+from agent.evaluation import evaluate, HardGate, EvalInputPolicy
+
+
+class StubEvaluator(evaluate):
+    """不加载 VLM，soft 评估返回固定分数并记录调用"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.soft_items = []
+
+    def _load_model(self):
+        return None, None
+
+    def soft_evaluate_batch(self, items, input_policy=None):
+        self.soft_items.extend(items)
+        return [(0.9, "coverage ok", 0.8, "semantic ok") for _ in items]
+
+
+IMG = np.zeros((64, 64, 3), dtype=np.uint8)
+PROMPT = "evaluate {}"
+
+
+def square_mask(size=24):
+    mask = np.zeros((64, 64), dtype=np.uint8)
+    mask[8:8 + size, 8:8 + size] = 255
+    return mask
+
+
+def test_gated_results_are_not_cached():
+    cache = EvaluationCache()
+    evaluator = StubEvaluator(cache=cache, gate=HardGate())
+
+    result, reason, _ = evaluator.run(IMG, np.zeros((64, 64), dtype=np.uint8), PROMPT, "bolt")
+    assert result["gated"] and reason.startswith("[hard gate]")
+    assert cache.stats()["size"] == 0
+
+    evaluator.run(IMG, square_mask(), PROMPT, "bolt")
+    assert cache.stats()["size"] == 1
+    assert len(evaluator.soft_items) == 1
+
+    # 相同的 mask 命中缓存，不再调用 VLM
+    evaluator.run(IMG, square_mask(), PROMPT, "bolt")
+    assert len(evaluator.soft_items) == 1 and cache.stats()["hits"] == 1
+
+
+def test_pipeline_gate_thresholds_reach_the_evaluator(monkeypatch):
+    from agent.pipeline import VisionManusPipeline
+
+    monkeypatch.setattr(evaluate, "_load_model", lambda self: (None, None))
+    calls = []
+    monkeypatch.setattr(evaluate, "soft_evaluate_batch",
+                        lambda self, items, input_policy=None: calls.extend(items) or
+                        [(0.9, "coverage ok", 0.8, "semantic ok") for _ in items])
+
+    class Segmenter:
+        patch_segment = roi_segment = staticmethod(lambda **kw: None)
+
+    def make(**kwargs):
+        return VisionManusPipeline(rag=object(), planner=object(), segmenter=Segmenter(), writer=object(),
+                                   strategy_replay=False, **kwargs)
+
+    pipeline = make(gate=HardGate(min_coverage=0.2))
+    assert pipeline.evaluator.gate.min_coverage == 0.2
+
+    # 覆盖率 0.14 低于自定义下限：门控拦截，不调用 VLM
+    result, _, _ = pipeline.evaluator.run(IMG, square_mask(24), PROMPT, "bolt")
+    assert result["gated"] and not calls
+    assert pipeline.evaluator.vlm_skipped == 1
+
+    # 默认门控下同一个 mask 进入 soft 评估；关闭门控时连空 mask 也会调用 VLM
+    result, _, _ = make().evaluator.run(IMG, square_mask(24), PROMPT, "bolt")
+    assert "gated" not in result and len(calls) == 1
+    ungated = make(hard_gating=False).evaluator
+    result, _, _ = ungated.run(IMG, np.zeros((64, 64), dtype=np.uint8), PROMPT, "bolt")
+    assert ungated.gate is None and "gated" not in result and len(calls) == 2
+
+
+def reference_hard_evaluate(mask):
+    """逐个连通域计数的原始写法，作为对照"""
+    h, w = mask.shape
+    fg = np.sum(mask > 0)
+    coverage = fg / (h * w)
+    num_labels, labels = cv2.connectedComponents((mask > 0).astype("uint8"))
+    largest = max([np.sum(labels == i) for i in range(1, num_labels)], default=0)
+    connectivity = largest / max(fg, 1)
+    smoothness = 1.0 - np.sum(cv2.Canny(mask, 100, 200) > 0) / (h * w)
+    return 0.4 * coverage + 0.4 * connectivity + 0.2 * smoothness, coverage, connectivity, smoothness
+
+
+def test_hard_evaluate_matches_per_component_counting():
+    rng = np.random.default_rng(0)
+    for density in (0.02, 0.2, 0.6):
+        mask = ((rng.random((48, 64)) < density) * 255).astype(np.uint8)
+        mask[10:30, 5:25] = 255
+        np.testing.assert_allclose(evaluate.hard_evaluate(mask), reference_hard_evaluate(mask))
+
+
+def test_hard_evaluate_coverage_bounds():
+    mask = square_mask(24)                                  # 覆盖率 0.14
+    score, coverage, connectivity, _ = evaluate.hard_evaluate(mask)
+    assert score > 0 and connectivity == 1.0
+    # 超出给定区间时综合评分记 0，其余指标照常给出
+    score, coverage2, connectivity2, _ = evaluate.hard_evaluate(mask, min_coverage=0.2)
+    assert score == 0.0 and coverage2 == coverage and connectivity2 == 1.0
+    assert evaluate.hard_evaluate(np.zeros((8, 8), dtype=np.uint8))[:3] == (0.0, 0.0, 0.0)
+
+
+class Processor:
+    class image_processor:
+        patch_size, merge_size = 14, 2
+
+
+def test_input_policy_target_size_aligns_and_respects_max_side():
+    policy = EvalInputPolicy(max_side=448)
+    assert policy.target_size(1080, 1920, 28) == (252, 448)
+    for h, w in ((1080, 1920), (500, 333), (30, 2000)):
+        nh, nw = policy.target_size(h, w, 28)
+        assert nh % 28 == 0 and nw % 28 == 0 and max(nh, nw) <= 448 and min(nh, nw) >= 28
+    # 不缩放、不对齐时保持原尺寸
+    assert EvalInputPolicy(align_to_grid=False).target_size(1080, 1920, 28) == (1080, 1920)
+
+
+def test_input_policy_render():
+    img = np.full((100, 60, 3), 200, dtype=np.uint8)
+    mask = np.zeros((100, 60), dtype=np.uint8)
+    mask[20:60, 10:40] = 255
+
+    img_out, mask_out = EvalInputPolicy(max_side=56).render(img, mask, Processor())
+    assert img_out.shape == (56, 28, 3) and mask_out.shape == (56, 28, 3)
+    assert set(np.unique(mask_out)) == {0, 255}
+
+    (overlay,) = EvalInputPolicy(mask_render="overlay", align_to_grid=False).render(img, mask, Processor())
+    assert overlay.shape == img.shape
+    assert tuple(overlay[30, 20]) == (227, 100, 100) and tuple(overlay[0, 0]) == (200, 200, 200)
+
+    (contour,) = EvalInputPolicy(mask_render="contour", align_to_grid=False).render(img, mask, Processor())
+    assert tuple(contour[20, 20]) == (0, 255, 0) and tuple(contour[30, 20]) == (200, 200, 200)
+
+
+def test_input_policy_is_part_of_the_cache_key():
+    cache = EvaluationCache()
+    plain = StubEvaluator(cache=cache)
+    reduced = StubEvaluator(cache=cache, input_policy=EvalInputPolicy(max_side=32))
+    plain.run(IMG, square_mask(), PROMPT, "bolt")
+    reduced.run(IMG, square_mask(), PROMPT, "bolt")
+    assert cache.stats()["size"] == 2 and len(reduced.soft_items) == 1
+    with pytest.raises(ValueError):
+        EvalInputPolicy(mask_render="heatmap")
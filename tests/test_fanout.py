@@ -0,0 +1,36 @@
+from agent.memory import Memory
+from agent.router import FanOutProposer
+
+from helpers import memory_with, patch_step, FIRST
+
+
+def test_fan_out_keeps_router_choice_first_and_dedups():
+    proposer = FanOutProposer(width=4)
+    decision = {"tool": "split_image_patches",
+                "parameters": {"class_name": "task_object", "img": "IMG", "rows": 2, "cols": 2, "overlap": 32}}
+    candidates = proposer.propose(decision, memory_with(FIRST))
+
+    assert candidates[0] == decision
+    assert [c["tool"] for c in candidates] == [
+        "split_image_patches", "postprocess_preserve_small", "zoom_in_roi", "split_image_patches"]
+    grids = [(c["parameters"]["rows"], c["parameters"]["cols"]) for c in candidates if c["tool"] == "split_image_patches"]
+    assert grids == [(2, 2), (3, 3)]
+
+
+def test_fan_out_skips_what_was_just_done():
+    proposer = FanOutProposer(width=5)
+    post = ("postprocess_preserve_small", {"mask": "MASK"}, {"score": 0.5, "coverage": 0.4, "connectivity": 0.9})
+    decision = {"tool": "zoom_in_roi", "parameters": {"class_name": "task_object", "img": "IMG", "mask": "MASK"}}
+    candidates = proposer.propose(decision, memory_with(FIRST, patch_step(2, 2), post))
+
+    tools = [c["tool"] for c in candidates]
+    assert tools[0] == "zoom_in_roi" and tools.count("zoom_in_roi") == 1
+    assert "postprocess_preserve_small" not in tools
+    grids = [(c["parameters"]["rows"], c["parameters"]["cols"]) for c in candidates if c["tool"] == "split_image_patches"]
+    assert grids == [(3, 3), (4, 4)]
+
+
+def test_fan_out_without_history_only_adds_patch_grids():
+    candidates = FanOutProposer(width=2).propose({"tool": "postprocess_preserve_small",
+                                                  "parameters": {"mask": "MASK"}}, Memory())
+    assert [c["tool"] for c in candidates] == ["postprocess_preserve_small", "split_image_patches"]
@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+import pytest
+
+from agent.mask import Mask, dense
+
+
+def make_mask(h=37, w=53):
+    # 宽度不是 8 的倍数，覆盖打包的尾字节
+    arr = np.zeros((h, w), dtype=np.uint8)
+    arr[5:20, 7:30] = 255
+    arr[30:33, 50:53] = 255
+    return arr
+
+
+def test_round_trip_keeps_values():
+    arr = make_mask()
+    mask = Mask.from_array(arr)
+    assert mask.shape == arr.shape
+    assert np.array_equal(np.asarray(mask), arr)
+    assert np.array_equal(mask.to_array(), arr)
+
+    ones = (arr > 0).astype(np.uint8)
+    assert np.array_equal(np.asarray(Mask.from_array(ones)), ones)
+
+
+def test_bool_float_and_channel_inputs_decode_to_255():
+    arr = make_mask()
+    expected = np.where(arr > 0, 255, 0).astype(np.uint8)
+    assert np.array_equal(np.asarray(Mask.from_array(arr > 0)), expected)
+    assert np.array_equal(np.asarray(Mask.from_array(arr / 255.0 * 0.7)), expected)
+    assert np.array_equal(np.asarray(Mask.from_array(np.stack([arr] * 3, axis=-1))), expected)
+
+
+def test_from_array_rejects_non_2d():
+    with pytest.raises(ValueError):
+        Mask.from_array(np.zeros(10, dtype=np.uint8))
+
+
+def test_area_coverage_and_nbytes():
+    arr = make_mask()
+    mask = Mask.from_array(arr)
+    assert mask.area == np.count_nonzero(arr)
+    assert mask.coverage == pytest.approx(np.count_nonzero(arr) / arr.size)
+    assert mask.nbytes == arr.shape[0] * ((arr.shape[1] + 7) // 8)
+
+
+def test_bbox_matches_opencv():
+    arr = make_mask()
+    x, y, w, h = cv2.boundingRect(arr)
+    assert Mask.from_array(arr).bbox == (x, y, x + w, y + h)
+    assert Mask.from_array(np.zeros((4, 9), dtype=np.uint8)).bbox is None
+
+
+def test_crop_and_components():
+    arr = make_mask()
+    mask = Mask.from_array(arr)
+    x0, y0, x1, y1 = mask.bbox
+    assert np.array_equal(mask.crop(mask.bbox), (arr[y0:y1, x0:x1] > 0).astype(np.uint8))
+    assert sorted(mask.components().tolist()) == [9, 15 * 23]
+    assert Mask.from_array(np.zeros((4, 9), dtype=np.uint8)).components().size == 0
+
+
+def test_digest_follows_content():
+    arr = make_mask()
+    a, b = Mask.from_array(arr), Mask.from_array(arr.copy())
+    assert a.digest() == b.digest()
+    arr[0, 0] = 255
+    assert Mask.from_array(arr).digest() != a.digest()
+
+
+def test_dense_only_decodes_masks():
+    arr = make_mask()
+    assert np.array_equal(dense(Mask.from_array(arr)), arr)
+    assert dense(arr) is arr
+    assert dense(3) == 3
@@ -0,0 +1,50 @@
+import json
+
+import numpy as np
+
+from agent.eval_cache import EvaluationCache
+from agent.mask import Mask
+from agent.memory import Memory, Step, normalize_params
+
+
+def test_normalize_params_uses_declared_placeholders():
+    img = np.zeros((4, 6, 3), dtype=np.uint8)
+    mask = Mask.from_array(np.zeros((4, 6), dtype=np.uint8))
+    params = normalize_params("split_image_patches", {"img": img, "class_name": "bolt", "rows": np.int64(2)})
+    assert params == {"class_name": "bolt", "img": "IMG", "rows": 2}
+    assert list(params) == sorted(params)
+    assert type(params["rows"]) is int
+    assert normalize_params("postprocess_preserve_small", {"mask": mask}) == {"mask": "MASK"}
+
+
+def test_normalize_params_undeclared_values():
+    arr = np.arange(6, dtype=np.float32).reshape(2, 3)
+    params = normalize_params("unknown_tool", {"a": arr, "b": (1, 2), "c": np.float32(0.5), "d": object})
+    assert params["a"] == {"ndarray": EvaluationCache.digest_array(arr), "shape": [2, 3], "dtype": "float32"}
+    assert params["b"] == [1, 2] and params["c"] == 0.5 and params["d"] == str(object)
+    json.dumps(params)
+
+
+def test_records_round_trip():
+    memory = Memory()
+    mask = np.zeros((4, 4), dtype=np.uint8)
+    memory.record(1, "iSeg-Plus", {"class_name": "bolt"}, {"score": np.float32(0.5)}, mask=mask, elapsed=0.123456)
+    memory.record(2, "postprocess_preserve_small", {"mask": Mask.from_array(mask)}, candidate=True)
+    memory.record(2, "zoom_in_roi", {"class_name": "bolt"}, {"score": 0.7})
+
+    records = json.loads(json.dumps(memory.to_records()))
+    restored = Memory.from_records(records)
+    assert restored.steps == memory.steps
+    assert restored.summary() == memory.summary()
+
+    first, candidate, last = restored.steps
+    assert first.elapsed == 0.1235 and first.mask == EvaluationCache.digest_array(mask)
+    assert type(first.metrics["score"]) is float and first.score == 0.5
+    assert candidate.candidate and candidate.params == {"mask": "MASK"} and candidate.score is None
+    assert "candidate" not in records[2] and "mask" not in records[2]
+
+
+def test_summary_keeps_last_steps():
+    memory = Memory.from_records([Step(round=i, tool="t").to_dict() for i in range(1, 8)])
+    rounds = [s["round"] for s in json.loads(memory.summary(max_steps=3))]
+    assert rounds == [5, 6, 7]
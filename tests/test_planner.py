@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+pytest.importorskip("streamlit")
+
+from agent import planner as planner_module
+from agent.planner import MAX_PREFIX_CACHES, Planner, THINK_END_TOKEN_ID, ThinkingBudgetProcessor
+from agent.structured import ROUTER_SCHEMA
+
+END = 9
+
+
+def step(processor, rows):
+    scores = torch.tensor(np.zeros((len(rows), 10)), dtype=torch.float32)
+    return processor(torch.tensor(rows, dtype=torch.long), scores)
+
+
+def test_forces_think_end_once_budget_is_spent():
+    processor = ThinkingBudgetProcessor(prompt_len=2, budget=3, think_end_id=END)
+    prompt = [[1, 1], [1, 1]]
+
+    # 预算内不干预
+    scores = step(processor, prompt)
+    assert np.all(np.asarray(scores) == 0)
+    scores = step(processor, [p + [3, 4] for p in prompt])
+    assert np.all(np.asarray(scores) == 0)
+
+    # 达到预算：只允许 </think>
+    scores = np.asarray(step(processor, [p + [3, 4, 5] for p in prompt]))
+    assert np.all(scores[:, END] == 0)
+    assert np.all(np.isneginf(np.delete(scores, END, axis=1)))
+
+
+def test_sequences_that_already_ended_thinking_are_left_alone():
+    processor = ThinkingBudgetProcessor(prompt_len=1, budget=2, think_end_id=END)
+    step(processor, [[0], [0]])
+    step(processor, [[0, END], [0, 3]])
+
+    scores = np.asarray(step(processor, [[0, END, 4], [0, 3, 4]]))
+    assert np.all(scores[0] == 0)                       # 第一个序列已输出 </think>
+    assert scores[1, END] == 0 and np.isneginf(scores[1, :END]).all()
+
+
+class Encoding(dict):
+
+    @property
+    def input_ids(self):
+        return self["input_ids"]
+
+    def to(self, device):
+        return self
+
+
+class CharTokenizer:
+    """每个字符一个 token；</think> 为特殊 token"""
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True, enable_thinking=True):
+        system, user = messages
+        return f"<sys>{system['content']}<|im_start|>user\n{user['content']}<|im_start|>assistant\n"
+
+    def __call__(self, texts, return_tensors="pt"):
+        return Encoding(input_ids=torch.tensor([[ord(c) for c in texts[0]]], dtype=torch.long))
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(chr(i) for i in ids if i != THINK_END_TOKEN_ID)
+
+
+class FakeModel:
+    """prefill 调用只计数；generate 返回 prompt + 预设的输出"""
+
+    device = "cpu"
+
+    def __init__(self, output):
+        self.output = output
+        self.prefills = 0
+        self.generate_kwargs = []
+
+    def __call__(self, input_ids, past_key_values=None, use_cache=True):
+        self.prefills += 1
+
+        class Out:
+            pass
+        out = Out()
+        out.past_key_values = {"prefix_len": input_ids.shape[1], "layers": [[0.0]]}
+        return out
+
+    def generate(self, input_ids, max_new_tokens, **kwargs):
+        self.generate_kwargs.append(dict(kwargs, max_new_tokens=max_new_tokens))
+        return torch.tensor([np.asarray(input_ids)[0].tolist() + self.output], dtype=torch.long)
+
+
+def make_planner(monkeypatch, output, **kwargs):
+    model = FakeModel(output)
+    monkeypatch.setattr(planner_module, "load_model", lambda name: (CharTokenizer(), model))
+    return Planner(**kwargs), model
+
+
+OUTPUT = [ord(c) for c in "hmm"] + [THINK_END_TOKEN_ID] + [ord(c) for c in '{"tool": "Pass"}']
+
+
+def test_run_splits_thinking_and_counts_tokens(monkeypatch):
+    planner, model = make_planner(monkeypatch, OUTPUT)
+    thinking, content = planner.run("sys", "user", schema=ROUTER_SCHEMA, thinking="budget", thinking_budget=16)
+    assert (thinking, content) == ("hmm", '{"tool": "Pass"}')
+    assert planner.last_usage["thinking_tokens"] == 4 and planner.last_usage["answer_tokens"] == 16
+    assert planner.usage["budget"]["calls"] == 1
+
+    kwargs = model.generate_kwargs[-1]
+    assert kwargs["max_new_tokens"] == 16 + 1 + ROUTER_SCHEMA.max_new_tokens
+    assert len(kwargs["logits_processor"]) == 1 and len(kwargs["stopping_criteria"]) == 1
+    assert kwargs["stopping_criteria"][0].start_token_id == THINK_END_TOKEN_ID
+
+    planner.run("sys", "user", schema=ROUTER_SCHEMA, thinking="no_think")
+    kwargs = model.generate_kwargs[-1]
+    assert "logits_processor" not in kwargs and kwargs["stopping_criteria"][0].start_token_id is None
+    assert kwargs["max_new_tokens"] == ROUTER_SCHEMA.max_new_tokens
+
+
+def test_system_prompt_prefill_is_reused(monkeypatch):
+    planner, model = make_planner(monkeypatch, OUTPUT)
+    planner.run("router rules", "round 1", thinking="no_think")
+    planner.run("router rules", "round 2", thinking="no_think")
+    assert model.prefills == 1
+
+    first, second = (kw["past_key_values"] for kw in model.generate_kwargs)
+    assert first == second and first is not second          # generate 拿到的是副本
+    assert first["prefix_len"] == len("<sys>router rules")
+
+    for i in range(MAX_PREFIX_CACHES):
+        planner.run(f"other {i}", "u", thinking="no_think")
+    assert len(planner._prefix_caches) == MAX_PREFIX_CACHES
+    planner.run("router rules", "round 3", thinking="no_think")   # 最早的前缀已被淘汰
+    assert model.prefills == MAX_PREFIX_CACHES + 2
+
+
+def test_prefix_cache_can_be_disabled(monkeypatch):
+    planner, model = make_planner(monkeypatch, OUTPUT, use_prefix_cache=False)
+    planner.run("sys", "user", thinking="full")
+    assert model.prefills == 0 and "past_key_values" not in model.generate_kwargs[-1]
@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+import pytest
+from skimage.restoration import denoise_bilateral
+
+from tools.postprocess import postprocess_preserve_small
+
+
+def reference_postprocess(mask, small_component_thr=80, hole_size_thr=200, sigma_color=0.15, sigma_spatial=3):
+    """逐连通域处理、整图滤波的原始写法，作为对照"""
+    m = (mask > 128).astype(np.uint8)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(m)
+    cleaned = np.zeros_like(m)
+    for i in range(1, num_labels):
+        if stats[i, cv2.CC_STAT_AREA] >= small_component_thr:
+            cleaned[labels == i] = 1
+
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(1 - cleaned)
+    for i in range(1, num_labels):
+        if stats[i, cv2.CC_STAT_AREA] <= hole_size_thr:
+            cleaned[labels == i] = 1
+
+    smooth = denoise_bilateral(cleaned.astype(np.float32), sigma_color=sigma_color, sigma_spatial=sigma_spatial)
+    return ((smooth > 0.4) * 255).astype(np.uint8)
+
+
+def noisy_mask(seed, shape=(72, 96)):
+    rng = np.random.default_rng(seed)
+    mask = np.zeros(shape, dtype=np.uint8)
+    mask[10:50, 20:70] = 255
+    mask[25:32, 40:46] = 0                                  # 小洞
+    mask[rng.random(shape) < 0.01] = 255                    # 噪点
+    mask[60:72, 80:96] = 255                                # 贴边的目标
+    return mask
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_reference(seed):
+    mask = noisy_mask(seed)
+    np.testing.assert_array_equal(postprocess_preserve_small(mask), reference_postprocess(mask))
+
+
+def test_small_thresholds_and_empty_mask():
+    mask = noisy_mask(3)
+    np.testing.assert_array_equal(postprocess_preserve_small(mask, small_component_thr=1, hole_size_thr=10),
+                                  reference_postprocess(mask, small_component_thr=1, hole_size_thr=10))
+    assert not postprocess_preserve_small(np.zeros((16, 16), dtype=np.uint8)).any()
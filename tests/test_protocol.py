@@ -0,0 +1,45 @@
+import numpy as np
+
+from agent.mask import Mask
+from serving import protocol
+
+
+def test_array_round_trip_keeps_dtype_and_shape():
+    for arr in (np.arange(24, dtype=np.uint8).reshape(2, 3, 4),
+                np.linspace(0, 1, 7, dtype=np.float32),
+                np.zeros((0, 5), dtype=np.int64)):
+        out = protocol.decode_array(protocol.encode_array(arr))
+        assert out.dtype == arr.dtype and out.shape == arr.shape
+        assert np.array_equal(out, arr)
+
+
+def test_mask_travels_as_packed_bits():
+    arr = np.zeros((21, 30), dtype=np.uint8)
+    arr[3:9, 4:25] = 1
+    mask = Mask.from_array(arr)
+    encoded = protocol.encode_mask(mask)
+    assert "__mask__" in encoded and encoded["value"] == 1
+
+    out = protocol.decode_mask(encoded)
+    assert isinstance(out, Mask)
+    assert out.shape == mask.shape and out.digest() == mask.digest()
+    assert np.array_equal(np.asarray(out), arr)
+
+
+def test_nested_payload_round_trip():
+    img = np.random.default_rng(0).integers(0, 255, (8, 10, 3), dtype=np.uint8)
+    mask = Mask.from_array(img[..., 0] > 128)
+    payload = {
+        "class_name": "bolt",
+        "img": img,
+        "items": [{"mask": mask, "score": np.float32(0.5)}, (1, 2)],
+        "none": None,
+    }
+    out = protocol.loads(protocol.dumps(payload))
+
+    assert out["class_name"] == "bolt" and out["none"] is None
+    assert np.array_equal(out["img"], img)
+    assert isinstance(out["items"][0]["mask"], Mask)
+    assert out["items"][0]["mask"].digest() == mask.digest()
+    assert out["items"][0]["score"] == 0.5 and isinstance(out["items"][0]["score"], float)
+    assert out["items"][1] == [1, 2]
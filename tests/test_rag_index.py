@@ -0,0 +1,223 @@
+import json
+import os
+
+import numpy as np
+
+from rag.index import TfidfIndex
+from rag.retriever import DenseRetriever
+from rag.strategy_writer import StrategyWriter
+
+
+def text_fn(d):
+    return d["object"]
+
+
+def record(obj, conf, tool="segment_object"):
+    steps = [{"tool": tool, "params": {"class_name": obj}}]
+    return {"object": obj, "confidence": conf, "strategy_summary": {"path": [tool], "steps": steps}}
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r) + "\n")
+
+
+class HashEmbedder:
+    """按字符 n-gram 哈希的确定性向量，替代真实的文本向量模型"""
+
+    name = "hash-embedder"
+
+    def encode(self, texts):
+        out = np.zeros((len(texts), 64), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for j in range(len(t) - 1):
+                out[i, hash(t[j:j + 2]) % 64] += 1.0
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-6)
+
+
+def append_jsonl(path, records):
+    with open(path, "a", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r) + "\n")
+
+
+def top1(index, query):
+    scores = index.scores(index.transform([query]))[0]
+    return index.get_item(int(np.argmax(scores)))["object"]
+
+
+def test_tfidf_index_appends_incrementally(tmp_path):
+    path = str(tmp_path / "kb.jsonl")
+    write_jsonl(path, [record(o, 0.9) for o in ("pantograph", "insulator", "catenary wire")])
+    index = TfidfIndex(path, text_fn, index_dir=str(tmp_path / "index"))
+    vocab = index.vectorizer.vocabulary_
+
+    append_jsonl(path, [record("insulator", 0.9, tool="split_image_patches")])   # n-gram 都在词表内
+    assert index.refresh()
+    assert len(index) == 4 and index._n_fit_docs == 3
+    assert index.vectorizer.vocabulary_ is vocab
+    assert not index.refresh()
+
+
+def test_tfidf_index_new_object_is_retrievable_after_append(tmp_path):
+    path = str(tmp_path / "kb.jsonl")
+    write_jsonl(path, [record(o, 0.9) for o in ("pantograph", "insulator", "catenary wire")])
+    index = TfidfIndex(path, text_fn, index_dir=str(tmp_path / "index"))
+
+    # 全新对象名的 n-gram 大多不在冻结词表中：按词表覆盖率触发重建，而不是追加后检索不到
+    append_jsonl(path, [record("bolt", 0.9)])
+    assert index.refresh()
+    assert index._n_fit_docs == 4
+    assert top1(index, "bolt") == "bolt"
+
+
+def test_tfidf_index_reloads_from_disk(tmp_path):
+    path = str(tmp_path / "kb.jsonl")
+    write_jsonl(path, [record(o, 0.9) for o in ("pantograph", "insulator", "catenary wire")])
+    index = TfidfIndex(path, text_fn, index_dir=str(tmp_path / "index"))
+
+    loaded = TfidfIndex(path, text_fn, index_dir=str(tmp_path / "index"))
+    assert loaded._version == index._version            # 直接加载，没有重新拟合
+    assert isinstance(loaded.offsets, np.memmap)
+    assert top1(loaded, "insulator") == "insulator"
+
+
+def test_tfidf_index_rebuilds_when_rewritten(tmp_path):
+    path = str(tmp_path / "kb.jsonl")
+    write_jsonl(path, [record(o, 0.9) for o in ("pantograph", "insulator", "catenary wire")])
+    index = TfidfIndex(path, text_fn, index_dir=str(tmp_path / "index"))
+
+    with open(path, "w", encoding="utf-8") as f:             # 原地改写变小
+        f.write(json.dumps(record("insulator", 0.9)) + "\n")
+    assert index.refresh()
+    assert objects(index) == ["insulator"]
+
+
+def compact_then_append(tmp_path):
+    """重复记录触发压缩（文件被 os.replace），随后追加的记录让文件比压缩前更大"""
+    path = str(tmp_path / "strategies.jsonl")
+    writer = StrategyWriter(path, background_compaction=False)
+    for obj in ("pantograph", "insulator", "catenary wire"):
+        writer.append(record(obj, 0.6))
+    yield path
+
+    assert writer.append(record("pantograph", 0.9))       # 同路径更高置信度 → 压缩
+    assert writer.compactions == 1
+    # 已有对象换一条路径：n-gram 全在词表内，不会因新词触发重建
+    writer.append(record("insulator", 0.8, tool="split_image_patches"))
+    writer.append(record("catenary wire", 0.8, tool="split_image_patches"))
+    yield path
+
+
+def objects(retriever):
+    return [retriever.get_item(i)["object"] for i in range(len(retriever))]
+
+
+def test_tfidf_index_rebuilds_after_compaction(tmp_path):
+    steps = compact_then_append(tmp_path)
+    path = next(steps)
+    index = TfidfIndex(path, text_fn, index_dir=str(tmp_path / "index"))
+    size = index._source_size
+
+    path = next(steps)
+    with open(path, "rb") as f:
+        assert len(f.read()) > size
+
+    assert index.refresh()
+    expected = [json.loads(line)["object"] for line in open(path, encoding="utf-8")]
+    assert objects(index) == expected
+    assert index.matrix.shape[0] == len(expected)
+
+
+def test_dense_retriever_rebuilds_after_compaction(tmp_path):
+    steps = compact_then_append(tmp_path)
+    path = next(steps)
+    dense = DenseRetriever(path, text_fn, embedder=HashEmbedder(), index_dir=str(tmp_path / "dense"))
+    assert len(dense) == 3
+
+    path = next(steps)
+    assert dense.refresh()
+    expected = [json.loads(line)["object"] for line in open(path, encoding="utf-8")]
+    assert objects(dense) == expected
+    assert dense.vectors.shape[0] == len(expected)
+
+    hits = dense.search(["catenary wire"], top_k=1)[0]
+    assert dense.get_item(hits[0][0])["object"] == "catenary wire"
+
+
+def compacted_after_refresh(tmp_path):
+    """索引建好后、读取记录前，策略库被压缩：重复记录删除，后续记录的字节偏移前移"""
+    path = str(tmp_path / "strategies.jsonl")
+    records = [record("pantograph", 0.6), record("insulator", 0.6),
+               record("catenary wire", 0.6), record("pantograph", 0.9)]
+    write_jsonl(path, records)
+    yield path, [r["object"] for r in records]
+
+    assert StrategyWriter(path, background_compaction=False).compact() == 1
+    yield path
+
+
+def test_tfidf_index_reads_indexed_file_after_compaction(tmp_path):
+    steps = compacted_after_refresh(tmp_path)
+    path, indexed = next(steps)
+    index = TfidfIndex(path, text_fn, index_dir=str(tmp_path / "index"))
+    next(steps)
+
+    # 下一次 refresh 之前，偏移仍对应建立索引时的文件
+    assert objects(index) == indexed
+    assert index.refresh()
+    assert objects(index) == [json.loads(line)["object"] for line in open(path, encoding="utf-8")]
+
+
+def test_dense_retriever_reads_indexed_file_after_compaction(tmp_path):
+    steps = compacted_after_refresh(tmp_path)
+    path, indexed = next(steps)
+    dense = DenseRetriever(path, text_fn, embedder=HashEmbedder(), index_dir=str(tmp_path / "dense"))
+    next(steps)
+
+    assert objects(dense) == indexed
+    assert dense.refresh()
+    assert objects(dense) == [json.loads(line)["object"] for line in open(path, encoding="utf-8")]
+
+
+def cache_files(index_dir):
+    return sorted(n for n in os.listdir(index_dir) if n.startswith(("keys.", "vectors.")))
+
+
+def test_dense_cache_only_removes_its_own_files(tmp_path):
+    path, index_dir = str(tmp_path / "kb.jsonl"), str(tmp_path / "dense")
+    write_jsonl(path, [record("pantograph", 0.9)])
+    first = DenseRetriever(path, text_fn, embedder=HashEmbedder(), index_dir=index_dir)
+    first_files = cache_files(index_dir)
+
+    # 另一个进程（这里用另一个实例模拟）写出新版本时，不删除仍可能被加载的旧版本
+    append_jsonl(path, [record("insulator", 0.9)])
+    second = DenseRetriever(path, text_fn, embedder=HashEmbedder(), index_dir=index_dir)
+    second_files = [n for n in cache_files(index_dir) if n not in first_files]
+    assert len(second_files) == 2 and set(first_files) <= set(cache_files(index_dir))
+
+    append_jsonl(path, [record("catenary wire", 0.9)])
+    assert first.refresh()
+    remaining = cache_files(index_dir)
+    assert not set(first_files) & set(remaining)
+    assert set(second_files) <= set(remaining) and len(remaining) == 4
+
+
+def test_dense_cache_is_capped(tmp_path):
+    path = str(tmp_path / "kb.jsonl")
+    write_jsonl(path, [record(o, 0.9) for o in ("pantograph", "insulator", "catenary wire", "bolt")])
+    dense = DenseRetriever(path, text_fn, embedder=HashEmbedder(), index_dir=str(tmp_path / "dense"),
+                           max_cache_items=3)
+    assert len(dense._cache_keys) == 4               # 当前记录用到的向量不丢弃
+
+    write_jsonl(path, [record(o, 0.9) for o in ("insulator", "dropper")])
+    assert dense.refresh()
+    assert len(dense._cache_keys) == 3 and len(dense._cache_vectors) == 3
+    assert objects(dense) == ["insulator", "dropper"]
+    hits = dense.search(["dropper"], top_k=1)[0]
+    assert dense.get_item(hits[0][0])["object"] == "dropper"
+
+    reloaded = DenseRetriever(path, text_fn, embedder=HashEmbedder(), index_dir=str(tmp_path / "dense"),
+                              max_cache_items=3)
+    assert reloaded._cache_keys == dense._cache_keys
@@ -0,0 +1,80 @@
+import json
+
+import numpy as np
+import pytest
+
+# agent.pipeline 在导入时加载评估 / 规划模块，需要完整的运行环境
+pytest.importorskip("transformers")
+pytest.importorskip("streamlit")
+
+from agent.pipeline import Job, VisionManusPipeline
+from rag.strategy_writer import StrategyWriter
+from rag.vision_rag import VisionRAG
+
+
+class StubPlanner:
+    """任务理解返回固定对象；路由调用只计数（本测试中不应发生）"""
+
+    def __init__(self):
+        self.calls = []
+        self.last_usage = {}
+
+    def run(self, sys_prompt, user_prompt, schema=None, **kwargs):
+        self.calls.append(schema.name)
+        if schema.name == "task_understanding":
+            return "", json.dumps({"user_goal": "segment", "task_object": "bolt"})
+        return "", json.dumps({"tool": "Terminate", "parameters": {"reason": "stub"}})
+
+
+class StubEvaluator:
+    """按调用顺序返回给定的评分"""
+
+    def __init__(self, scores):
+        self.scores = list(scores)
+
+    def run(self, img, mask, prompt, visual_concept):
+        score = self.scores.pop(0)
+        return {"score": score, "coverage": 0.4, "connectivity": 0.3}, "coverage", "semantic"
+
+
+class StubSegmenter:
+
+    def __init__(self):
+        self.calls = 0
+
+    def segment(self, class_name, img):
+        self.calls += 1
+        mask = np.zeros(img.shape[:2], dtype=np.uint8)
+        mask[8:40, 8:40] = 255
+        return mask
+
+    patch_segment = roi_segment = None
+
+
+def test_stored_strategy_is_replayed_without_routing(tmp_path):
+    visual, strategies = tmp_path / "visual.jsonl", tmp_path / "strategies.jsonl"
+    visual.write_text("")
+    planner, segmenter = StubPlanner(), StubSegmenter()
+    # 第一个作业：分割 0.6 → 规则路由后处理 → 0.9 通过并入库；第二个作业回放评分 0.82
+    evaluator = StubEvaluator([0.6, 0.9, 0.82])
+    pipeline = VisionManusPipeline(
+        rag=VisionRAG(str(visual), str(strategies)),
+        planner=planner,
+        evaluator=evaluator,
+        segmenter=segmenter,
+        writer=StrategyWriter(str(strategies), background_compaction=False),
+    )
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+
+    first = pipeline.run_job(Job("a", img, "Segment the bolt."))
+    assert first.status == "Pass" and not first.replayed
+    stored = [json.loads(line) for line in strategies.read_text().splitlines()]
+    assert [s["tool"] for s in stored[0]["strategy_summary"]["steps"]] == ["iSeg-Plus", "postprocess_preserve_small"]
+
+    second = pipeline.run_job(Job("b", img, "Segment the bolt."))
+    # 检索 → 选择 → 解析 → 绑定 → 执行，评分达到入库阈值即通过，不调用路由
+    assert second.status == "Pass" and second.replayed
+    assert second.best_score == 0.82 and second.rounds == 1
+    assert planner.calls == ["task_understanding", "task_understanding"]
+    assert pipeline.replayer.stats() == {"replay_attempts": 1, "replay_passes": 1}
+    assert segmenter.calls == 2 and not evaluator.scores
@@ -0,0 +1,51 @@
+import numpy as np
+
+from tools.roi import merge_boxes, roi_boxes, zoom_factor
+
+
+def test_empty_mask_has_no_roi():
+    assert roi_boxes(np.zeros((64, 64), dtype=np.uint8)) == []
+
+
+def test_small_target_is_kept():
+    # 1080p 图像中 6×6 的小目标：固定 64 像素阈值会把它当噪声丢掉
+    mask = np.zeros((1080, 1920), dtype=np.uint8)
+    mask[500:506, 900:906] = 255
+    boxes = roi_boxes(mask)
+    assert len(boxes) == 1
+    y0, y1, x0, x1 = boxes[0]
+    assert y0 <= 500 and y1 >= 506 and x0 <= 900 and x1 >= 906
+
+
+def test_tiny_components_fall_back_to_the_largest():
+    mask = np.zeros((200, 200), dtype=np.uint8)
+    mask[10:12, 10:12] = 255
+    mask[100:105, 150:155] = 255
+    boxes = roi_boxes(mask, min_area=64, min_margin=0)
+    assert len(boxes) == 1
+    y0, y1, x0, x1 = boxes[0]
+    assert y0 <= 100 and y1 >= 105 and x0 <= 150 and x1 >= 155
+
+
+def test_noise_is_dropped_next_to_a_real_target():
+    mask = np.zeros((400, 400), dtype=np.uint8)
+    mask[100:200, 100:200] = 255
+    mask[350, 350] = 255
+    boxes = roi_boxes(mask, min_area=16, min_margin=0)
+    assert boxes == [(75, 225, 75, 225)]
+    assert all(isinstance(v, int) for v in boxes[0])
+
+
+def test_overlapping_boxes_are_merged_and_capped():
+    assert merge_boxes([(0, 10, 0, 10), (5, 15, 5, 15), (20, 30, 20, 30)]) == [(0, 15, 0, 15), (20, 30, 20, 30)]
+
+    mask = np.zeros((1000, 1000), dtype=np.uint8)
+    for k in range(6):
+        mask[k * 160 + 10:k * 160 + 60, 10 + k * 20:60 + k * 20] = 255
+    assert len(roi_boxes(mask, max_rois=4, min_margin=0)) == 4
+
+
+def test_zoom_factor_never_shrinks():
+    assert zoom_factor(2000, 1000) == 1.0
+    assert zoom_factor(128, 64, zoom_side=1024, max_zoom=4.0) == 4.0
+    assert zoom_factor(512, 256, zoom_side=1024) == 2.0
@@ -0,0 +1,53 @@
+from agent.memory import Memory
+from agent.router import RuleRouter
+
+from helpers import memory_with, patch_step, FIRST
+
+
+def test_pass_and_terminate():
+    router = RuleRouter()
+    assert router.decide({"score": 0.9}, Memory(), 1, 3)["tool"] == "Pass"
+    # 被门控拦截的结果不能直接通过
+    assert router.decide({"score": 0.9, "gated": True, "coverage": 0.5, "connectivity": 1.0},
+                         Memory(), 3, 3)["tool"] == "Terminate"
+    assert router.decide({"score": 0.5, "coverage": 0.5, "connectivity": 1.0}, Memory(), 3, 3)["tool"] == "Terminate"
+
+
+def test_low_coverage_densifies_patch_grid():
+    router = RuleRouter()
+    result = {"score": 0.3, "coverage": 0.05, "connectivity": 1.0}
+
+    d = router.decide(result, memory_with(FIRST), 1, 5)
+    assert d["tool"] == "split_image_patches"
+    assert (d["parameters"]["rows"], d["parameters"]["cols"]) == (2, 2)
+    assert d["parameters"]["img"] == "IMG" and d["parameters"]["class_name"] == "task_object"
+
+    d = router.decide(result, memory_with(FIRST, patch_step(2, 2)), 2, 5)
+    assert (d["parameters"]["rows"], d["parameters"]["cols"]) == (3, 3)
+
+    # 最密网格已用过：交给 LLM
+    assert router.decide(result, memory_with(FIRST, patch_step(4, 4)), 3, 5) is None
+
+
+def test_fragmented_mask_goes_to_postprocess_once():
+    router = RuleRouter()
+    result = {"score": 0.5, "coverage": 0.4, "connectivity": 0.3}
+    assert router.decide(result, memory_with(FIRST), 1, 5)["tool"] == "postprocess_preserve_small"
+
+    post = ("postprocess_preserve_small", {"mask": "MASK"}, result)
+    assert router.decide(result, memory_with(FIRST, post), 2, 5) is None
+    assert router.stats() == {"rule_decisions": 1, "llm_fallbacks": 1}
+
+
+def test_unclear_case_falls_back_to_llm():
+    router = RuleRouter()
+    assert router.decide({"score": 0.6, "coverage": 0.4, "connectivity": 0.9}, memory_with(FIRST), 1, 5) is None
+
+
+def test_final_round_leaves_storable_scores_to_llm():
+    router = RuleRouter()
+    result = {"score": 0.82, "coverage": 0.4, "connectivity": 0.9}
+    # 0.82 低于 pass_score 但达到入库阈值：最后一轮仍交给 LLM 决定是否 Pass
+    assert router.decide(result, memory_with(FIRST), 3, 3) is None
+    assert router.decide({**result, "score": 0.79}, memory_with(FIRST), 3, 3)["tool"] == "Terminate"
+    assert RuleRouter(write_score=0.9).decide(result, memory_with(FIRST), 3, 3)["tool"] == "Terminate"
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+# agent.segment 在导入时加载 iSeg / streamlit
+pytest.importorskip("iSeg_Plus")
+pytest.importorskip("streamlit")
+
+import agent.segment as segment
+
+
+def reference_patch_segment(tiles, boxes, H, W, threshold=0.5):
+    """逐 patch 加权融合再二值化（未做任何优化的串行写法），作为对照"""
+    stitched = np.zeros((H, W), dtype=np.float32)
+    weight = np.zeros((H, W), dtype=np.float32)
+    for (y0, y1, x0, x1), mask in zip(boxes, tiles):
+        mask = mask.astype(np.float32)
+        if mask.max() > 1:
+            mask /= 255.0
+        h, w = mask.shape
+        wy, wx = np.linspace(0, 1, h), np.linspace(0, 1, w)
+        window = np.outer(np.minimum(wy, wy[::-1]), np.minimum(wx, wx[::-1])) + 1e-6
+        stitched[y0:y1, x0:x1] += mask * window
+        weight[y0:y1, x0:x1] += window
+    weight[weight == 0] = 1e-6
+    merged = np.clip(stitched / weight, 0, 1)
+    return (merged >= threshold).astype(np.uint8) * 255
+
+
+def run_patch_segment(monkeypatch, tiles, rows, cols, H, W, **kwargs):
+    """按调用顺序依次返回 tiles 作为各 patch 的模型输出，记录每个 patch 的范围"""
+    boxes, outputs = [], iter(tiles)
+
+    def fake_run_one_image(model, class_name, patch, **kw):
+        return next(outputs)
+
+    monkeypatch.setattr(segment, "run_one_image", fake_run_one_image)
+    seg = object.__new__(segment.segmenter_iSeg)
+    seg.model, seg.patch_workers = None, 1
+    img = np.zeros((H, W, 3), dtype=np.uint8)
+    out = seg.patch_segment("bolt", img, rows=rows, cols=cols, **kwargs)
+
+    ph, pw = H // rows, W // cols
+    for r in range(rows):
+        for c in range(cols):
+            boxes.append((r * ph, H if r == rows - 1 else (r + 1) * ph,
+                          c * pw, W if c == cols - 1 else (c + 1) * pw))
+    return out, boxes
+
+
+def tile_shapes(rows, cols, H, W):
+    ph, pw = H // rows, W // cols
+    return [((H - r * ph) if r == rows - 1 else ph, (W - c * pw) if c == cols - 1 else pw)
+            for r in range(rows) for c in range(cols)]
+
+
+def test_no_overlap_matches_serial_blend_for_probability_tiles(monkeypatch):
+    rng = np.random.default_rng(0)
+    H, W, rows, cols = 67, 53, 3, 2
+    # 概率图输出，集中在阈值附近最容易暴露 float32 舍入差异
+    tiles = [(0.5 + rng.uniform(-1e-6, 1e-6, shape)).astype(np.float32) for shape in tile_shapes(rows, cols, H, W)]
+
+    out, boxes = run_patch_segment(monkeypatch, tiles, rows, cols, H, W, overlap=0)
+    np.testing.assert_array_equal(out, reference_patch_segment(tiles, boxes, H, W))
+
+
+def test_no_overlap_binary_tiles_take_the_fast_path(monkeypatch):
+    rng = np.random.default_rng(1)
+    H, W, rows, cols = 40, 30, 2, 2
+    tiles = [(rng.random(shape) > 0.5).astype(np.uint8) * 255 for shape in tile_shapes(rows, cols, H, W)]
+
+    out, boxes = run_patch_segment(monkeypatch, tiles, rows, cols, H, W, overlap=0)
+    np.testing.assert_array_equal(out, reference_patch_segment(tiles, boxes, H, W))
+    assert set(np.unique(out)) <= {0, 255}
@@ -0,0 +1,183 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+from agent.mask import Mask
+from serving import protocol
+from serving.backends import LocalBackend, StubBackend
+from serving.server import ModelServer
+
+
+class RecordingBackend(StubBackend):
+    """记录每个入口收到的批大小"""
+
+    def __init__(self):
+        self.batches = {"planner": [], "soft_eval": [], "segment": []}
+
+    def planner_batch(self, reqs):
+        self.batches["planner"].append(len(reqs))
+        return super().planner_batch(reqs)
+
+    def soft_eval_batch(self, reqs):
+        self.batches["soft_eval"].append(len(reqs))
+        return super().soft_eval_batch(reqs)
+
+    def segment_batch(self, reqs):
+        self.batches["segment"].append(len(reqs))
+        return super().segment_batch(reqs)
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(backend, **kwargs):
+        server = ModelServer(backend, port=0, **kwargs)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def post(server, path, payload):
+    req = urllib.request.Request(server.address + path, data=protocol.dumps(payload), method="POST",
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return protocol.loads(resp.read())
+
+
+def post_concurrently(server, path, payloads):
+    results = [None] * len(payloads)
+
+    def worker(i):
+        try:
+            results[i] = post(server, path, payloads[i])
+        except urllib.error.HTTPError as e:
+            results[i] = (e.code, json.loads(e.read())["error"])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(payloads))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+IMG = np.arange(8 * 8 * 3, dtype=np.uint8).reshape(8, 8, 3)
+
+
+def test_stub_backend_batches_concurrent_requests(serve):
+    backend = RecordingBackend()
+    server = serve(backend, max_batch=4, max_wait=0.2)
+
+    outs = post_concurrently(server, "/evaluate/soft",
+                             [{"img": IMG, "mask": Mask.from_array(IMG[..., 0] > 100), "prompt": "p"}] * 4)
+    assert all(o["coverage_score"] == 0.8 for o in outs)
+    assert sum(backend.batches["soft_eval"]) == 4 and max(backend.batches["soft_eval"]) > 1
+
+    outs = post_concurrently(server, "/planner/run", [
+        {"sys_prompt": "s", "user_prompt": f"Segment the bolt{i}.", "schema": "task_understanding"}
+        for i in range(3)])
+    assert sorted(json.loads(o["content"])["task_object"] for o in outs) == ["bolt0", "bolt1", "bolt2"]
+
+    mask = post(server, "/segment", {"class_name": "bolt", "img": IMG})["mask"]
+    assert isinstance(mask, Mask) and mask.shape == (8, 8)
+
+    health = json.loads(urllib.request.urlopen(server.address + "/health", timeout=10).read())
+    assert health["backend"] == "stub" and health["stats"]["evaluate/soft"]["items"] == 4
+
+
+class FakePlanner:
+
+    def __init__(self):
+        self.last_usage = {}
+        self.calls = []
+
+    def run(self, sys_prompt, user_prompt, schema=None, thinking="full", thinking_budget=512):
+        if user_prompt == "fail":
+            raise RuntimeError("planner failed")
+        self.calls.append((user_prompt, schema, thinking))
+        self.last_usage = {"thinking_tokens": 1, "answer_tokens": 2}
+        return "", json.dumps({"echo": user_prompt})
+
+
+class FakeEvaluator:
+
+    def __init__(self):
+        self.batches = []
+
+    def soft_evaluate_batch(self, items, input_policy=None):
+        self.batches.append((len(items), input_policy))
+        return [(0.5, "c", 0.7, "s") for _ in items]
+
+
+class FakeSegmenter:
+
+    def segment(self, class_name, img):
+        return (np.asarray(img)[..., 0] > 100) * 255
+
+    def patch_segment(self, class_name, img, rows=2, cols=2, overlap=0, run_args=None):
+        return np.full(np.asarray(img).shape[:2], 255, dtype=np.uint8)
+
+    def roi_segment(self, class_name, img, mask, **kwargs):
+        return mask
+
+
+def local_backend():
+    """不加载模型的 LocalBackend：三个模型换成假对象"""
+    backend = object.__new__(LocalBackend)
+    backend.schemas = {"router": "router-schema"}
+    backend.EvalInputPolicy = lambda **kw: kw
+    backend.planner, backend.evaluator, backend.segmenter = FakePlanner(), FakeEvaluator(), FakeSegmenter()
+    return backend
+
+
+def test_local_backend_groups_soft_eval_by_policy(serve):
+    backend = local_backend()
+    server = serve(backend, max_batch=4, max_wait=0.2)
+    mask = Mask.from_array(IMG[..., 0] > 100)
+    policy = {"max_side": 512, "mask_render": "overlay"}
+
+    outs = post_concurrently(server, "/evaluate/soft", [
+        {"img": IMG, "mask": mask, "prompt": "p", "policy": None},
+        {"img": IMG, "mask": mask, "prompt": "p", "policy": policy},
+        {"img": IMG, "mask": mask, "prompt": "p", "policy": None},
+        {"img": IMG, "mask": mask, "prompt": "p", "policy": policy},
+    ])
+    assert all(o == {"coverage_score": 0.5, "coverage_reason": "c", "semantic_score": 0.7, "semantic_reason": "s"}
+               for o in outs)
+    # 同一批内按输入策略分组，每组一次 batched 调用
+    assert sum(n for n, _ in backend.evaluator.batches) == 4
+    assert {json.dumps(p, sort_keys=True) for _, p in backend.evaluator.batches} == {"null", json.dumps(policy, sort_keys=True)}
+    assert max(n for n, _ in backend.evaluator.batches) > 1
+
+
+def test_local_backend_isolates_failures_within_a_batch(serve):
+    backend = local_backend()
+    server = serve(backend, max_batch=3, max_wait=0.2)
+
+    outs = post_concurrently(server, "/planner/run", [
+        {"sys_prompt": "s", "user_prompt": "a", "schema": "router", "thinking": "no_think"},
+        {"sys_prompt": "s", "user_prompt": "fail"},
+        {"sys_prompt": "s", "user_prompt": "b"},
+    ])
+    assert json.loads(outs[0]["content"]) == {"echo": "a"} and outs[0]["usage"]["answer_tokens"] == 2
+    assert outs[1] == (500, "RuntimeError: planner failed")
+    assert json.loads(outs[2]["content"]) == {"echo": "b"}
+    assert ("a", "router-schema", "no_think") in backend.planner.calls
+
+    outs = post_concurrently(server, "/segment", [
+        {"class_name": "bolt", "img": IMG},
+        {"class_name": "bolt", "img": IMG, "patch": True, "rows": 2, "cols": 2},
+        {"class_name": "bolt", "img": IMG, "roi": True},            # 缺少 mask：只有这一项失败
+    ])
+    assert np.array_equal(np.asarray(outs[0]["mask"]), (IMG[..., 0] > 100) * 255)
+    assert np.asarray(outs[1]["mask"]).all()
+    assert outs[2][0] == 500 and "KeyError" in outs[2][1]
@@ -0,0 +1,95 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+# agent.pipeline 在导入时加载评估 / 规划模块，需要完整的运行环境
+pytest.importorskip("transformers")
+pytest.importorskip("streamlit")
+
+from agent.pipeline import Job, JobResult, JobState, STAGES
+from agent.stage_runner import StagedRunner
+
+
+class StubPipeline:
+    """按 STAGES 顺序流转、路由后回到分割 loops 次的假引擎，每个阶段睡眠 delay 秒"""
+
+    def __init__(self, loops=2, delay=0.002, fail_on=None):
+        self.loops = loops
+        self.delay = delay
+        self.fail_on = fail_on
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def start_job(self, job):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return JobState(job=job, result=JobResult(job_id=job.job_id, prompt=job.prompt),
+                        log=lambda role, msg: None, emit_mask=lambda m: None, t_start=time.perf_counter())
+
+    def step(self, stage, state):
+        time.sleep(self.delay)
+        if self.fail_on == (state.job.job_id, stage):
+            with self._lock:
+                self.in_flight -= 1
+            raise RuntimeError("boom")
+        if stage == "route":
+            state.attempt += 1
+            return "segment" if state.attempt <= self.loops else None
+        return STAGES[STAGES.index(stage) + 1]
+
+    def finish_job(self, state):
+        with self._lock:
+            self.in_flight -= 1
+        state.result.status = "Pass"
+        state.result.rounds = state.attempt - 1
+        return state.result
+
+
+def jobs(n):
+    return (Job(job_id=str(i), image=None, prompt="p") for i in range(n))
+
+
+def test_all_jobs_finish_and_stats_add_up():
+    pipeline = StubPipeline(loops=2)
+    runner = StagedRunner(pipeline, max_in_flight=3)
+    results = list(runner.run(jobs(10)))
+
+    assert sorted(int(r.job_id) for r in results) == list(range(10))
+    assert all(r.status == "Pass" and r.rounds == 2 for r in results)
+    assert pipeline.max_in_flight <= 3
+
+    stats = runner.stats()
+    assert stats["understand"]["items"] == 10
+    assert stats["segment"]["items"] == 20
+    assert all(s["max_queue"] <= 3 + s["workers"] for s in stats.values())
+    assert runner.bottleneck() in STAGES
+
+
+def test_failed_job_is_reported_without_stopping_the_batch():
+    runner = StagedRunner(StubPipeline(fail_on=("3", "evaluate")), max_in_flight=2)
+    results = {r.job_id: r for r in runner.run(jobs(6))}
+
+    assert len(results) == 6
+    assert results["3"].status == "error" and "boom" in results["3"].error
+    assert all(r.status == "Pass" for k, r in results.items() if k != "3")
+
+
+def test_early_close_releases_the_feeder():
+    infinite = (Job(job_id=str(i), image=None, prompt="p") for i in itertools.count())
+    runner = StagedRunner(StubPipeline(loops=1), max_in_flight=2)
+    it = runner.run(infinite)
+    for _ in range(3):
+        next(it)
+    it.close()
+
+    deadline = time.time() + 2.0
+    while time.time() < deadline:
+        alive = [t for t in threading.enumerate() if t.name.startswith("stage-")]
+        if not alive:
+            break
+        time.sleep(0.02)
+    assert not alive
@@ -0,0 +1,89 @@
+import json
+import threading
+
+from rag.strategy_writer import StrategyWriter, strategy_key, summarize_strategy
+from agent.memory import Memory
+
+
+def record(obj, conf, rows=2):
+    steps = [
+        {"round": 1, "tool": "iSeg-Plus", "params": {"class_name": "task_object"}},
+        {"round": 2, "tool": "split_image_patches", "params": {"class_name": "task_object", "rows": rows, "cols": rows}},
+    ]
+    return {"object": obj, "confidence": conf,
+            "strategy_summary": {"path": [s["tool"] for s in steps], "steps": steps}}
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_strategy_key_normalizes_object_and_uses_params():
+    assert strategy_key(record("  Bolt ", 0.9)) == strategy_key(record("bolt", 0.5))
+    assert strategy_key(record("bolt", 0.9, rows=2)) != strategy_key(record("bolt", 0.9, rows=3))
+
+
+def test_duplicates_are_skipped_unless_more_confident(tmp_path):
+    path = str(tmp_path / "s.jsonl")
+    writer = StrategyWriter(path, background_compaction=False)
+
+    assert writer.append(record("bolt", 0.8))
+    assert not writer.append(record("bolt", 0.8))
+    assert not writer.append(record("Bolt", 0.7))
+    assert writer.append(record("bolt", 0.8, rows=3))
+    assert writer.stats()["skipped_duplicates"] == 2
+
+    # 更高置信度的同路径记录替换旧记录（同步压缩）
+    assert writer.append(record("bolt", 0.95))
+    rows = read(path)
+    assert len(rows) == 2 and writer.compactions == 1
+    assert sorted(r["confidence"] for r in rows) == [0.8, 0.95]
+
+
+def test_compaction_keeps_top_records_per_object(tmp_path):
+    path = str(tmp_path / "s.jsonl")
+    writer = StrategyWriter(path, max_per_object=2, background_compaction=False)
+    for rows, conf in ((2, 0.7), (3, 0.9), (4, 0.8)):
+        writer.append(record("bolt", conf, rows=rows))
+    writer.append(record("insulator", 0.6))
+
+    rows = read(path)
+    bolts = [r for r in rows if r["object"] == "bolt"]
+    assert sorted(r["confidence"] for r in bolts) == [0.8, 0.9]
+    assert [r["object"] for r in rows].count("insulator") == 1
+    assert writer.compact() == 0
+
+
+def test_writers_see_each_others_records(tmp_path):
+    path = str(tmp_path / "s.jsonl")
+    a = StrategyWriter(path, background_compaction=False)
+    b = StrategyWriter(path, background_compaction=False)
+    assert a.append(record("bolt", 0.8))
+    assert not b.append(record("bolt", 0.8))
+
+
+def test_concurrent_appends_do_not_interleave(tmp_path):
+    path = str(tmp_path / "s.jsonl")
+    writer = StrategyWriter(path, max_per_object=1000, background_compaction=False)
+
+    def worker(k):
+        for i in range(25):
+            writer.append(record(f"object-{k}", 0.5, rows=i + 2))
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(read(path)) == 100
+
+
+def test_summarize_strategy_drops_fan_out_candidates():
+    memory = Memory()
+    memory.record(1, "iSeg-Plus", {"class_name": "bolt"}, {"score": 0.4})
+    memory.record(2, "postprocess_preserve_small", {}, {"score": 0.5}, candidate=True)
+    memory.record(2, "split_image_patches", {"rows": 2, "cols": 2}, {"score": 0.9})
+    ss = summarize_strategy(memory)
+    assert ss["path"] == ["iSeg-Plus", "split_image_patches"]
+    assert [s["tool"] for s in ss["steps"]] == ss["path"]
@@ -0,0 +1,77 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from agent.structured import (JsonObjectStoppingCriteria, ROUTER_SCHEMA, TASK_SCHEMA,
+                              extract_json_object, parse_json_output)
+
+
+class CharTokenizer:
+    """每个字符一个 token（token id 即字符的码位）"""
+
+    def encode(self, text):
+        return [ord(ch) for ch in text]
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(chr(i) for i in ids)
+
+
+def test_parse_nested_objects_and_braces_in_strings():
+    text = 'Sure:\n```json\n{"tool": "split_image_patches", "parameters": {"rows": 2, "reason": "a } in {text}"}}\n```'
+    obj = parse_json_output(text, ROUTER_SCHEMA)
+    assert obj["parameters"] == {"rows": 2, "reason": "a } in {text}"}
+
+
+def test_parse_escaped_quotes_and_trailing_text():
+    text = '{"user_goal": "say \\"hi}\\"", "task_object": "bolt"} and then {"ignored": 1}'
+    assert extract_json_object(text) == '{"user_goal": "say \\"hi}\\"", "task_object": "bolt"}'
+    assert parse_json_output(text, TASK_SCHEMA)["user_goal"] == 'say "hi}"'
+
+
+def test_parse_repairs_trailing_commas():
+    assert parse_json_output('{"tool": "Pass", "parameters": {"reason": "ok",},}') == {
+        "tool": "Pass", "parameters": {"reason": "ok"}}
+
+
+@pytest.mark.parametrize("text, message", [
+    ("no json here", "no JSON object"),
+    ('{"tool": "Pass"', "no JSON object"),                  # 未闭合
+    ('{"tool": Pass}', "malformed JSON"),
+    ('{"user_goal": "x"}', "missing keys"),
+])
+def test_parse_errors(text, message):
+    with pytest.raises(ValueError, match=message):
+        parse_json_output(text, TASK_SCHEMA)
+
+
+def generate(criteria, prompt, continuations):
+    """逐 token 追加 continuations 中的字符，返回各序列第一次被判定停止时已生成的文本"""
+    tok = CharTokenizer()
+    rows = [tok.encode(prompt) for _ in continuations]
+    stopped = [None] * len(continuations)
+    for step in range(max(len(c) for c in continuations)):
+        for i, c in enumerate(continuations):
+            rows[i].append(ord(c[step]) if step < len(c) else ord(" "))
+        done = criteria(torch.tensor(rows, dtype=torch.long), None).tolist()
+        for i, d in enumerate(done):
+            if d and stopped[i] is None:
+                stopped[i] = tok.decode(rows[i][len(prompt):])
+    return stopped
+
+
+def test_stopping_criteria_stops_when_top_level_object_closes():
+    prompt = "prompt {not json"
+    criteria = JsonObjectStoppingCriteria(CharTokenizer(), prompt_len=len(prompt), max_answer_tokens=200)
+    answers = ['{"a": {"b": "}"}} trailing', 'text {"x": "{{"} more']
+    assert generate(criteria, prompt, answers) == ['{"a": {"b": "}"}}', 'text {"x": "{{"}']
+
+
+def test_stopping_criteria_waits_for_start_token_and_enforces_budget():
+    prompt = "p"
+    end_think = ord("|")
+    criteria = JsonObjectStoppingCriteria(CharTokenizer(), prompt_len=len(prompt), max_answer_tokens=8,
+                                          start_token_id=end_think)
+    # 思考内容里的 {} 不计入；第二个序列的回答超过 8 个 token 仍未闭合
+    answers = ['{think}|{"k": 1}', 'hmm|{"key": "long value"}']
+    assert generate(criteria, prompt, answers) == ['{think}|{"k": 1}', 'hmm|{"key": ']
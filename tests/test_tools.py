@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from tools.base import LazyToolRegistry, ToolSpec, TOOL_REGISTRY
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_factory_runs_once_on_first_call():
+    created = []
+
+    def factory():
+        time.sleep(0.01)
+        created.append(1)
+        return lambda x: x * 2
+
+    spec = ToolSpec("double", factory, params={"x": {"type": "int"}}, resources=("cpu",))
+    registry = LazyToolRegistry([spec])
+    assert not spec.loaded and "double" in registry and len(registry) == 1
+
+    threads = [threading.Thread(target=lambda: registry["double"](x=3)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert created == [1] and spec.loaded
+    assert registry["double"](4) == 8
+
+
+def test_builtin_registry_is_declarative():
+    # 导入 tools.base 不加载任何模型或工具实现
+    check = "import sys, tools.base; assert not {'agent.segment', 'tools.postprocess'} & set(sys.modules)"
+    subprocess.run([sys.executable, "-c", check], check=True, cwd=ROOT)
+    assert set(TOOL_REGISTRY) == {"split_image_patches", "zoom_in_roi", "postprocess_preserve_small"}
+    assert TOOL_REGISTRY["split_image_patches"].resources == ("cuda", "iseg")
+    assert TOOL_REGISTRY["zoom_in_roi"].params["mask"]["placeholder"] == "MASK"
+    assert TOOL_REGISTRY["postprocess_preserve_small"].resources == ("cpu",)
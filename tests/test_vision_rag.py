@@ -0,0 +1,116 @@
+import json
+
+import numpy as np
+import pytest
+
+from rag.retriever import DenseRetriever, Retriever
+from rag.vision_rag import VisionRAG, _format_path
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r) + "\n")
+
+
+def make_rag(tmp_path, **kwargs):
+    visual = tmp_path / "visual.jsonl"
+    strategy = tmp_path / "strategy.jsonl"
+    write_jsonl(visual, [
+        {"object": "pantograph", "aliases": ["collector"], "tags": ["metal"], "prior": "on the roof"},
+        {"object": "insulator", "aliases": [], "tags": ["ceramic"], "prior": "stacked discs"},
+    ])
+    steps = [
+        {"round": 1, "tool": "iSeg-Plus", "params": {"class_name": "bolt"}},
+        {"round": 2, "tool": "split_image_patches",
+         "params": {"class_name": "bolt", "cols": 2, "img": "IMG", "overlap": 32, "rows": 2}},
+    ]
+    write_jsonl(strategy, [{
+        "object": "bolt",
+        "confidence": 0.9,
+        "final_score": {"score": 0.9},
+        "strategy_summary": {"path": [s["tool"] for s in steps], "steps": steps},
+    }])
+    return VisionRAG(str(visual), str(strategy), **kwargs)
+
+
+def test_format_path_shows_step_params():
+    ss = {"path": ["iSeg-Plus", "split_image_patches"], "steps": [
+        {"tool": "iSeg-Plus", "params": {"class_name": "bolt"}},
+        {"tool": "split_image_patches", "params": {"class_name": "bolt", "img": "IMG", "rows": 3, "cols": 2}},
+    ]}
+    assert _format_path(ss) == "iSeg-Plus -> split_image_patches(rows=3, cols=2)"
+    assert _format_path({"path": ["iSeg-Plus"]}) == "iSeg-Plus"
+
+
+def test_strategy_context_keeps_patch_grid(tmp_path):
+    rag = make_rag(tmp_path)
+    context, hits = rag.retrieve_strategy_cases("bolt")
+    assert hits and hits[0]["object"] == "bolt"
+    assert "split_image_patches(cols=2, overlap=32, rows=2)" in context
+
+
+def test_retriever_interface_is_abstract():
+    class Partial(Retriever):
+        def refresh(self):
+            return False
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_dense_retrievers_share_one_embedder(tmp_path):
+    # 源文件不存在时不会编码，不需要加载模型
+    a = DenseRetriever(str(tmp_path / "a.jsonl"), lambda d: d["object"])
+    b = DenseRetriever(str(tmp_path / "b.jsonl"), lambda d: d["object"])
+    assert a.embedder is b.embedder
+
+
+class HashEmbedder:
+    name = "hash-embedder"
+
+    def encode(self, texts):
+        out = np.zeros((len(texts), 64), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for j in range(len(t) - 1):
+                out[i, hash(t[j:j + 2]) % 64] += 1.0
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-6)
+
+
+def test_min_score_defaults_follow_the_retriever(tmp_path):
+    tfidf = make_rag(tmp_path)
+    dense = make_rag(tmp_path, retriever="dense", embedder=HashEmbedder())
+    assert tfidf.strategy_index.min_scores != dense.strategy_index.min_scores
+
+    # 稠密检索下与库中记录毫无关系的查询不应被 TF-IDF 的低阈值放行
+    score = dense.strategy_index.search(["zzzz"], top_k=1)[0][0][1]
+    assert score < dense.strategy_index.min_scores["strategy"]
+    assert dense.retrieve_strategy_cases("zzzz")[1] == []
+    assert dense.retrieve_strategy_cases("bolt iSeg-Plus split_image_patches")[1]
+
+
+def test_batch_retrieval_memoizes_normalized_names(tmp_path):
+    rag = make_rag(tmp_path)
+    searches = []
+    search = rag.visual_index.search
+    rag.visual_index.search = lambda queries, top_k: searches.append(list(queries)) or search(queries, top_k)
+
+    batch = rag.retrieve_visual_concept_batch(["Pantograph", " pantograph ", "insulator"])
+    assert searches == [["insulator", "pantograph"]]          # 去重后一次检索
+    assert batch[0][1] == batch[1][1] and batch[0][1][0]["object"] == "pantograph"
+    assert batch[2][1][0]["object"] == "insulator"
+    assert rag.retrieve_visual_concept("PANTOGRAPH")[1] == batch[0][1]
+    assert len(searches) == 1
+
+    # 知识库变化后缓存失效
+    with open(tmp_path / "visual.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps({"object": "pantograph head", "aliases": [], "tags": [], "prior": "x"}) + "\n")
+    rag.retrieve_visual_concept("pantograph")
+    assert searches[-1] == ["pantograph"] and len(searches) == 2
+
+
+def test_empty_object_is_not_searched(tmp_path):
+    rag = make_rag(tmp_path)
+    context, hits = rag.retrieve_visual_concept("")
+    assert hits == [] and "No prior" in context
+    assert rag._visual_memo == {}
@@ -1,8 +1,119 @@
-from agent.segment import segmenter_iSeg
-from tools.postprocess import postprocess_preserve_small
+import threading
+from collections.abc import Mapping
 
 
-TOOL_REGISTRY = {
-    "split_image_patches": segmenter_iSeg().patch_segment,
-    "postprocess_preserve_small": postprocess_preserve_small,
-}
+# ——————————————————————————— 工具声明 ———————————————————————————
+# 每个工具声明名称、参数说明与资源需求，实际的函数（以及它依赖的模型）
+# 在第一次调用时才创建，import tools.base 不会加载任何模型。
+class ToolSpec:
+
+    def __init__(self, name, factory, params=None, resources=(), description=""):
+        """
+        name: 工具名（与路由器输出的 tool 一致）
+        factory: 无参函数，返回真正执行的可调用对象
+        params: {参数名: {"type": ..., "placeholder"/"default": ...}}
+        resources: 运行所需资源，例如 ("cuda", "iseg")
+        """
+        self.name = name
+        self.factory = factory
+        self.params = params or {}
+        self.resources = tuple(resources)
+        self.description = description
+
+        self._fn = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._fn is not None
+
+    @property
+    def fn(self):
+        if self._fn is None:
+            with self._lock:
+                if self._fn is None:
+                    self._fn = self.factory()
+        return self._fn
+
+    def __call__(self, *args, **kwargs):
+        return self.fn(*args, **kwargs)
+
+    def __repr__(self):
+        return f"ToolSpec(name={self.name!r}, resources={self.resources}, loaded={self.loaded})"
+
+
+class LazyToolRegistry(Mapping):
+    """按名称索引的工具表，TOOL_REGISTRY[tool](**params) 的用法保持不变"""
+
+    def __init__(self, specs=()):
+        self._specs = {}
+        for spec in specs:
+            self.register(spec)
+
+    def register(self, spec: ToolSpec) -> ToolSpec:
+        self._specs[spec.name] = spec
+        return spec
+
+    def __getitem__(self, name) -> ToolSpec:
+        return self._specs[name]
+
+    def __iter__(self):
+        return iter(self._specs)
+
+    def __len__(self):
+        return len(self._specs)
+
+
+# ——————————————————————————— 内置工具 ———————————————————————————
+def _load_patch_segment():
+    from agent.segment import segmenter_iSeg
+    return segmenter_iSeg().patch_segment
+
+
+def _load_roi_segment():
+    from agent.segment import segmenter_iSeg
+    return segmenter_iSeg().roi_segment
+
+
+def _load_postprocess():
+    from tools.postprocess import postprocess_preserve_small
+    return postprocess_preserve_small
+
+
+TOOL_REGISTRY = LazyToolRegistry([
+    ToolSpec(
+        "split_image_patches",
+        _load_patch_segment,
+        params={
+            "class_name": {"type": "str", "placeholder": "task_object"},
+            "img": {"type": "ndarray", "placeholder": "IMG"},
+            "rows": {"type": "int", "default": 2},
+            "cols": {"type": "int", "default": 2},
+            "overlap": {"type": "int", "default": 0},
+        },
+        resources=("cuda", "iseg"),
+        description="Patch-based re-segmentation with iSeg",
+    ),
+    ToolSpec(
+        "zoom_in_roi",
+        _load_roi_segment,
+        params={
+            "class_name": {"type": "str", "placeholder": "task_object"},
+            "img": {"type": "ndarray", "placeholder": "IMG"},
+            "mask": {"type": "ndarray", "placeholder": "MASK"},
+            "margin": {"type": "float", "default": 0.25},
+            "max_rois": {"type": "int", "default": 4},
+        },
+        resources=("cuda", "iseg"),
+        description="Zoom into the current mask's regions and re-segment them with iSeg",
+    ),
+    ToolSpec(
+        "postprocess_preserve_small",
+        _load_postprocess,
+        params={
+            "mask": {"type": "ndarray", "placeholder": "MASK"},
+        },
+        resources=("cpu",),
+        description="Preserve small targets + Denoising",
+    ),
+])
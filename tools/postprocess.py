@@ -1,3 +1,5 @@
+import math
+
 import cv2
 import numpy as np
 from skimage.restoration import denoise_bilateral
@@ -13,34 +15,44 @@ def postprocess_preserve_small(
     """
     后处理：保留小目标 + 去噪
     mask: uint8 {0,255}
+
+    去噪与补洞都通过“标签 → 保留/填充”查找表一次性完成，
+    双边滤波只在前景外接框（外扩一个滤波窗口）内进行。
     """
     # 1. 二值化
     m = (mask > 128).astype(np.uint8)
 
     # 2. 去除极小噪点（比目标小得多）
     num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(m)
-    cleaned = np.zeros_like(m)
-
-    for i in range(1, num_labels):
-        area = stats[i, cv2.CC_STAT_AREA]
-        if area >= small_component_thr:   # 阈值大幅减小
-            cleaned[labels == i] = 1
+    keep = stats[:, cv2.CC_STAT_AREA] >= small_component_thr   # 阈值大幅减小
+    keep[0] = False                                             # 背景
+    cleaned = keep[labels].astype(np.uint8)
 
     # 3. 填补洞（只填小洞，避免破坏内部结构）
     cleaned_inv = 1 - cleaned
     num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(cleaned_inv)
+    fill = stats[:, cv2.CC_STAT_AREA] <= hole_size_thr          # 小洞才填
+    fill[0] = False                                             # 前景
+    cleaned[fill[labels]] = 1
 
-    for i in range(1, num_labels):
-        area = stats[i, cv2.CC_STAT_AREA]
-        if area <= hole_size_thr:  # 小洞才填
-            cleaned[labels == i] = 1
+    out = np.zeros_like(cleaned)
+    ys, xs = np.nonzero(cleaned)
+    if ys.size == 0:
+        return out
 
     # 4. 使用双边滤波进行“边缘保持”平滑
-    cleaned_float = cleaned.astype(np.float32)
+    # 外扩半个滤波窗口，保证裁剪区域内的结果与整图滤波一致
+    win_size = max(5, 2 * int(math.ceil(3 * sigma_spatial)) + 1)
+    pad = win_size // 2 + 1
+    H, W = cleaned.shape
+    y0, y1 = max(0, ys.min() - pad), min(H, ys.max() + 1 + pad)
+    x0, x1 = max(0, xs.min() - pad), min(W, xs.max() + 1 + pad)
+
+    cleaned_float = cleaned[y0:y1, x0:x1].astype(np.float32)
     smooth = denoise_bilateral(cleaned_float,
                                sigma_color=sigma_color,
                                sigma_spatial=sigma_spatial)
 
-    smooth = (smooth > 0.4).astype(np.uint8)
+    out[y0:y1, x0:x1] = smooth > 0.4
 
-    return (smooth * 255).astype(np.uint8)
+    return (out * 255).astype(np.uint8)
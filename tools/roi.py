@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+
+def _overlaps(a, b):
+    return a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]
+
+
+def merge_boxes(boxes):
+    """合并相互重叠的框 (y0, y1, x0, x1)，直到任意两个框都不重叠"""
+    boxes = [tuple(b) for b in boxes]
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        for box in boxes:
+            for i, other in enumerate(out):
+                if _overlaps(box, other):
+                    out[i] = (min(box[0], other[0]), max(box[1], other[1]),
+                              min(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                out.append(box)
+        boxes = out
+    return boxes
+
+
+# 未指定 min_area 时按图像面积的比例取噪声阈值（1080p 约 20 像素），至少 MIN_AREA_FLOOR
+MIN_AREA_RATIO = 1e-5
+MIN_AREA_FLOOR = 4
+
+
+def roi_boxes(mask, margin=0.25, min_margin=16, min_area=None, max_rois=4):
+    """
+    由 mask 的连通域外接框得到需要放大重分割的区域。
+    每个框按自身尺寸外扩 margin（至少 min_margin 像素）并裁剪到图像边界，
+    重叠的框合并为一个；面积小于 min_area 的连通域视为噪声不单独处理。
+    min_area 为 None 时按图像面积的 MIN_AREA_RATIO 计算；所有连通域都小于阈值时
+    保留面积最大的一个——小目标本身就是这个工具要放大的对象。
+    返回 [(y0, y1, x0, x1), ...]，按面积从大到小至多 max_rois 个；空 mask 返回 []。
+    """
+    m = (np.asarray(mask) > 0).astype(np.uint8)
+    if m.ndim == 3:
+        m = m[..., 0]
+    H, W = m.shape
+    if min_area is None:
+        min_area = max(MIN_AREA_FLOOR, int(H * W * MIN_AREA_RATIO))
+
+    num_labels, _, stats, _ = cv2.connectedComponentsWithStats(m)
+    rows = [row for row in stats[1:] if row[cv2.CC_STAT_AREA] >= min_area]
+    if not rows and num_labels > 1:
+        rows = [max(stats[1:], key=lambda row: row[cv2.CC_STAT_AREA])]
+
+    boxes = []
+    for row in rows:
+        x, y, w, h, _ = (int(v) for v in row)
+        py = max(min_margin, int(round(h * margin)))
+        px = max(min_margin, int(round(w * margin)))
+        boxes.append((max(0, y - py), min(H, y + h + py), max(0, x - px), min(W, x + w + px)))
+
+    boxes = merge_boxes(boxes)
+    boxes.sort(key=lambda b: (b[1] - b[0]) * (b[3] - b[2]), reverse=True)
+    return boxes[:max_rois]
+
+
+def zoom_factor(h, w, zoom_side=1024, max_zoom=4.0):
+    """把长边放大到 zoom_side 的倍数（不缩小，至多 max_zoom 倍）"""
+    return float(min(max_zoom, max(1.0, zoom_side / max(h, w))))